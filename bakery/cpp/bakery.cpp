@@ -1,9 +1,24 @@
+#include <algorithm>
 #include <atomic>
 #include <chrono>
 #include <cstdint>
+#include <cstdlib>
 #include <iostream>
+#include <latch>
+#include <mutex>
+#include <numeric>
+#include <new>
+#include <sstream>
+#include <string>
 #include <thread>
 #include <vector>
+#include <time.h>
+
+#include "bakery_padded.h"
+
+#if defined(__x86_64__) || defined(__i386__)
+#include <immintrin.h>
+#endif
 
 /*-----------------------------------------------------------
    Lamport's bakery algorithm
@@ -231,50 +246,385 @@ private:
     std::vector<std::atomic<std::size_t>>   number;    // ticket values
 };
 
-bool parse_positive(char const* s, std::size_t& out)
+// bakery_mutex_padded (and cache_line_size) live in bakery_padded.h, bakery_shm.cpp uses the same lock
+
+class bakery_mutex_counter
 {
-    char* end = nullptr;
-    unsigned long long v = std::strtoull(s, &end, 10);
-    if (end && *end == '\0' && v > 0) {
-        out = static_cast<std::size_t>(v);
-        return true;
-    } else {
-        return false;
+public:
+    explicit bakery_mutex_counter(std::size_t n)
+        : slots(n)
+    {
+        for (auto& s : slots) {
+            s.choosing.store(false, std::memory_order_relaxed);
+            s.number.store(0,       std::memory_order_relaxed);
+        }
     }
+
+    std::size_t lock(std::size_t id)
+    {
+        auto my_ticket = announce_intent(id); // choose ticket
+        wait_acquire(id, my_ticket);          // wait for turn
+        return my_ticket;                     // critical section may begin
+    }
+
+    void unlock(std::size_t id)
+    {
+        slots[id].number.store(0, std::memory_order_release); // release ticket
+    }
+
+private:
+    struct alignas(cache_line_size) slot
+    {
+        std::atomic<bool>        choosing;  // true = thread is in doorway
+        std::atomic<std::size_t> number;    // ticket value
+    };
+
+    std::size_t announce_intent(std::size_t id)
+    {
+        slots[id].choosing.store(true, std::memory_order_relaxed);
+        std::atomic_thread_fence(std::memory_order_seq_cst);
+        // O(1) doorway: instead of 1 + max(number) over all n slots, draw from a shared counter.
+        // Tickets are unique and grow in doorway order, so first-come-first-served still holds
+        // (and ties never happen). A plain-store "max seen" hint is not enough: a slow thread
+        // could move it backwards and a later thread would get a smaller ticket than one in the CS
+        std::size_t my_ticket = next_ticket.fetch_add(1, std::memory_order_relaxed) + 1;
+        slots[id].number.store(my_ticket, std::memory_order_relaxed);
+        slots[id].choosing.store(false, std::memory_order_release);  // done choosing
+        std::atomic_thread_fence(std::memory_order_seq_cst);
+        return my_ticket;
+    }
+
+    void wait_acquire(std::size_t id, std::size_t ti)
+    {
+        // still n slots to check: an O(1) wait needs a hand-off from the previous owner, which is ticket_mutex
+        const std::size_t n = slots.size();
+        for (std::size_t j = 0; j < n; ++j) {
+            if (j == id) continue;
+            // wait while j is still choosing
+            while (slots[j].choosing.load(std::memory_order_acquire))
+                std::this_thread::yield();
+            // wait while j holds a smaller ticket
+            while (true) {
+                std::size_t tj = slots[j].number.load(std::memory_order_acquire);
+                if (tj == 0 || tj > ti) break;
+                std::this_thread::yield();
+            }
+        }
+    }
+
+    alignas(cache_line_size) std::atomic<std::size_t> next_ticket{0};
+    std::vector<slot> slots;
+};
+
+// CPU hint for spin loops: lets the sibling hyperthread run and saves power while we poll
+static inline void cpu_relax()
+{
+#if defined(__x86_64__) || defined(__i386__)
+    _mm_pause();
+#elif defined(__aarch64__)
+    asm volatile("yield");
+#endif
 }
 
-int main(int argc, char* argv[])
+// spins before parking, a few microseconds of pause instructions; with more threads than cores
+// the thread we wait for may not be running at all, so spinning only delays it: park at once
+constexpr std::size_t DEFAULT_SPIN_LIMIT = 1000;
+
+inline std::size_t default_spin_limit(std::size_t num_threads)
 {
-    constexpr std::size_t DEFAULT_THREADS = 16;
-    constexpr std::size_t DEFAULT_LOOPS   = 1000*1000;
+    return num_threads > std::thread::hardware_concurrency() ? 0 : DEFAULT_SPIN_LIMIT;
+}
+
+class bakery_mutex_parking
+{
+public:
+    // spin_limit = 0 parks right away, a huge spin_limit never parks
+    explicit bakery_mutex_parking(std::size_t n)
+        : bakery_mutex_parking(n, default_spin_limit(n))
+    {
+    }
+
+    bakery_mutex_parking(std::size_t n, std::size_t spin_limit)
+        : slots(n), spin_limit(spin_limit)
+    {
+        for (auto& s : slots) {
+            s.choosing.store(false, std::memory_order_relaxed);
+            s.number.store(0,       std::memory_order_relaxed);
+            s.seq.store(0,          std::memory_order_relaxed);
+            s.waiters.store(0,      std::memory_order_relaxed);
+        }
+    }
+
+    std::size_t lock(std::size_t id)
+    {
+        auto my_ticket = announce_intent(id); // choose ticket
+        wait_acquire(id, my_ticket);          // wait for turn
+        return my_ticket;                     // critical section may begin
+    }
+
+    void unlock(std::size_t id)
+    {
+        // seq_cst exchange instead of a release store: orders our 0 before the waiters check in wake()
+        slots[id].number.exchange(0, std::memory_order_seq_cst); // release ticket
+        wake(slots[id]);
+    }
+
+private:
+    // same layout idea as bakery_mutex_padded, plus a 32 bit futex word (seq) that the owner bumps
+    // when it changes choosing/number while somebody is parked on the slot
+    struct alignas(cache_line_size) slot
+    {
+        std::atomic<bool>           choosing;  // true = thread is in doorway
+        std::atomic<std::size_t>    number;    // ticket value
+        std::atomic<std::uint32_t>  seq;       // bumped to wake parked waiters
+        std::atomic<std::uint32_t>  waiters;   // threads parked (or about to park) on this slot
+    };
+
+    std::size_t get_max_ticket() const
+    {
+        std::size_t max_ticket = 0;
+        for (const auto& s : slots)
+            max_ticket = std::max(max_ticket, s.number.load(std::memory_order_relaxed));
+        return max_ticket;
+    }
+
+    std::size_t announce_intent(std::size_t id)
+    {
+        slots[id].choosing.store(true, std::memory_order_relaxed);
+        std::atomic_thread_fence(std::memory_order_seq_cst);
+        // pick ticket = 1 + max(number)
+        std::size_t my_ticket = get_max_ticket() + 1;
+        slots[id].number.store(my_ticket, std::memory_order_relaxed);
+        slots[id].choosing.store(false, std::memory_order_release);  // done choosing
+        std::atomic_thread_fence(std::memory_order_seq_cst);
+        wake(slots[id]);
+        return my_ticket;
+    }
+
+    // called by the owner after changing its slot, behind a seq_cst fence or RMW:
+    // a waiter either sees the change when it re-checks after registering, or is counted here;
+    // no syscall unless somebody is actually parked on this slot
+    static void wake(slot& s)
+    {
+        if (s.waiters.load(std::memory_order_seq_cst) > 0) {
+            s.seq.fetch_add(1, std::memory_order_seq_cst);
+            s.seq.notify_all();
+        }
+    }
+
+    template <typename Ready>
+    void wait_until(slot& s, Ready ready)
+    {
+        for (std::size_t i = 0; i < spin_limit; ++i) {
+            if (ready(std::memory_order_acquire)) return;
+            cpu_relax();
+        }
+        while (true) {
+            auto seq = s.seq.load(std::memory_order_seq_cst);
+            if (ready(std::memory_order_seq_cst)) return;
+            s.waiters.fetch_add(1, std::memory_order_seq_cst);
+            // re-check after registering, the owner may have changed the slot before it saw us
+            if (ready(std::memory_order_seq_cst)) {
+                s.waiters.fetch_sub(1, std::memory_order_relaxed);
+                return;
+            }
+            s.seq.wait(seq, std::memory_order_seq_cst); // returns at once if seq already moved on
+            s.waiters.fetch_sub(1, std::memory_order_relaxed);
+        }
+    }
+
+    void wait_acquire(std::size_t id, std::size_t ti)
+    {
+        const std::size_t n = slots.size();
+        for (std::size_t j = 0; j < n; ++j) {
+            if (j == id) continue;
+            slot& sj = slots[j];
+            // wait while j is still choosing
+            wait_until(sj, [&](std::memory_order order) { return !sj.choosing.load(order); });
+            // wait while (ticket[j], j) < (ticket[i], i)
+            wait_until(sj, [&](std::memory_order order) {
+                std::size_t tj = sj.number.load(order);
+                return tj == 0 || tj > ti || (tj == ti && j > id);
+            });
+        }
+    }
+
+    std::vector<slot> slots;
+    std::size_t       spin_limit;
+};
 
-    std::size_t num_threads = DEFAULT_THREADS;
-    std::size_t num_loops   = DEFAULT_LOOPS;
+/*-----------------------------------------------------------
+   Baselines, same lock(id)/unlock(id) interface
+-----------------------------------------------------------*/
 
-    if (argc >= 2 && !parse_positive(argv[1], num_threads)) {
-        std::cerr << "Usage: " << argv[0] << " [n_threads] [iterations]\n";
-        return 1;
+class std_mutex
+{
+public:
+    explicit std_mutex(std::size_t) {}
+
+    std::size_t lock(std::size_t)
+    {
+        mtx.lock();
+        return 0;
     }
-    if (argc >= 3 && !parse_positive(argv[2], num_loops)) {
-        std::cerr << "Usage: " << argv[0] << " [n_threads] [iterations]\n";
-        return 1;
+
+    void unlock(std::size_t)
+    {
+        mtx.unlock();
+    }
+
+private:
+    std::mutex mtx;
+};
+
+class ticket_mutex
+{
+public:
+    explicit ticket_mutex(std::size_t) {}
+
+    std::size_t lock(std::size_t)
+    {
+        auto my_ticket = next_ticket.fetch_add(1, std::memory_order_relaxed);
+        while (now_serving.load(std::memory_order_acquire) != my_ticket)
+            std::this_thread::yield();
+        return my_ticket + 1;
+    }
+
+    void unlock(std::size_t)
+    {
+        // only the owner writes now_serving
+        now_serving.store(now_serving.load(std::memory_order_relaxed) + 1, std::memory_order_release);
     }
 
-    bakery_mutex_naive mtx{num_threads};
-    //bakery_mutex_atomic mtx{num_threads};
-    //bakery_mutex_bounded mtx{num_threads, 1u << 16};
+private:
+    alignas(cache_line_size) std::atomic<std::size_t> next_ticket{0};
+    alignas(cache_line_size) std::atomic<std::size_t> now_serving{0};
+};
+
+class mcs_mutex
+{
+public:
+    explicit mcs_mutex(std::size_t n)
+        : nodes(n)
+    {
+    }
+
+    std::size_t lock(std::size_t id)
+    {
+        node& me = nodes[id];
+        me.next.store(nullptr, std::memory_order_relaxed);
+        me.locked.store(true,  std::memory_order_relaxed);
+        node* prev = tail.exchange(&me, std::memory_order_acq_rel);
+        if (prev != nullptr) {
+            // queue behind prev and spin on our own cache line until it hands over
+            prev->next.store(&me, std::memory_order_release);
+            while (me.locked.load(std::memory_order_acquire))
+                std::this_thread::yield();
+        }
+        return 0;
+    }
+
+    void unlock(std::size_t id)
+    {
+        node& me = nodes[id];
+        node* succ = me.next.load(std::memory_order_acquire);
+        if (succ == nullptr) {
+            node* expected = &me;
+            if (tail.compare_exchange_strong(expected, nullptr, std::memory_order_release, std::memory_order_relaxed))
+                return; // nobody waiting
+            // a successor swapped itself into tail but hasn't linked itself yet
+            while ((succ = me.next.load(std::memory_order_acquire)) == nullptr)
+                std::this_thread::yield();
+        }
+        succ->locked.store(false, std::memory_order_release);
+    }
+
+private:
+    struct alignas(cache_line_size) node
+    {
+        std::atomic<node*> next;
+        std::atomic<bool>  locked;
+    };
+
+    alignas(cache_line_size) std::atomic<node*> tail{nullptr};
+    std::vector<node> nodes;
+};
+
+/*-----------------------------------------------------------
+   Benchmark
+-----------------------------------------------------------*/
+
+// timing every acquisition would dominate short critical sections, sample every k-th
+constexpr std::size_t LATENCY_SAMPLE_EVERY = 16;
+
+struct bench_result
+{
+    double        seconds;
+    double        cpu_seconds;  // summed over threads: spinning burns it, parking doesn't
+    double        locks_per_sec;
+    double        p50_ns;       // lock() latency, sampled
+    double        p99_ns;
+    std::size_t   max_ticket;
+    bool          passed;
+};
+
+double percentile(std::vector<std::uint64_t>& values, double p)
+{
+    if (values.empty())
+        return 0;
+    auto k = std::min(values.size() - 1, static_cast<std::size_t>(p / 100 * values.size()));
+    std::nth_element(values.begin(), values.begin() + k, values.end());
+    return static_cast<double>(values[k]);
+}
 
+template <typename Mutex>
+bench_result run_benchmark(Mutex& mtx, std::size_t num_threads, std::size_t num_loops, std::size_t num_warmup)
+{
     std::uint64_t shared_counter = 0;
     std::size_t   max_ticket     = 0;
+    std::vector<std::vector<std::uint64_t>> latencies(num_threads);
+    std::latch warmed_up{static_cast<std::ptrdiff_t>(num_threads)};
+    // wall clock from the first thread starting the measured part to the last one finishing,
+    // taken by the workers: when oversubscribed, main may not even run until they are done
+    using clock = std::chrono::steady_clock;
+    std::vector<clock::time_point> started(num_threads), finished(num_threads);
+    std::vector<double> cpu_seconds(num_threads);
+
+    auto thread_cpu_seconds = []
+    {
+        timespec ts;
+        clock_gettime(CLOCK_THREAD_CPUTIME_ID, &ts);
+        return ts.tv_sec + ts.tv_nsec * 1e-9;
+    };
 
     auto worker = [&](std::size_t id)
     {
+        for (std::size_t k = 0; k < num_warmup; ++k) {
+            mtx.lock(id);
+            ++shared_counter;                   // critical section
+            mtx.unlock(id);
+        }
+        auto& samples = latencies[id];
+        samples.reserve(num_loops / LATENCY_SAMPLE_EVERY + 1);
+        warmed_up.arrive_and_wait();            // everybody starts the measured part together
+        started[id] = clock::now();
+        auto cpu_started = thread_cpu_seconds();
         for (std::size_t k = 0; k < num_loops; ++k) {
-            std::size_t t = mtx.lock(id);
+            std::size_t t;
+            if (k % LATENCY_SAMPLE_EVERY == 0) {
+                auto before = clock::now();
+                t = mtx.lock(id);
+                auto after = clock::now();
+                samples.push_back(std::chrono::duration_cast<std::chrono::nanoseconds>(after - before).count());
+            } else {
+                t = mtx.lock(id);
+            }
             ++shared_counter;                   // critical section
             max_ticket = std::max(max_ticket, t);
             mtx.unlock(id);
         }
+        finished[id] = clock::now();
+        cpu_seconds[id] = thread_cpu_seconds() - cpu_started;
     };
 
     std::vector<std::thread> threads;
@@ -283,16 +633,163 @@ int main(int argc, char* argv[])
         threads.emplace_back(worker, i);
 
     for (auto& t : threads) t.join();
+    std::chrono::duration<double> elapsed =
+        *std::max_element(finished.begin(), finished.end()) - *std::min_element(started.begin(), started.end());
+
+    std::vector<std::uint64_t> all;
+    for (auto& samples : latencies)
+        all.insert(all.end(), samples.begin(), samples.end());
+    auto expected = num_threads * (num_warmup + num_loops);
+    return bench_result{
+        elapsed.count(),
+        std::accumulate(cpu_seconds.begin(), cpu_seconds.end(), 0.0),
+        num_threads * num_loops / elapsed.count(),
+        percentile(all, 50),
+        percentile(all, 99),
+        max_ticket,
+        expected == shared_counter,
+    };
+}
 
-    auto expected = num_threads * num_loops;
-    auto good = expected == shared_counter;
-    std::cout << "Threads:    " << num_threads         << '\n'
-              << "Iterations: " << num_loops           << '\n'
-              << "Expected:   " << expected            << '\n'
-              << "Observed:   " << shared_counter      << '\n'
-              << "Max ticket: " << max_ticket          << '\n'
-              << (good ? "Passed!" : "FAILED!")        << '\n'
-              ;
+const std::vector<std::string> MUTEX_NAMES = {"naive", "atomic", "bounded", "padded", "parking", "counter", "std", "ticket", "mcs"};
+
+bool run_named(const std::string& name, std::size_t num_threads, std::size_t num_loops, std::size_t num_warmup,
+               std::size_t spin_limit, bench_result& out)
+{
+    if (name == "naive")        { bakery_mutex_naive   mtx{num_threads};          out = run_benchmark(mtx, num_threads, num_loops, num_warmup); }
+    else if (name == "atomic")  { bakery_mutex_atomic  mtx{num_threads};          out = run_benchmark(mtx, num_threads, num_loops, num_warmup); }
+    else if (name == "bounded") { bakery_mutex_bounded mtx{num_threads, 1u << 16}; out = run_benchmark(mtx, num_threads, num_loops, num_warmup); }
+    else if (name == "padded")  { bakery_mutex_padded<> mtx{num_threads};         out = run_benchmark(mtx, num_threads, num_loops, num_warmup); }
+    else if (name == "counter") { bakery_mutex_counter mtx{num_threads};          out = run_benchmark(mtx, num_threads, num_loops, num_warmup); }
+    else if (name == "parking") { bakery_mutex_parking mtx{num_threads, spin_limit}; out = run_benchmark(mtx, num_threads, num_loops, num_warmup); }
+    else if (name == "std")     { std_mutex            mtx{num_threads};          out = run_benchmark(mtx, num_threads, num_loops, num_warmup); }
+    else if (name == "ticket")  { ticket_mutex         mtx{num_threads};          out = run_benchmark(mtx, num_threads, num_loops, num_warmup); }
+    else if (name == "mcs")     { mcs_mutex            mtx{num_threads};          out = run_benchmark(mtx, num_threads, num_loops, num_warmup); }
+    else return false;
+    return true;
+}
+
+bool parse_positive(char const* s, std::size_t& out)
+{
+    char* end = nullptr;
+    unsigned long long v = std::strtoull(s, &end, 10);
+    if (end && *end == '\0' && v > 0) {
+        out = static_cast<std::size_t>(v);
+        return true;
+    } else {
+        return false;
+    }
+}
+
+std::vector<std::string> split(const std::string& s, char sep)
+{
+    std::vector<std::string> parts;
+    std::stringstream ss(s);
+    std::string part;
+    while (std::getline(ss, part, sep))
+        parts.push_back(part);
+    return parts;
+}
+
+int usage(char const* prog)
+{
+    std::cerr << "Usage: " << prog << " [--mutex=name[,name...]|all] [--warmup=n] [--spin=n] [--csv] [n_threads[,n_threads...]] [iterations]\n"
+              << "  mutexes: naive, atomic, bounded, padded, parking, counter, std, ticket, mcs (default: atomic)\n"
+              << "  --spin:  pause-loop iterations before parking, for parking (default " << DEFAULT_SPIN_LIMIT
+              << ", or 0 = park at once with more threads than cores)\n"
+              << "  e.g.     " << prog << " --mutex=all --csv 2,4,8,16,32,64 100000\n";
+    return 1;
+}
+
+int main(int argc, char* argv[])
+{
+    constexpr std::size_t DEFAULT_THREADS = 16;
+    constexpr std::size_t DEFAULT_LOOPS   = 1000*1000;
+
+    std::vector<std::string> mutexes{"atomic"};
+    std::vector<std::size_t> thread_counts{DEFAULT_THREADS};
+    std::size_t num_loops  = DEFAULT_LOOPS;
+    std::size_t num_warmup = 0;        // default: a tenth of the iterations
+    std::size_t spin_limit = 0;
+    bool        spin_auto  = true;     // default_spin_limit(threads)
+    bool        csv        = false;
+
+    std::vector<std::string> positional;
+    for (int i = 1; i < argc; ++i) {
+        std::string arg = argv[i];
+        if (arg.rfind("--mutex=", 0) == 0) {
+            mutexes = arg.substr(8) == "all" ? MUTEX_NAMES : split(arg.substr(8), ',');
+        } else if (arg.rfind("--warmup=", 0) == 0) {
+            if (!parse_positive(arg.c_str() + 9, num_warmup))
+                return usage(argv[0]);
+        } else if (arg.rfind("--spin=", 0) == 0) {
+            spin_auto = false;
+            if (arg == "--spin=0")
+                spin_limit = 0;
+            else if (!parse_positive(arg.c_str() + 7, spin_limit))
+                return usage(argv[0]);
+        } else if (arg == "--csv") {
+            csv = true;
+        } else if (arg.rfind("--", 0) == 0) {
+            return usage(argv[0]);
+        } else {
+            positional.push_back(arg);
+        }
+    }
+    if (positional.size() > 2)
+        return usage(argv[0]);
+    if (positional.size() >= 1) {
+        thread_counts.clear();
+        for (const auto& part : split(positional[0], ',')) {
+            std::size_t t;
+            if (!parse_positive(part.c_str(), t))
+                return usage(argv[0]);
+            thread_counts.push_back(t);
+        }
+    }
+    if (positional.size() >= 2 && !parse_positive(positional[1].c_str(), num_loops))
+        return usage(argv[0]);
+    if (num_warmup == 0)
+        num_warmup = num_loops / 10;
+
+    if (csv)
+        std::cout << "mutex,threads,iterations,seconds,cpu_seconds,locks_per_sec,p50_ns,p99_ns,max_ticket,passed\n";
+    bool all_good = true;
+    for (std::size_t num_threads : thread_counts) {
+        for (const auto& name : mutexes) {
+            bench_result r;
+            auto spin = spin_auto ? default_spin_limit(num_threads) : spin_limit;
+            if (!run_named(name, num_threads, num_loops, num_warmup, spin, r)) {
+                std::cerr << "Unknown mutex: " << name << '\n';
+                return usage(argv[0]);
+            }
+            all_good = all_good && r.passed;
+            if (csv) {
+                std::cout << name << ',' << num_threads << ',' << num_loops << ',' << r.seconds << ','
+                          << r.cpu_seconds << ',' << r.locks_per_sec << ',' << r.p50_ns << ',' << r.p99_ns << ','
+                          << r.max_ticket << ',' << (r.passed ? 1 : 0) << std::endl;
+            } else {
+                std::cout << "Mutex:      " << name                << '\n'
+                          << "Threads:    " << num_threads         << '\n'
+                          << "Iterations: " << num_loops           << " (+" << num_warmup << " warm-up)\n"
+                          << "Max ticket: " << r.max_ticket        << '\n'
+                          << "Seconds:    " << r.seconds           << '\n'
+                          << "CPU:        " << r.cpu_seconds       << " s\n"
+                          << "Locks/s:    " << r.locks_per_sec     << '\n'
+                          << "Lock p50:   " << r.p50_ns            << " ns\n"
+                          << "Lock p99:   " << r.p99_ns            << " ns\n"
+                          << (r.passed ? "Passed!" : "FAILED!")    << "\n\n"
+                          ;
+            }
+        }
+    }
+    return all_good ? 0 : 2;
 }
 
 // g++ -std=c++20 -O3 -flto -march=native -DNDEBUG -pthread bakery.cpp -o bakery
+// ./bakery --mutex=all --csv 2,4,8,16,32,64 100000 > results.csv
+// oversubscribed, e.g. 64 threads on 8 cores: spinning vs parking, compare cpu_seconds
+// ./bakery --mutex=padded,parking --csv 64 10000
+// ./bakery --mutex=parking --spin=0 --csv 64 10000
+// scaling of the doorway: O(n) max scan vs shared ticket counter
+// ./bakery --mutex=padded,counter,ticket,mcs --csv 2,4,8,16,32,64,128 10000
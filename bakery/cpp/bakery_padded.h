@@ -0,0 +1,106 @@
+#pragma once
+
+#include <algorithm>
+#include <atomic>
+#include <cstddef>
+#include <span>
+#include <thread>
+#include <type_traits>
+#include <vector>
+
+// the cache-line padded bakery lock, shared by bakery.cpp (threads, slots in a std::vector)
+// and bakery_shm.cpp (processes, slots in a POSIX shared memory segment)
+
+// fixed, not std::hardware_destructive_interference_size: the padding is part of the shared memory layout,
+// which processes built with other compilers or flags must agree on (g++ warns about it, -Winterference-size);
+// 64 bytes is the line size of x86-64 and most ARM cores
+constexpr std::size_t cache_line_size = 64;
+
+// each thread's choosing/number pair on its own cache line: only the owner writes it,
+// so a ticket write doesn't invalidate the line other threads' slots live on
+struct alignas(cache_line_size) bakery_padded_slot
+{
+    std::atomic<bool>        choosing;  // true = thread is in doorway
+    std::atomic<std::size_t> number;    // ticket value
+};
+static_assert(sizeof(bakery_padded_slot) == cache_line_size, "one slot per cache line");
+
+// Slots is where the slots live: anything with size() and operator[], a std::vector that the lock
+// owns by default, or e.g. a std::span over memory someone else zero-filled and maps
+template <typename Slots = std::vector<bakery_padded_slot>>
+class bakery_mutex_padded
+{
+public:
+    explicit bakery_mutex_padded(std::size_t n) requires std::is_same_v<Slots, std::vector<bakery_padded_slot>>
+        : slots(n)
+    {
+        for (auto& s : slots) {
+            s.choosing.store(false, std::memory_order_relaxed);
+            s.number.store(0,       std::memory_order_relaxed);
+        }
+    }
+
+    // slots that are already initialized (choosing = false, number = 0), and may already be in use
+    explicit bakery_mutex_padded(Slots slots)
+        : slots(slots)
+    {}
+
+    std::size_t lock(std::size_t id)
+    {
+        auto my_ticket = announce_intent(id); // choose ticket
+        wait_acquire(id, my_ticket);          // wait for turn
+        return my_ticket;                     // critical section may begin
+    }
+
+    void unlock(std::size_t id)
+    {
+        // release: the critical section happens-before the next owner's acquire load of our 0
+        slots[id].number.store(0, std::memory_order_release); // release ticket
+    }
+
+private:
+    std::size_t get_max_ticket() const
+    {
+        std::size_t max_ticket = 0;
+        for (std::size_t j = 0; j < slots.size(); ++j)
+            max_ticket = std::max(max_ticket, slots[j].number.load(std::memory_order_relaxed));
+        return max_ticket;
+    }
+
+    std::size_t announce_intent(std::size_t id)
+    {
+        slots[id].choosing.store(true, std::memory_order_relaxed);
+        // store-load: others must see us choosing before we read their tickets,
+        // or two threads can both miss each other and pick the same ticket unnoticed
+        std::atomic_thread_fence(std::memory_order_seq_cst);
+        // pick ticket = 1 + max(number)
+        std::size_t my_ticket = get_max_ticket() + 1;
+        slots[id].number.store(my_ticket, std::memory_order_relaxed);
+        // release: whoever sees choosing == false also sees our ticket
+        slots[id].choosing.store(false, std::memory_order_release);  // done choosing
+        // store-load: our ticket must be visible before we read theirs in wait_acquire
+        std::atomic_thread_fence(std::memory_order_seq_cst);
+        return my_ticket;
+    }
+
+    void wait_acquire(std::size_t id, std::size_t ti)
+    {
+        const std::size_t n = slots.size();
+        for (std::size_t j = 0; j < n; ++j) {
+            if (j == id) continue;
+            // wait while j is still choosing
+            while (slots[j].choosing.load(std::memory_order_acquire))
+                std::this_thread::yield();
+            // wait while (ticket[j], j) < (ticket[i], i), our own ticket doesn't change while we wait
+            while (true) {
+                std::size_t tj = slots[j].number.load(std::memory_order_acquire);
+                if (tj == 0) break;
+                if (tj >  ti) break;
+                if (tj == ti && j > id) break;
+                std::this_thread::yield();
+            }
+        }
+    }
+
+    Slots slots;
+};
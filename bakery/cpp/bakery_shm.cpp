@@ -0,0 +1,304 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include <atomic>
+#include <cerrno>
+#include <cstdint>
+#include <cstring>
+#include <new>
+#include <string>
+#include <thread>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include "bakery_padded.h"
+
+// Python extension: the cache-line padded bakery lock of bakery.cpp (bakery_mutex_padded, bakery_padded.h),
+// with its slots in a POSIX shared memory segment instead of a std::vector, so separate
+// Python processes on one host can take turns; each process passes its own id in 0..n-1
+//
+//   import bakery_shm
+//   lock = bakery_shm.Bakery("/dca-bakery", n, create=True)  # once, in the parent
+//   lock = bakery_shm.Bakery("/dca-bakery")                  # in every worker
+//   ticket = lock.lock(my_id)
+//   ...critical section...
+//   lock.unlock(my_id)
+
+// other processes map the segment at a different address, the atomics must not need a side table
+static_assert(std::atomic<bool>::is_always_lock_free,        "choosing must be address-free");
+static_assert(std::atomic<std::size_t>::is_always_lock_free, "number must be address-free");
+
+constexpr std::uint64_t SEGMENT_MAGIC = 0x62616b6572790001; // "bakery", layout version 1
+
+struct alignas(cache_line_size) segment_header
+{
+    std::uint64_t magic;
+    std::uint64_t n;
+};
+
+// the lock from bakery_padded.h, on slots right after the header;
+// ftruncate zero-fills, which is choosing = false, number = 0
+using bakery_mutex_shm = bakery_mutex_padded<std::span<bakery_padded_slot>>;
+
+static std::size_t segment_size(std::size_t n)
+{
+    return sizeof(segment_header) + n * sizeof(bakery_padded_slot);
+}
+
+static bakery_padded_slot* segment_slots(void* base)
+{
+    return reinterpret_cast<bakery_padded_slot*>(static_cast<char*>(base) + sizeof(segment_header));
+}
+
+// Python wrapper
+
+struct BakeryObject
+{
+    PyObject_HEAD
+    void*             base;
+    std::size_t       size;
+    bakery_mutex_shm* mutex;
+    std::size_t       n;
+    PyObject*         name;
+    std::size_t       busy;  // lock() calls waiting without the GIL, the segment must stay mapped for them
+};
+
+static PyObject* raise_errno(const char* what, const char* name)
+{
+    std::string msg = std::string(what) + " " + name + ": " + std::strerror(errno);
+    PyErr_SetString(PyExc_OSError, msg.c_str());
+    return nullptr;
+}
+
+static bool check_idle(BakeryObject* self)
+{
+    if (self->busy != 0) {
+        PyErr_SetString(PyExc_BufferError, "lock() is still waiting in another thread, can't unmap the segment");
+        return false;
+    }
+    return true;
+}
+
+static void unmap(BakeryObject* self)
+{
+    delete self->mutex;
+    self->mutex = nullptr;
+    if (self->base != nullptr)
+        munmap(self->base, self->size);
+    self->base = nullptr;
+}
+
+static int Bakery_init(BakeryObject* self, PyObject* args, PyObject* kwargs)
+{
+    static const char* kwlist[] = {"name", "n", "create", nullptr};
+    const char* name = nullptr;
+    Py_ssize_t  n = 0;
+    int         create = 0;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s|np", const_cast<char**>(kwlist), &name, &n, &create))
+        return -1;
+    if (create && n <= 0) {
+        PyErr_SetString(PyExc_ValueError, "n must be positive when creating the segment");
+        return -1;
+    }
+    if (!check_idle(self))
+        return -1;
+    unmap(self);
+
+    int fd = shm_open(name, create ? (O_RDWR | O_CREAT | O_TRUNC) : O_RDWR, 0600);
+    if (fd < 0) {
+        raise_errno("shm_open", name);
+        return -1;
+    }
+    std::size_t size = 0;
+    if (create) {
+        size = segment_size(n);
+        if (ftruncate(fd, size) != 0) {
+            raise_errno("ftruncate", name);
+            close(fd);
+            return -1;
+        }
+    }
+    else {
+        struct stat st;
+        if (fstat(fd, &st) != 0) {
+            raise_errno("fstat", name);
+            close(fd);
+            return -1;
+        }
+        size = st.st_size;
+    }
+    if (size < sizeof(segment_header)) {
+        PyErr_Format(PyExc_ValueError, "%s is not a bakery segment", name);
+        close(fd);
+        return -1;
+    }
+    void* base = mmap(nullptr, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (base == MAP_FAILED) {
+        raise_errno("mmap", name);
+        return -1;
+    }
+
+    auto* header = static_cast<segment_header*>(base);
+    if (create) {
+        header->n = n;
+        header->magic = SEGMENT_MAGIC;
+    }
+    std::size_t segment_n = header->n;
+    if (header->magic != SEGMENT_MAGIC || segment_size(segment_n) > size) {
+        munmap(base, size);
+        PyErr_Format(PyExc_ValueError, "%s is not a bakery segment", name);
+        return -1;
+    }
+    if (n != 0 && static_cast<std::size_t>(n) != segment_n) {
+        munmap(base, size);
+        PyErr_Format(PyExc_ValueError, "%s was created for %zu processes, not %zd", name, segment_n, n);
+        return -1;
+    }
+
+    self->base  = base;
+    self->size  = size;
+    self->n     = segment_n;
+    self->mutex = new bakery_mutex_shm(std::span(segment_slots(base), self->n));
+    Py_XSETREF(self->name, PyUnicode_FromString(name));
+    return self->name == nullptr ? -1 : 0;
+}
+
+static void Bakery_dealloc(BakeryObject* self)
+{
+    unmap(self);
+    Py_XDECREF(self->name);
+    Py_TYPE(self)->tp_free(reinterpret_cast<PyObject*>(self));
+}
+
+static bool check_id(BakeryObject* self, Py_ssize_t id)
+{
+    if (self->mutex == nullptr) {
+        PyErr_SetString(PyExc_ValueError, "bakery segment is closed");
+        return false;
+    }
+    if (id < 0 || static_cast<std::size_t>(id) >= self->n) {
+        PyErr_Format(PyExc_ValueError, "id must be in 0..%zu", self->n - 1);
+        return false;
+    }
+    return true;
+}
+
+static PyObject* Bakery_lock(BakeryObject* self, PyObject* arg)
+{
+    Py_ssize_t id = PyNumber_AsSsize_t(arg, PyExc_OverflowError);
+    if (id == -1 && PyErr_Occurred())
+        return nullptr;
+    if (!check_id(self, id))
+        return nullptr;
+    std::size_t ticket;
+    // waiting can take long: let the other Python threads of this process run meanwhile,
+    // busy (only touched with the GIL held) keeps them from unmapping the slots under us
+    ++self->busy;
+    Py_BEGIN_ALLOW_THREADS
+    ticket = self->mutex->lock(id);
+    Py_END_ALLOW_THREADS
+    --self->busy;
+    return PyLong_FromSize_t(ticket);
+}
+
+static PyObject* Bakery_unlock(BakeryObject* self, PyObject* arg)
+{
+    Py_ssize_t id = PyNumber_AsSsize_t(arg, PyExc_OverflowError);
+    if (id == -1 && PyErr_Occurred())
+        return nullptr;
+    if (!check_id(self, id))
+        return nullptr;
+    self->mutex->unlock(id);
+    Py_RETURN_NONE;
+}
+
+static PyObject* Bakery_close(BakeryObject* self, PyObject*)
+{
+    if (!check_idle(self))
+        return nullptr;
+    unmap(self);
+    Py_RETURN_NONE;
+}
+
+static PyObject* Bakery_unlink(BakeryObject* self, PyObject*)
+{
+    if (self->name == nullptr)
+        Py_RETURN_NONE;
+    const char* name = PyUnicode_AsUTF8(self->name);
+    if (name == nullptr)
+        return nullptr;
+    if (shm_unlink(name) != 0 && errno != ENOENT)
+        return raise_errno("shm_unlink", name);
+    Py_RETURN_NONE;
+}
+
+static PyObject* Bakery_get_n(BakeryObject* self, void*)
+{
+    return PyLong_FromSize_t(self->n);
+}
+
+static PyObject* Bakery_get_name(BakeryObject* self, void*)
+{
+    if (self->name == nullptr)
+        Py_RETURN_NONE;
+    return Py_NewRef(self->name);
+}
+
+static PyMethodDef Bakery_methods[] = {
+    {"lock",   reinterpret_cast<PyCFunction>(Bakery_lock),   METH_O,      "lock(id) -> ticket, blocks until process id may enter"},
+    {"unlock", reinterpret_cast<PyCFunction>(Bakery_unlock), METH_O,      "unlock(id), releases the ticket of process id"},
+    {"close",  reinterpret_cast<PyCFunction>(Bakery_close),  METH_NOARGS, "unmap the segment, not while lock() waits in another thread"},
+    {"unlink", reinterpret_cast<PyCFunction>(Bakery_unlink), METH_NOARGS, "remove the segment name, mappings stay valid"},
+    {nullptr, nullptr, 0, nullptr},
+};
+
+static PyGetSetDef Bakery_getset[] = {
+    {"n",    reinterpret_cast<getter>(Bakery_get_n),    nullptr, "number of processes", nullptr},
+    {"name", reinterpret_cast<getter>(Bakery_get_name), nullptr, "shared memory name",  nullptr},
+    {nullptr, nullptr, nullptr, nullptr, nullptr},
+};
+
+static PyTypeObject BakeryType = {
+    PyVarObject_HEAD_INIT(nullptr, 0)
+};
+
+static PyModuleDef bakery_shm_module = {
+    PyModuleDef_HEAD_INIT,
+    "bakery_shm",
+    "Lamport's bakery lock over POSIX shared memory, for processes on one host",
+    -1,
+    nullptr,
+};
+
+PyMODINIT_FUNC PyInit_bakery_shm(void)
+{
+    BakeryType.tp_name      = "bakery_shm.Bakery";
+    BakeryType.tp_doc       = "Bakery(name, n=0, create=False): bakery lock for n processes in shared memory segment name";
+    BakeryType.tp_basicsize = sizeof(BakeryObject);
+    BakeryType.tp_flags     = Py_TPFLAGS_DEFAULT;
+    BakeryType.tp_new       = PyType_GenericNew;
+    BakeryType.tp_init      = reinterpret_cast<initproc>(Bakery_init);
+    BakeryType.tp_dealloc   = reinterpret_cast<destructor>(Bakery_dealloc);
+    BakeryType.tp_methods   = Bakery_methods;
+    BakeryType.tp_getset    = Bakery_getset;
+    if (PyType_Ready(&BakeryType) < 0)
+        return nullptr;
+
+    PyObject* m = PyModule_Create(&bakery_shm_module);
+    if (m == nullptr)
+        return nullptr;
+    Py_INCREF(&BakeryType);
+    if (PyModule_AddObject(m, "Bakery", reinterpret_cast<PyObject*>(&BakeryType)) < 0) {
+        Py_DECREF(&BakeryType);
+        Py_DECREF(m);
+        return nullptr;
+    }
+    return m;
+}
+
+// build next to the Python driver:
+// g++ -std=c++20 -O3 -march=native -DNDEBUG -shared -fPIC $(python3-config --includes) bakery_shm.cpp -o ../python/bakery_shm$(python3-config --extension-suffix)
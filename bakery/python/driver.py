@@ -1,51 +1,103 @@
-import subprocess, requests, time, sys, logging
+import requests, time, sys, os, logging
 from multiprocessing import Process
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import start_cluster, stop_cluster, wait_ready, driver_args, node_url
+
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
 num_workers = 8
 num_loops   = 100
+mode        = "http" # http: bakery over HTTP workers, shm: native bakery_shm lock, compare: both
+# --fork: fork workers from this process instead of starting new interpreters, --cluster=<file>: where they run
+fork, args = driver_args(sys.argv[1:])
+if len(args) >= 1:
+    num_workers = int(args[0])
+if len(args) >= 2:
+    num_loops = int(args[1])
+if len(args) >= 3:
+    mode = args[2]
 
-if len(sys.argv) >= 2:
-    num_workers = int(sys.argv[1])
-if len(sys.argv) >= 3:
-    num_loops = int(sys.argv[2])
-
-def spawn(mod, *args):
-    return subprocess.Popen([sys.executable, mod, *map(str, args)])
+urls = [node_url(i, 7000+i) for i in range(num_workers+1)] # 0 is the increment server
 
 def wait_done(i):
-    url = f"http://127.0.0.1:{7000+i}/status"
+    url = f"{urls[i]}/status"
     while not requests.get(url).json().get("done"):
         time.sleep(0.1)
 
-def main():
-    # start increment server
-    procs = [spawn("inc_server.py")]
-    # start workers
-    for i in range(1, num_workers+1):
-        procs.append(spawn("worker.py", num_loops, i, num_workers))
-    # allow ports to open
-    time.sleep(1)
+def run_http():
     # start workers
+    started = time.perf_counter()
     for i in range(1, num_workers+1):
-        requests.post(f"http://127.0.0.1:{7000+i}/start")
+        requests.post(f"{urls[i]}/start")
     # wait until all workers have done their part
     for i in range(1, num_workers+1):
         wait_done(i)
-    # check results
-    expected = num_workers * num_loops
-    observed = requests.get("http://127.0.0.1:7000/get").json()["value"]
-    print(f"Workers:    {num_workers}")
-    print(f"Iterations: {num_loops}")
-    print(f"Expected:   {expected}")
-    print(f"Observed:   {observed}")
-    print(f"Passed!" if expected == observed else "FAILED!")
-    # clean up
-    for p in procs:
-        p.terminate()
-    for p in procs:
-        p.wait()
+    return time.perf_counter() - started
+
+def shm_worker(name, my_id):
+    # same critical section as worker.py, only the lock is different
+    import bakery_shm
+    lock = bakery_shm.Bakery(name, num_workers)
+    session = requests.Session()
+    for i in range(num_loops):
+        lock.lock(my_id - 1)
+        curr = session.get(f"{urls[0]}/get").json()["value"]
+        session.post(f"{urls[0]}/set", json={"value": curr + 1})
+        lock.unlock(my_id - 1)
+    lock.close()
+
+def run_shm():
+    # build bakery_shm first, see the end of ../cpp/bakery_shm.cpp
+    import bakery_shm
+    name = f"/dca-bakery-{time.time_ns()}"
+    lock = bakery_shm.Bakery(name, num_workers, create=True)
+    try:
+        workers = [Process(target=shm_worker, args=(name, i)) for i in range(1, num_workers+1)]
+        started = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return time.perf_counter() - started
+    finally:
+        lock.unlink()
+        lock.close()
+
+def run(lock_mode):
+    # start increment server and HTTP workers, their ports accept connections as soon as this returns
+    nodes = [("inc_server.py", [], 0, 7000)]
+    if lock_mode == "http":
+        nodes += [("worker.py", [num_loops, i, num_workers], i, 7000+i) for i in range(1, num_workers+1)]
+    procs = start_cluster(nodes, fork=fork)
+    try:
+        wait_ready(procs, [f"{urls[node_id]}/status" for _, _, node_id, _ in nodes])
+        seconds = run_http() if lock_mode == "http" else run_shm()
+        # check results
+        expected = num_workers * num_loops
+        observed = requests.get(f"{urls[0]}/get").json()["value"]
+        print(f"Lock:       {lock_mode}")
+        print(f"Workers:    {num_workers}")
+        print(f"Iterations: {num_loops}")
+        print(f"Expected:   {expected}")
+        print(f"Observed:   {observed}")
+        print(f"Seconds:    {seconds:.3f}")
+        print(f"Locks/s:    {expected / seconds:.1f}")
+        print(f"Passed!" if expected == observed else "FAILED!")
+        return seconds
+    finally:
+        # clean up
+        stop_cluster(procs)
+
+def main():
+    if mode == "compare":
+        http_seconds = run("http")
+        print()
+        shm_seconds = run("shm")
+        print()
+        print(f"Speedup:    {http_seconds / shm_seconds:.1f}x (shm over http, same critical section)")
+    else:
+        run(mode)
 
 if __name__ == "__main__":
     main()
@@ -1,16 +1,26 @@
-import sys, time, threading, requests, logging
-from flask import Flask, jsonify, request
+import sys, os, time, threading, logging
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address, node_url
+from metrics import Metrics
 
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
 num_loops   = int(sys.argv[1])  # e.g. 1_000
 my_id       = int(sys.argv[2])  # 1 .. n
 num_workers = int(sys.argv[3])  # e.g. 8
+peers       = [node_url(i, 7000+i) for i in range(num_workers+1)] # 0 is the increment server
+metrics     = Metrics(peers)   # /metrics, also counts the messages /status reports, see ../../metrics.py
+net         = metrics.client() # every outbound call goes through it
+lock_wait   = metrics.histogram("dca_lock_wait_seconds", "Seconds from asking for the lock until holding it")
 
 app = Flask(__name__)
+metrics.register(app)
 choosing = 0
 ticket   = 0
 done     = False
+latencies = [] # seconds per lock + critical section + unlock
 
 @app.route("/choosing")
 def endpoint_choosing():
@@ -22,7 +32,8 @@ def endpoint_ticket():
 
 @app.route("/status")
 def endpoint_status():
-    return jsonify(done=done)
+    # latencies only once done, /status is polled while the workload runs
+    return jsonify(done=done, messages=metrics.messages_received(), latencies=latencies if done else None)
 
 @app.route("/start", methods=["POST"])
 def endpoint_start():
@@ -30,10 +41,10 @@ def endpoint_start():
     return jsonify(started=True)
 
 def worker_ticket(i):
-    return requests.get(f"http://127.0.0.1:{7000+i}/ticket").json().get("ticket", 0)
+    return net.get(f"{peers[i]}/ticket").json().get("ticket", 0)
 
 def worker_choose(i):
-    return requests.get(f"http://127.0.0.1:{7000+i}/choosing").json().get("choosing",0)
+    return net.get(f"{peers[i]}/choosing").json().get("choosing",0)
 
 def announce_intent():
     global choosing, ticket
@@ -63,18 +74,22 @@ def unlock():
     ticket = 0
 
 def critical_section():
-    curr = requests.get(f"http://127.0.0.1:7000/get").json()["value"]     # get
-    requests.post(f"http://127.0.0.1:7000/set", json={"value": curr + 1}) # set
+    curr = net.get(f"{peers[0]}/get").json()["value"]     # get
+    net.post(f"{peers[0]}/set", json={"value": curr + 1}) # set
 
 def run_worker():
     global done
     for i in range(num_loops):
+        started = time.perf_counter()
         lock()
+        lock_wait.observe(time.perf_counter() - started)
         critical_section()
         unlock()
+        latencies.append(time.perf_counter() - started)
         #print(f"Worker {my_id} at {i}")
     done = True
     print(f"Worker {my_id} Done.", flush=True)
 
 if __name__ == "__main__":
-    app.run(port=7000+my_id, threaded=False)
+    host, port = node_address(my_id, 7000+my_id)
+    app.run(host=host, port=port, threaded=False)
@@ -0,0 +1,567 @@
+import os
+import sys
+import json
+import math
+import bisect
+import itertools
+import time
+import random
+import requests
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from cluster import start_cluster, stop_cluster, wait_ready, driver_args, node_url, CONFIG_ENV
+
+# one benchmark runner for every protocol: starts the nodes, waits until each answers HTTP (no fixed sleeps),
+# runs the workload, then reports throughput, per-operation latency percentiles from a log-linear histogram
+# and protocol messages per operation (from the nodes' /status counters); optionally writes the results as JSON
+# python3 bench.py <protocol> [nodes] [operations] [concurrency] [results.json] [--fork] [--cluster=<file>]
+# --fork: fork the nodes from this process (Flask and requests imported once) instead of starting interpreters
+# --cluster=<file>: put the nodes where the cluster config says, see cluster.py
+# --scenario=<name|steps.json>: inject network faults while the workload runs (dme, byzantine-multi, paxos-multi),
+#   reports throughput over time, the dip while faulted and the recovery time after the heal, see SCENARIOS;
+#   such a run passes if the protocol stayed safe and recovered, operations failing during the faults are only counted
+#
+# protocols and what one operation is:
+#   bakery, dme                                 lock + critical section + unlock by one worker
+#   byzantine-simple, byzantine-sign, byzantine-multi   one round, from the commander's order to all decisions
+#   paxos-multi                                 one /command, sent by one of <concurrency> clients to a random node
+#
+# python3 bench.py bakery 4 200
+# python3 bench.py byzantine-multi 7 20 1 results/byzantine-multi.json
+# python3 bench.py paxos-multi 3 500 8 results/paxos-multi.json
+# python3 bench.py paxos-multi 3 400 4 --scenario=leader-partition
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+POLL_INTERVAL = 0.01   # seconds between /status polls while waiting for an operation to finish
+ROUND_TIMEOUT = 10.0   # byzantine rounds: decide with defaults after this long, like the drivers do
+SCENARIO_BUCKET = 0.25 # seconds of workload per throughput sample in scenario reports
+RECOVERED = 0.8        # back to this fraction of the pre-fault throughput counts as recovered
+fork = False           # --fork
+scenario = None        # --scenario, (name, steps)
+
+# fault scenarios, steps at seconds into the workload; nodes are ids, "*" for all, or "leader"
+# (paxos: the node the others forward commands to, dme: worker 1, byzantine: general 0):
+#   {"at": 1.0, "partition": ["leader"]}   cut these nodes off from all others, both directions
+#   {"at": 1.0, "links": [{"from": "*", "to": 2, "delay": 0.05, "jitter": 0.01, "loss": 0.01}]}   rules as in faults.py
+#   {"at": 4.0, "heal": true}               clear every fault
+# --scenario=<file> takes a JSON list of steps like these
+SCENARIOS = {
+    "leader-partition": [{"at": 1.0, "partition": ["leader"]}, {"at": 4.0, "heal": True}],
+    "slow-network":     [{"at": 1.0, "links": [{"from": "*", "to": "*", "delay": 0.05, "jitter": 0.02}]}, {"at": 4.0, "heal": True}],
+    "lossy-network":    [{"at": 1.0, "links": [{"from": "*", "to": "*", "loss": 0.1}]}, {"at": 4.0, "heal": True}],
+}
+SCENARIO_PROTOCOLS = ("dme", "byzantine-multi", "paxos-multi") # whose nodes send through faults.py
+
+# node ids -> base URLs, the protocols' default ports unless a cluster config says otherwise
+def mutex_url(i):   return node_url(i, 7000+i) # 0 is inc_server
+def general_url(i): return node_url(i, 8000+i)
+def paxos_url(i):   return node_url(i, 5000+i, "localhost")
+
+class LatencyHistogram:
+    # log-linear buckets like HdrHistogram: microseconds, 2**SUB_BUCKET_BITS linear sub-buckets per power of two,
+    # so memory doesn't grow with the number of samples and a bucket is less than 1/128 of its value wide
+    SUB_BUCKET_BITS = 7
+
+    def __init__(self):
+        self.counts = Counter() # bucket lower bound -> count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds):
+        value = max(0, int(seconds * 1_000_000))
+        shift = max(0, value.bit_length() - self.SUB_BUCKET_BITS)
+        self.counts[(value >> shift) << shift] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    @classmethod
+    def bucket_upper(cls, lower):
+        return lower + (1 << max(0, lower.bit_length() - cls.SUB_BUCKET_BITS)) - 1
+
+    def percentile(self, p):
+        # highest value in the bucket that holds the p-th percentile sample, capped at the true max
+        if self.count == 0:
+            return 0
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for lower in sorted(self.counts):
+            seen += self.counts[lower]
+            if seen >= rank:
+                return min(self.bucket_upper(lower), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "unit": "us",
+            "count": self.count,
+            "min": self.min or 0,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max,
+            "buckets": [[lower, self.bucket_upper(lower), self.counts[lower]] for lower in sorted(self.counts)],
+        }
+
+class Scenario:
+    # plays fault steps against the nodes' /faults while the workload runs, and records when operations complete
+    def __init__(self, steps, node_ids, url, leader):
+        self.steps = sorted(steps, key=lambda step: step["at"])
+        self.node_ids = node_ids
+        self.url = url
+        self.leader = leader
+        self.rules = {}       # (from, to) -> rule
+        self.events = []      # (seconds, step) as applied
+        self.completions = [] # (seconds, operations)
+        self.stopping = threading.Event()
+        self.session = requests.Session()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self.play, daemon=True)
+        self.thread.start()
+        return self
+
+    def record(self, operations=1):
+        self.completions.append((time.perf_counter() - self.started, operations))
+
+    def resolve(self, node):
+        return self.node_ids if node == "*" else [self.leader() if node == "leader" else int(node)]
+
+    def apply(self, step):
+        if step.get("heal"):
+            self.rules = {}
+        for node in step.get("partition", []):
+            for cut in self.resolve(node):
+                for other in self.node_ids:
+                    if other != cut:
+                        self.rules[(cut, other)] = self.rules[(other, cut)] = {"partitioned": True}
+        for link in step.get("links", []):
+            rule = {key: value for key, value in link.items() if key not in ("from", "to")}
+            for a in self.resolve(link.get("from", "*")):
+                for b in self.resolve(link.get("to", "*")):
+                    if a != b:
+                        self.rules[(a, b)] = rule
+        self.push()
+
+    def push(self):
+        # every node gets its whole outbound table, what isn't in it is healed
+        for i in self.node_ids:
+            links = {str(b): rule for (a, b), rule in self.rules.items() if a == i}
+            self.session.post(f"{self.url(i)}/faults", json={"links": links}, timeout=5.0).raise_for_status()
+
+    def play(self):
+        for step in self.steps:
+            if self.stopping.wait(max(0.0, step["at"] - (time.perf_counter() - self.started))):
+                return
+            self.apply(step)
+            self.events.append((time.perf_counter() - self.started, step))
+
+    def stop(self):
+        self.ended = time.perf_counter() - self.started
+        self.stopping.set()
+        self.thread.join()
+        if self.rules:
+            self.rules = {}
+            self.push()
+
+    def report(self):
+        # throughput per SCENARIO_BUCKET, baseline before the first fault, dip while faulted, recovery after the last heal
+        counts = [0] * (int(self.ended / SCENARIO_BUCKET) + 1)
+        for seconds, operations in self.completions:
+            counts[min(int(seconds / SCENARIO_BUCKET), len(counts) - 1)] += operations
+        rates = [c / SCENARIO_BUCKET for c in counts]
+        faulted = [t for t, step in self.events if not step.get("heal")]
+        healed = [t for t, step in self.events if step.get("heal") and faulted and t > faulted[-1]]
+        baseline = during = dip = recovery = None
+        if faulted:
+            before = int(faulted[0] / SCENARIO_BUCKET) # whole buckets before the first fault
+            baseline = sum(counts[:before]) / (before * SCENARIO_BUCKET) if before else None
+            fault_end = healed[-1] if healed else self.ended
+            window = [c for t, c in self.completions if faulted[0] <= t < fault_end]
+            during = sum(window) / (fault_end - faulted[0]) if fault_end > faulted[0] else None
+            dip = min(rates[before:int(fault_end / SCENARIO_BUCKET) + 1], default=None)
+        if healed and baseline:
+            # the first SCENARIO_BUCKET-wide window after the heal, starting at a completion, that's back to baseline
+            after = sorted((t, k) for t, k in self.completions if t >= healed[-1])
+            times = [t for t, _ in after]
+            totals = list(itertools.accumulate((k for _, k in after), initial=0))
+            for j, t in enumerate(times):
+                if t + SCENARIO_BUCKET > self.ended:
+                    break
+                end = bisect.bisect_left(times, t + SCENARIO_BUCKET)
+                if totals[end] - totals[j] >= RECOVERED * baseline * SCENARIO_BUCKET:
+                    recovery = t - healed[-1]
+                    break
+        return {
+            "steps": self.steps,
+            "events": [{"seconds": t, "step": step} for t, step in self.events],
+            "bucket_seconds": SCENARIO_BUCKET,
+            "throughput": rates,
+            "baseline_throughput": baseline,
+            "faulted_throughput": during,
+            "dip_throughput": dip,
+            "recovery_seconds": recovery,
+            # None when there's nothing to recover to: no heal after the faults, or no baseline before them
+            "recovered": recovery is not None if healed and baseline else None,
+        }
+
+def start_scenario(node_ids, url, leader=None):
+    if scenario is None:
+        return None
+    return Scenario(scenario[1], node_ids, url, leader or (lambda: node_ids[0])).start()
+
+def count_messages(counts, paths):
+    return sum(c.get(path, 0) for c in counts for path in paths)
+
+def run_mutex(directory, messages, nodes, operations, concurrency):
+    # bakery and dme workers share the driver protocol: /start, poll /status, the count is on inc_server
+    loops = max(1, operations // nodes)
+    started = time.perf_counter()
+    procs = start_cluster([("inc_server.py", [], 0, 7000)] + [("worker.py", [loops, i, nodes], i, 7000+i) for i in range(1, nodes + 1)],
+                          fork=fork, directory=os.path.join(ROOT, directory), quiet=True)
+    try:
+        wait_ready(procs, [f"{mutex_url(0)}/get"] + [f"{mutex_url(i)}/status" for i in range(1, nodes + 1)])
+        startup = time.perf_counter() - started
+        session = requests.Session()
+        started = time.perf_counter()
+        play = start_scenario(list(range(1, nodes + 1)), mutex_url)
+        for i in range(1, nodes + 1):
+            session.post(f"{mutex_url(i)}/start")
+        statuses = {}
+        sampled = 0
+        while len(statuses) < nodes:
+            for i in range(1, nodes + 1):
+                if i not in statuses and (status := session.get(f"{mutex_url(i)}/status").json())["done"]:
+                    statuses[i] = status
+            if play is not None:
+                # operations complete inside the workers, the count on inc_server says how many did
+                count = session.get(f"{mutex_url(0)}/get").json()["value"]
+                play.record(count - sampled)
+                sampled = count
+            time.sleep(POLL_INTERVAL)
+        wall = time.perf_counter() - started
+        if play is not None:
+            play.stop()
+        histogram = LatencyHistogram()
+        for status in statuses.values():
+            for latency in status["latencies"]:
+                histogram.record(latency)
+        expected = nodes * loops
+        observed = session.get(f"{mutex_url(0)}/get").json()["value"]
+        return {
+            "operations": expected,
+            "startup_seconds": startup,
+            "wall_seconds": wall,
+            "latency": histogram,
+            "messages": count_messages([s["messages"] for s in statuses.values()], messages),
+            "passed": expected == observed,
+            "safe": expected == observed, # a lost update means two workers were in the critical section at once
+            "failed_operations": 0,       # workers keep trying until they've done their loops
+            "details": {"expected": expected, "observed": observed},
+            "scenario": play.report() if play is not None else None,
+        }
+    finally:
+        stop_cluster(procs)
+
+def byzantine_m(variant, nodes):
+    # oral messages need n >= 3m+1, signed messages tolerate up to n-2 traitors
+    return nodes - 2 if variant == "sign" else (nodes - 1) // 3
+
+def start_generals(variant, nodes, traitors):
+    directory = f"byzantine/{variant}"
+    m = byzantine_m(variant, nodes)
+    procs = start_cluster([("general.py", [i, nodes, m, int(i in traitors)], i, 8000+i) for i in range(nodes)],
+                          fork=fork, directory=os.path.join(ROOT, directory), quiet=True)
+    try:
+        wait_ready(procs, [f"{general_url(i)}/status" for i in range(nodes)])
+        if variant == "sign":
+            public_keys = {i: requests.get(f"{general_url(i)}/public_key").json()["public_key"] for i in range(nodes)}
+            for i in range(nodes):
+                requests.post(f"{general_url(i)}/public_keys", json={"public_keys": public_keys}).raise_for_status()
+    except Exception:
+        stop_cluster(procs)
+        raise
+    return procs
+
+def byzantine_round(session, nodes, round_id, traitors, body):
+    # start, wait for every general to be done (or time out), collect loyal decisions; body carries round_id for multi
+    order = random.choice(["attack", "retreat"])
+    commander = random.randrange(nodes) if "round_id" in body else 0
+    session.post(f"{general_url(commander)}/start", json={**body, "order": order})
+    deadline = time.monotonic() + ROUND_TIMEOUT
+    statuses = {}
+    while len(statuses) < nodes and time.monotonic() < deadline:
+        for i in range(nodes):
+            if i in statuses:
+                continue
+            r = session.get(f"{general_url(i)}/status", json=body)
+            if r.status_code == 200 and r.json()["done"]:
+                statuses[i] = r.json()
+        time.sleep(POLL_INTERVAL)
+    # simple and sign generals refuse to decide before they are done, that counts as a failed round
+    decisions = set()
+    for i in range(nodes):
+        if i not in traitors:
+            r = session.post(f"{general_url(i)}/decide", json=body)
+            decisions.add(r.json()["value"] if r.ok else None)
+    return len(statuses) < nodes, len(decisions) == 1 and None not in decisions
+
+def run_byzantine(variant, nodes, operations, concurrency):
+    m = byzantine_m(variant, nodes)
+    if m < 1:
+        raise ValueError(f"byzantine-{variant} needs more nodes to tolerate a traitor")
+    histogram = LatencyHistogram()
+    startup = wall = 0.0
+    messages = timeouts = failures = unsafe = 0
+    session = requests.Session()
+    report = None
+    # simple and sign generals only know one round: a fresh cluster (and traitors) per operation, startup not timed
+    rounds_per_cluster = operations if variant == "multi" else 1
+    for cluster in range(operations // rounds_per_cluster):
+        traitors = set(random.sample(range(nodes), m))
+        started = time.perf_counter()
+        procs = start_generals(variant, nodes, traitors)
+        startup += time.perf_counter() - started
+        try:
+            play = start_scenario(list(range(nodes)), general_url)
+            for round_id in range(rounds_per_cluster):
+                body = {"round_id": round_id} if variant == "multi" else {}
+                started = time.perf_counter()
+                timed_out, agreed = byzantine_round(session, nodes, round_id, traitors, body)
+                latency = time.perf_counter() - started
+                histogram.record(latency)
+                wall += latency
+                timeouts += timed_out
+                failures += not agreed
+                unsafe += not agreed and not timed_out # loyal generals that finished must agree
+                if play is not None and agreed and not timed_out:
+                    play.record()
+            if play is not None:
+                play.stop()
+                report = play.report()
+            counts = []
+            for i in range(nodes):
+                r = session.get(f"{general_url(i)}/status", json=body)
+                if r.status_code == 200:
+                    counts.append(r.json()["messages"])
+            messages += count_messages(counts, ["/order"])
+        finally:
+            stop_cluster(procs)
+    return {
+        "operations": histogram.count,
+        "startup_seconds": startup,
+        "wall_seconds": wall,
+        "latency": histogram,
+        "messages": messages,
+        "passed": failures == 0,
+        "safe": unsafe == 0,
+        "failed_operations": failures,
+        "details": {"m": m, "timeouts": timeouts, "disagreements": failures},
+        "scenario": report,
+    }
+
+def paxos_leader(session, nodes):
+    # the node most others would forward commands to, 0 before any round was chosen
+    hints = Counter()
+    for i in range(nodes):
+        try:
+            r = session.get(f"{paxos_url(i)}/status", params={"limit": 0, "compact": 1}, timeout=1.0)
+            hints[r.json()["summary"]["leader_hint"]] += 1
+        except (requests.RequestException, ValueError, KeyError):
+            continue
+    hints.pop(None, None)
+    return hints.most_common(1)[0][0] if hints else 0
+
+def paxos_conflicts(session, nodes):
+    # rounds in which two nodes learned different commands, which Paxos must never allow
+    chosen = {}
+    for i in range(nodes):
+        from_round = 0
+        while True:
+            status = session.get(f"{paxos_url(i)}/status", params={"from_round": from_round, "limit": 1000, "compact": 1}).json()
+            for round_id, learned in status["learner_state"].items():
+                chosen.setdefault(round_id, set()).add(learned["chosen_value"])
+            from_round += 1000
+            if from_round > max(status["current_round"], status["summary"]["max_learned_round"] or 0):
+                break
+    return sum(len(values) > 1 for values in chosen.values())
+
+def paxos_diverged(session, nodes, timeout=10.0):
+    # once every node applied the same number of rounds (catch-up runs once a second), every replica's db must
+    # be the same; returns (replicas that differ from the most common db, nodes still behind after the timeout)
+    deadline = time.time() + timeout
+    while True:
+        dbs = {}
+        for i in range(nodes):
+            try:
+                dbs[i] = session.get(f"{paxos_url(i)}/db", params={"compact": 1}, timeout=1.0).json()
+            except (requests.RequestException, ValueError):
+                continue
+        versions = {d["version"] for d in dbs.values()}
+        if (len(dbs) == nodes and len(versions) == 1) or time.time() > deadline:
+            break
+        time.sleep(0.2)
+    latest = [json.dumps(d["db"], sort_keys=True) for d in dbs.values() if d["version"] == max(versions, default=0)]
+    counts = Counter(latest)
+    return len(latest) - max(counts.values(), default=0), nodes - len(latest)
+
+def run_paxos_multi(nodes, operations, concurrency):
+    started = time.perf_counter()
+    procs = start_cluster([("node.py", [i, nodes], i, 5000+i) for i in range(nodes)],
+                          fork=fork, directory=os.path.join(ROOT, "paxos/multi"), default_host="0.0.0.0", quiet=True)
+    try:
+        wait_ready(procs, [f"{paxos_url(i)}/current" for i in range(nodes)])
+        startup = time.perf_counter() - started
+        session = requests.Session()
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        def command(k):
+            started = time.perf_counter()
+            try:
+                r = session.post(f"{paxos_url(random.randrange(nodes))}/command",
+                                 json={"command": f"x{k % 100} = {k}"}, timeout=30.0)
+                status = r.json().get("status")
+            except (requests.RequestException, ValueError):
+                status = "error"
+            if play is not None and status == "success":
+                play.record()
+            return status, time.perf_counter() - started
+        started = time.perf_counter()
+        play = start_scenario(list(range(nodes)), paxos_url, lambda: paxos_leader(session, nodes))
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(command, range(operations)))
+        wall = time.perf_counter() - started
+        if play is not None:
+            play.stop()
+        histogram = LatencyHistogram()
+        for status, latency in results:
+            if status == "success":
+                histogram.record(latency)
+        statuses = Counter(status for status, _ in results)
+        counts = [session.get(f"{paxos_url(i)}/status", params={"limit": 0, "compact": 1}).json()["summary"]["messages"]
+                  for i in range(nodes)]
+        # client commands aren't protocol messages, forwarded ones are
+        messages = count_messages(counts, ["/prepare", "/propose", "/learn", "/fetch", "/command"]) - operations
+        conflicts = paxos_conflicts(session, nodes)
+        diverged, lagging = paxos_diverged(session, nodes)
+        return {
+            "operations": operations,
+            "startup_seconds": startup,
+            "wall_seconds": wall,
+            "latency": histogram,
+            "messages": messages,
+            "passed": statuses["success"] == operations and conflicts == 0 and diverged == 0,
+            "safe": conflicts == 0 and diverged == 0,
+            "failed_operations": operations - statuses["success"],
+            "details": {"statuses": dict(statuses), "conflicting_rounds": conflicts,
+                        "diverged_replicas": diverged, "lagging_replicas": lagging},
+            "scenario": play.report() if play is not None else None,
+        }
+    finally:
+        stop_cluster(procs)
+
+PROTOCOLS = {
+    "bakery":           lambda *args: run_mutex("bakery/python", ["/ticket", "/choosing"], *args),
+    "dme":              lambda *args: run_mutex("dme/python", ["/request", "/reply"], *args),
+    "byzantine-simple": lambda *args: run_byzantine("simple", *args),
+    "byzantine-sign":   lambda *args: run_byzantine("sign", *args),
+    "byzantine-multi":  lambda *args: run_byzantine("multi", *args),
+    "paxos-multi":      run_paxos_multi,
+}
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def main():
+    global fork, scenario
+    fork, args = driver_args(sys.argv[1:])
+    name = next((a.split("=", 1)[1] for a in args if a.startswith("--scenario=")), None)
+    args = [a for a in args if not a.startswith("--scenario=")]
+    if len(args) < 1 or args[0] not in PROTOCOLS:
+        print(f"Usage: bench.py <{'|'.join(PROTOCOLS)}> [nodes] [operations] [concurrency] [results.json] "
+              f"[--fork] [--cluster=<file>] [--scenario=<{'|'.join(SCENARIOS)}|steps.json>]")
+        sys.exit(1)
+    protocol = args[0]
+    if name is not None:
+        if protocol not in SCENARIO_PROTOCOLS:
+            print(f"--scenario needs nodes that send through faults.py: {', '.join(SCENARIO_PROTOCOLS)}")
+            sys.exit(1)
+        if name in SCENARIOS:
+            scenario = (name, SCENARIOS[name])
+        else:
+            with open(name) as f:
+                scenario = (name, json.load(f))
+    nodes = int(args[1]) if len(args) >= 2 else 4
+    operations = int(args[2]) if len(args) >= 3 else 100
+    concurrency = int(args[3]) if len(args) >= 4 else 1
+    out = args[4] if len(args) >= 5 else None
+
+    result = PROTOCOLS[protocol](nodes, operations, concurrency)
+    if scenario:
+        # faults are meant to make operations fail: a scenario run passes if it stayed safe and recovered after the heal,
+        # failed operations are reported, not held against it
+        result["passed"] = result["safe"] and result["scenario"]["recovered"] is not False
+    latency = result["latency"].to_dict()
+    ops = result["operations"]
+    results = {
+        "protocol": protocol,
+        "version": git_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "nodes": nodes,
+        "concurrency": concurrency,
+        "fork": fork,
+        "cluster": os.environ.get(CONFIG_ENV),
+        "operations": ops,
+        "startup_seconds": result["startup_seconds"],
+        "wall_seconds": result["wall_seconds"],
+        "throughput": ops / result["wall_seconds"] if result["wall_seconds"] else 0.0,
+        "messages": result["messages"],
+        "messages_per_operation": result["messages"] / ops if ops else 0.0,
+        "latency": latency,
+        "passed": result["passed"],
+        "safe": result["safe"],
+        "failed_operations": result["failed_operations"],
+        "details": result["details"],
+        "scenario": {"name": scenario[0], **result["scenario"]} if scenario else None,
+    }
+    print(f"Protocol:    {protocol} ({nodes} nodes, concurrency {concurrency})")
+    print(f"Operations:  {ops} in {results['wall_seconds']:.3f}s, startup {results['startup_seconds']:.3f}s")
+    print(f"Throughput:  {results['throughput']:.1f} ops/s")
+    print(f"Latency:     p50={latency['p50']/1000:.2f}ms p90={latency['p90']/1000:.2f}ms "
+          f"p99={latency['p99']/1000:.2f}ms max={latency['max']/1000:.2f}ms")
+    print(f"Messages:    {results['messages_per_operation']:.1f} per operation")
+    print(f"Details:     {json.dumps(result['details'])}")
+    if scenario:
+        report = result["scenario"]
+        rate = lambda r: "n/a" if r is None else f"{r:.1f} ops/s"
+        print(f"Scenario:    {scenario[0]}, " + ", ".join(
+            " ".join(f"{k}={v}" for k, v in e["step"].items() if k != "at") + f" at {e['seconds']:.2f}s" for e in report["events"]))
+        print(f"Faulted:     baseline {rate(report['baseline_throughput'])}, {rate(report['faulted_throughput'])} while faulted, "
+              f"dip {rate(report['dip_throughput'])} per {SCENARIO_BUCKET}s")
+        recovery = report["recovery_seconds"]
+        print(f"Recovery:    " + (f"{recovery:.2f}s after the heal to {RECOVERED:.0%} of baseline" if recovery is not None
+                                  else "not within the workload, give it more operations" if report["recovered"] is False
+                                  else "n/a, no heal after a baseline"))
+        print(f"Failed:      {result['failed_operations']} operations, {'safe' if result['safe'] else 'SAFETY VIOLATED'}")
+    print(f"Passed!" if result["passed"] else "FAILED!")
+    if out is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Results:     {out}")
+    sys.exit(0 if result["passed"] else 2)
+
+if __name__ == "__main__":
+    main()
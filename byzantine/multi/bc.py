@@ -1,6 +1,32 @@
 from collections import Counter, defaultdict
+from functools import lru_cache
 from math import perm
 
+def majority(values, tie_breaker=min):
+    if not values:
+        raise ValueError("majority() called with no values")
+    counter      = Counter(values)
+    top_count    = max(counter.values())
+    tied_values  = [v for v, c in counter.items() if c == top_count]
+    # single clear winner
+    if len(tied_values) == 1:
+        return tied_values[0]
+    # tie -> delegate to tie-breaker
+    return tie_breaker(tied_values)
+
+@lru_cache(maxsize=None)
+def expected_paths(n, m, node_id, king_id):
+    # table of every path node_id expects a message along when king_id starts a round,
+    # mapped to the child paths whose OM(k-1) results go into the majority at that path
+    children = {}
+    def walk(path):
+        k = 1 + m - len(path)
+        children[path] = tuple(path + (i,) for i in range(n) if i not in path and i != node_id) if k > 0 else ()
+        for child in children[path]:
+            walk(child)
+    walk((king_id,))
+    return children
+
 class ByzantineConsensus:
     def __init__(self, node_id, n, m,
                  majority_func,     # majority_func(iterable[str]) -> str
@@ -16,6 +42,10 @@ class ByzantineConsensus:
         self.received_values = {}          # path-tuple -> value
         self._done           = False       # message cascade finished?
         self._value          = None
+        self._root           = None        # (king_id,), known once the first message arrives
+        self._children       = None        # path-tuple -> child path-tuples, see expected_paths()
+        self._fixed          = {}          # path-tuple -> OM value no missing message can change
+        self._known          = defaultdict(int) # path-tuple -> votes known there, its message and fixed children
         # pre-compute expectation
         self._total_expected = sum(self._expected_messages(k) for k in range(m + 1))
 
@@ -23,18 +53,41 @@ class ByzantineConsensus:
         return len(self.received_values) >= self._total_expected
 
     def is_done(self):
-        return self._done
+        return self._done or self.decided_early()
+
+    def decided_early(self):
+        return self._root is not None and self._root in self._fixed
 
     def value(self):
         return self._value
 
+    def expects(self, path):
+        # False for anything no loyal general sends: a path that isn't in this round's table (or names a king
+        # that can't be one), a second message along the same path, any message once the round is done
+        if self._done or not path:
+            return False
+        if self._children is not None:
+            # the table only holds valid paths, so membership is the whole check once it is known
+            try:
+                return path in self._children and path not in self.received_values
+            except TypeError: # unhashable element
+                return False
+        if not all(type(i) is int and 0 <= i < self.n for i in path):
+            return False
+        return path[0] != self.id and path in expected_paths(self.n, self.m, self.id, path[0])
+
     def onmessage(self, msg):
-        if self._done:
-            raise RuntimeError("node already finished this round")
+        # returns False, and changes nothing, for a message expects() rejects
         path  = tuple(msg["path"])
         value = msg["value"]
+        if not self.expects(path):
+            return False
+        if self._children is None:
+            self._root     = path[:1]
+            self._children = expected_paths(self.n, self.m, self.id, path[0])
         k = 1 + self.m - len(path)
         self.received_values[path] = value
+        self._update_fixed(path)
         # forward if required
         if k > 0: # more stages to go
             value = self._next_value(value)
@@ -45,6 +98,7 @@ class ByzantineConsensus:
         # check completion
         if self.all_messages_received():
             self._done = True
+        return True
 
     def decide(self, timeout_default=None):
         if self._value is not None:
@@ -53,6 +107,10 @@ class ByzantineConsensus:
             raise RuntimeError("cannot decide before cascade finishes and without default value")
         if len(self.received_values) == 0:
             return timeout_default
+        if self.decided_early():
+            # the outcome is the same whatever the missing messages turn out to be
+            self._value = self._fixed[self._root]
+            return self._value
         root = min(self.received_values.keys(), key=len) # shortest path
         root = [root[0]]
         self._value = self._om(list(root), timeout_default)
@@ -64,14 +122,50 @@ class ByzantineConsensus:
         self._done = True # king never receives later messages
 
     def _broadcast(self, path, value, k_remaining):
+        msg = {"path": path, "value": value} # one message for every target, nobody mutates it
         for i in range(self.n):
             if i in path or i == self.id: # do not resend along path
                 continue
-            self._send(i, {"path": list(path), "value": value})
+            self._send(i, msg)
 
     def _expected_messages(self, k):
         return perm(3 * self.m + 1 - 2, self.m - k)
 
+    def _update_fixed(self, path):
+        # a new message can only fix the OM value at its own path and, in turn, at its ancestors;
+        # a majority is only certain once more than half its votes are known, skip the scan until then
+        self._known[path] += 1
+        while path and path not in self._fixed:
+            if 2 * self._known[path] <= 1 + len(self._children[path]):
+                return
+            fixed = self._fixed_majority(path)
+            if fixed is None:
+                return
+            self._fixed[path] = fixed
+            path = path[:-1]
+            self._known[path] += 1
+
+    def _fixed_majority(self, path):
+        # returns the majority at path if it is already certain, otherwise None;
+        # assumes majority_func picks a most common value
+        children = self._children[path]
+        value    = self.received_values.get(path)
+        if not children: # leaf, most messages: the OM(0) value is the message itself
+            return value
+        fixed   = self._fixed
+        known   = [v for v in (value, *(fixed.get(child) for child in children)) if v is not None]
+        unknown = 1 + len(children) - len(known)
+        if unknown == 0:
+            return self._majority(known)
+        counts = {}
+        for v in known:
+            counts[v] = counts.get(v, 0) + 1
+        top_value, top_count = max(counts.items(), key=lambda vc: vc[1], default=(None, 0))
+        runner_up_count = max((c for v, c in counts.items() if v != top_value), default=0)
+        if top_count > runner_up_count + unknown:
+            return top_value
+        return None
+
     def _om(self, path, default_value):
         k = 1 + self.m - len(path)
         v = self.received_values.get(tuple(path), default_value)
@@ -1,4 +1,11 @@
-import subprocess, sys, random, time, requests
+import sys, os, random, time, requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import start_cluster, stop_cluster, wait_ready, driver_args, node_url
+
+# --fork: fork generals from this process instead of starting new interpreters, --cluster=<file>: where they run
+fork, args = driver_args(sys.argv[1:])
+sys.argv = sys.argv[:1] + args
 
 if len(sys.argv) != 3:
     print("Usage: general.py <m> <num_rounds>"); sys.exit(1)
@@ -11,36 +18,31 @@ timeout = 5 # seconds
 # randomly pick m traitors (could include commander 0)
 traitors = set(random.sample(range(n), m))
 print(f'Traitors: {traitors}')
+urls = [node_url(i, 8000+i) for i in range(n)]
 
-def spawn(mod, *args):
-    return subprocess.Popen([sys.executable, mod, *map(str, args)])
-
-procs = []
-# start every general
-for gid in range(n):
-    traitor = 1 if gid in traitors else 0
-    procs.append(spawn("general.py", gid, n, m, traitor))
-# let servers come up
-time.sleep(1)
+# start every general, wait until each answers
+procs = start_cluster([("general.py", [gid, n, m, 1 if gid in traitors else 0], gid, 8000+gid) for gid in range(n)], fork=fork)
+wait_ready(procs, [f"{urls[i]}/status" for i in range(n)])
 for round_id in range(num_rounds):
     king_id = random.sample(range(n), 1)[0]
     print(f"\nROUND #{round_id}, node {king_id} is king")
     # kick off message cascade by telling the king to issue his order
     activities = ["drink beer", "eat dinner", "sleep", "watch a movie", "go clubbing"]
     order = random.sample(activities, 1)[0]
-    requests.post(f"http://127.0.0.1:{8000+king_id}/start", json={"round_id": round_id, "order": order})
-    # wait until all generals report done
-    timeout_ts = time.monotonic() + timeout
+    started = time.monotonic()
+    requests.post(f"{urls[king_id]}/start", json={"round_id": round_id, "order": order})
+    # wait until all generals report done (either all messages arrived or the outcome is already fixed)
+    timeout_ts = started + timeout
     while True:
         if time.monotonic() > timeout_ts:
             print("Timeout, calling decide(), generals will assume default values for missing messages")
             break
         time.sleep(0.1)
-        try:
-            if all(requests.get(f"http://127.0.0.1:{8000+i}/status", json={"round_id": round_id}).json()["done"] for i in range(n)):
-                break # all done, exit waiting loop
-        except:
-            pass
+        # a general that hasn't heard of the round yet answers 400
+        statuses = [requests.get(f"{urls[i]}/status", json={"round_id": round_id}) for i in range(n)]
+        if all(r.ok and r.json()["done"] for r in statuses):
+            break # all done, exit waiting loop
+    print(f"Generals ready to decide after {time.monotonic() - started:.3f} seconds")
     # tell each general to decide based on what they've seen so far
     print('Decisions:')
     decisions = set()
@@ -48,7 +50,7 @@ for round_id in range(num_rounds):
         if i in traitors:
             print(f'General {i} is a traitor')
         else:
-            value = requests.post(f"http://127.0.0.1:{8000+i}/decide", json={"round_id": round_id}).json()["value"]
+            value = requests.post(f"{urls[i]}/decide", json={"round_id": round_id}).json()["value"]
             print(f'General {i} decided {value}')
             decisions.add(value)
     if len(decisions) == 1:
@@ -56,5 +58,4 @@ for round_id in range(num_rounds):
     else:
         print('FAILURE: non-traitor generals decided differently')
 # stop all generals
-for p in procs:
-    p.kill()
+stop_cluster(procs)
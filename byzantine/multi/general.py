@@ -1,8 +1,12 @@
-import sys, threading, requests, logging
+import sys, os, threading, requests, logging
 from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
-from collections import Counter
-from bc import ByzantineConsensus
+from bc import ByzantineConsensus, majority
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address, node_url
+from faults import Faults
+from metrics import Metrics
 
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
@@ -11,27 +15,21 @@ if len(sys.argv) != 5:
 
 node_id, n, m, is_traitor = map(int, sys.argv[1:])
 is_traitor = bool(is_traitor)
+peers = [node_url(i, 8000+i) for i in range(n)]
 bcr = {} # Byzantine Consensus rounds
 
 app      = Flask(__name__)
 session  = requests.Session()
 executor = ThreadPoolExecutor(max_workers=64)
-
-def majority(values, tie_breaker=min):
-    if not values:
-        raise ValueError("majority() called with no values")
-    counter      = Counter(values)
-    top_count    = max(counter.values())
-    tied_values  = [v for v, c in counter.items() if c == top_count]
-    # single clear winner
-    if len(tied_values) == 1:
-        return tied_values[0]
-    # tie -> delegate to tie-breaker
-    return tie_breaker(tied_values)
+faults   = Faults(peers, node_id, session) # delay/loss/partitions injected per link at runtime, see ../../faults.py
+metrics  = Metrics(peers)                  # /metrics, also counts the messages /status reports, see ../../metrics.py
+net      = metrics.client(faults)          # every outbound call goes through both
+faults.register(app)
+metrics.register(app)
 
 def async_order(target_id, msg):
     def _post():
-        try: session.post(f"http://127.0.0.1:{8000+target_id}/order", json=msg)
+        try: net.post(f"{peers[target_id]}/order", json=msg)
         except: pass
     executor.submit(_post)
 
@@ -47,12 +45,15 @@ def new_bcr(round_id):
 
 @app.route("/order", methods=["POST"])
 def order():
-    msg = request.get_json()
-    if "round_id" not in msg:
+    msg = request.get_json(silent=True) or {}
+    if not isinstance(msg, dict) or not isinstance(msg.get("round_id"), (int, str)):
         return "specify round_id", 400
+    if not isinstance(msg.get("path"), list) or "value" not in msg:
+        return "specify path and value", 400
     if msg["round_id"] not in bcr:
         bcr[msg["round_id"]] = new_bcr(msg["round_id"])
-    bcr[msg["round_id"]].onmessage(msg)
+    if not bcr[msg["round_id"]].onmessage(msg):
+        return "unexpected path", 400
     return jsonify(ok=True)
 
 @app.route("/start", methods=["POST"])
@@ -73,7 +74,7 @@ def status():
         return "specify round_id", 400
     if msg["round_id"] not in bcr:
         return "no such round_id seen", 400
-    return jsonify(done=bcr[msg["round_id"]].is_done())
+    return jsonify(done=bcr[msg["round_id"]].is_done(), messages=metrics.messages_received())
 
 @app.route("/decide", methods=["POST"])
 def decide():
@@ -85,4 +86,5 @@ def decide():
     return jsonify(value=bcr[msg["round_id"]].decide(timeout_default=msg.get("timeout_default", "")))
 
 if __name__ == "__main__":
-    app.run(port=8000 + node_id, threaded=True)
+    host, port = node_address(node_id, 8000 + node_id)
+    app.run(host=host, port=port, threaded=True)
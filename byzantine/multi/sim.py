@@ -0,0 +1,147 @@
+import os, sys, time, heapq, random
+from types import SimpleNamespace
+from bc import ByzantineConsensus, majority
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from stats import percentile
+
+# in-process discrete-event simulation of OM(m): 3m+1 ByzantineConsensus instances
+# exchange messages through an in-memory event queue on a simulated clock, no HTTP involved
+# python3 sim.py <m> <num_rounds> [traitor_strategy] [latency_model]
+# measured on one core with the default random/uniform: m=1 about 9,000-11,000 rounds/s (~8 messages a round),
+# m=2 about 800-900 rounds/s (~145 messages), m=3 about 30 rounds/s (~3,400 messages), so thousands of
+# rounds per second only for m=1; each message costs ~7us, mostly onmessage() and its majority bookkeeping
+
+ACTIVITIES = ["drink beer", "eat dinner", "sleep", "watch a movie", "go clubbing"]
+
+# traitor strategies: strategy(rng, sender, target, msg) -> msg to deliver, or None to drop it
+
+def honest(rng, sender, target, msg):
+    return msg
+
+def silent(rng, sender, target, msg):
+    return None
+
+def random_value(rng, sender, target, msg):
+    return {**msg, "value": rng.choice(ACTIVITIES)}
+
+def two_faced(rng, sender, target, msg):
+    return {**msg, "value": ACTIVITIES[target % 2]}
+
+TRAITOR_STRATEGIES = {
+    "honest": honest,
+    "silent": silent,
+    "random": random_value,
+    "two_faced": two_faced,
+}
+
+# latency models: latency(rng, sender, target, is_traitor) -> simulated seconds until delivery
+
+def constant(rng, sender, target, is_traitor):
+    return 0.001
+
+def uniform(rng, sender, target, is_traitor):
+    return rng.uniform(0.0005, 0.005)
+
+def exponential(rng, sender, target, is_traitor):
+    return 0.0005 + rng.expovariate(1 / 0.002)
+
+def slow_traitors(rng, sender, target, is_traitor):
+    return 2.0 if is_traitor else uniform(rng, sender, target, is_traitor)
+
+LATENCY_MODELS = {
+    "constant": constant,
+    "uniform": uniform,
+    "exponential": exponential,
+    "slow_traitors": slow_traitors,
+}
+
+class Simulation:
+    def __init__(self, m, traitors,
+                 strategy=honest,       # see TRAITOR_STRATEGIES
+                 latency=constant,      # see LATENCY_MODELS
+                 timeout=5.0,           # simulated seconds before generals fall back to defaults
+                 seed=None):
+        self.m         = m
+        self.n         = 3 * m + 1
+        self.traitors  = set(traitors)
+        self._strategy = strategy
+        self._latency  = latency
+        self._timeout  = timeout
+        self._rng      = random.Random(seed)
+        # state
+        self.now       = 0.0            # simulated clock
+        self._events   = []             # heap of (deliver_at, seq, target_id, msg)
+        self._seq      = 0              # tie-breaker, keeps delivery order deterministic
+
+    def _send(self, sender, target, msg):
+        is_traitor = sender in self.traitors
+        if is_traitor:
+            msg = self._strategy(self._rng, sender, target, msg)
+            if msg is None:
+                return
+        self._seq += 1
+        deliver_at = self.now + self._latency(self._rng, sender, target, is_traitor)
+        heapq.heappush(self._events, (deliver_at, self._seq, target, msg))
+
+    def run_round(self, king_id, order):
+        started = self.now
+        nodes = [ByzantineConsensus(node_id=i, n=self.n, m=self.m,
+                                    majority_func=majority,
+                                    send_func=lambda target_id, msg, sender=i: self._send(sender, target_id, msg),
+                                    next_value_func=lambda v: v) # traitors lie through the strategy
+                 for i in range(self.n)]
+        loyal = [i for i in range(self.n) if i not in self.traitors]
+        nodes[king_id].start(order)
+        waiting = {i for i in loyal if not nodes[i].is_done()}
+        messages = 0
+        # deliver until every loyal general can decide, or the timeout hits;
+        # messages still in flight after that can't change loyal decisions
+        while waiting and self._events and self._events[0][0] <= started + self._timeout:
+            self.now, _, target, msg = heapq.heappop(self._events)
+            nodes[target].onmessage(msg)
+            messages += 1
+            if target in waiting and nodes[target].is_done():
+                waiting.discard(target)
+        if waiting:
+            self.now = started + self._timeout
+        self._events.clear()
+        decisions = {i: nodes[i].decide(timeout_default="") for i in loyal}
+        return SimpleNamespace(
+            king_id=king_id,
+            order=order,
+            decisions=decisions,
+            agreement=len(set(decisions.values())) == 1,
+            validity=king_id in self.traitors or set(decisions.values()) == {order},
+            timed_out=bool(waiting),
+            latency=self.now - started,
+            messages=messages,
+        )
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or len(sys.argv) > 5:
+        print("Usage: sim.py <m> <num_rounds> [traitor_strategy] [latency_model]")
+        print(f"  traitor strategies: {', '.join(TRAITOR_STRATEGIES)}")
+        print(f"  latency models:     {', '.join(LATENCY_MODELS)}")
+        sys.exit(1)
+    m = int(sys.argv[1])
+    num_rounds = int(sys.argv[2])
+    strategy = TRAITOR_STRATEGIES[sys.argv[3] if len(sys.argv) >= 4 else "random"]
+    latency = LATENCY_MODELS[sys.argv[4] if len(sys.argv) >= 5 else "uniform"]
+    n = 3 * m + 1
+    traitors = set(random.sample(range(n), m))
+    print(f'Traitors: {traitors}')
+    sim = Simulation(m, traitors, strategy, latency)
+    results = []
+    wall_started = time.perf_counter()
+    for round_id in range(num_rounds):
+        results.append(sim.run_round(king_id=random.randrange(n), order=random.choice(ACTIVITIES)))
+    wall = time.perf_counter() - wall_started
+    latencies = [r.latency for r in results]
+    print(f"Rounds:             {num_rounds}")
+    print(f"Rounds/s (wall):    {num_rounds / wall:,.0f}")
+    print(f"Messages/round:     {sum(r.messages for r in results) / num_rounds:,.1f}")
+    print(f"Decision latency:   p50={percentile(latencies, 50)*1000:.2f}ms p99={percentile(latencies, 99)*1000:.2f}ms (simulated)")
+    print(f"Timeouts:           {sum(r.timed_out for r in results)}")
+    print(f"Agreement failures: {sum(not r.agreement for r in results)}")
+    print(f"Validity failures:  {sum(not r.validity for r in results)}")
@@ -0,0 +1,82 @@
+import sys, time, json, secrets
+from signatures import SignatureVerifier, canonical_json, b64encode_signature, sign_chain, chain_signers
+from nacl import signing
+
+# runs the full SM(m) message cascade in-process for m = 1..max_m (n = m + 2) and compares
+# the old nested re-signed payloads with signature chains: bytes per message and sign/verify CPU per round
+# python3 bench_chain.py [max_m] [rounds]
+
+max_m = int(sys.argv[1]) if len(sys.argv) >= 2 else 4
+num_rounds = int(sys.argv[2]) if len(sys.argv) >= 3 else 3
+
+class Stats:
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.sign_seconds = 0.0
+        self.verify_seconds = 0.0
+
+def run_nested(m, private_keys, stats):
+    # the format general.py used before: {"path", "msg", "signature_b64"} wrapped and re-signed on every hop,
+    # with the outer signature in the URL path /order/<signature_b64>
+    n = m + 2
+    verifiers = [SignatureVerifier(lambda node_id: bytes(private_keys[node_id].verify_key), n) for _ in range(n)]
+    def send(sender, target, msg):
+        started = time.process_time()
+        msg["node_id"] = sender
+        msg["nonce"] = secrets.token_urlsafe(16)
+        signature_b64 = b64encode_signature(private_keys[sender].sign(canonical_json(msg)).signature)
+        stats.sign_seconds += time.process_time() - started
+        body = json.dumps(msg)
+        stats.messages += 1
+        stats.bytes += len(body) + len(signature_b64)
+        receive(target, json.loads(body), signature_b64)
+    def receive(target, msg, signature_b64):
+        started = time.process_time()
+        signatures = [(msg["node_id"], canonical_json(msg), signature_b64)]
+        inner = msg
+        while "msg" in inner:
+            signatures.append((inner["msg"]["node_id"], canonical_json(inner["msg"]), inner["signature_b64"]))
+            inner = inner["msg"]
+        assert verifiers[target].verify_batch(signatures)
+        stats.verify_seconds += time.process_time() - started
+        path = msg["path"]
+        if len(path) <= m:
+            for i in range(n):
+                if i not in path + [target]:
+                    send(target, i, {"path": path + [target], "msg": msg, "signature_b64": signature_b64})
+    for i in range(1, n):
+        send(0, i, {"path": [0], "value": "attack"})
+
+def run_chain(m, private_keys, stats):
+    # signature chains: value, nonce and a list of (signer, signature) pairs in the request body
+    n = m + 2
+    verifiers = [SignatureVerifier(lambda node_id: bytes(private_keys[node_id].verify_key), n) for _ in range(n)]
+    def broadcast(sender, msg):
+        started = time.process_time()
+        signed_msg = sign_chain(private_keys[sender], sender, msg)
+        stats.sign_seconds += time.process_time() - started
+        body = json.dumps(signed_msg)
+        path = chain_signers(signed_msg)
+        for i in range(n):
+            if i not in path:
+                stats.messages += 1
+                stats.bytes += len(body)
+                receive(i, json.loads(body))
+    def receive(target, msg):
+        started = time.process_time()
+        assert verifiers[target].verify_chain(msg)
+        stats.verify_seconds += time.process_time() - started
+        if len(msg["signatures"]) <= m:
+            broadcast(target, msg)
+    broadcast(0, {"value": "attack", "nonce": secrets.token_urlsafe(16), "signatures": []})
+
+print(f"{'format':<8} {'m':>2} {'n':>2} {'msgs/round':>11} {'bytes/msg':>10} {'sign ms/round':>14} {'verify ms/round':>16}")
+for m in range(1, max_m + 1):
+    private_keys = [signing.SigningKey.generate() for _ in range(m + 2)]
+    for name, run in [("nested", run_nested), ("chain", run_chain)]:
+        stats = Stats()
+        for _ in range(num_rounds):
+            run(m, private_keys, stats)
+        print(f"{name:<8} {m:>2} {m+2:>2} {stats.messages // num_rounds:>11} {stats.bytes / stats.messages:>10.0f} "
+              f"{1000 * stats.sign_seconds / num_rounds:>14.2f} {1000 * stats.verify_seconds / num_rounds:>16.2f}")
@@ -0,0 +1,71 @@
+import sys, time, secrets
+from signatures import SignatureVerifier, b64decode_signature, sign_chain, chain_signers, chain_digest, chain_link
+from nacl import signing
+
+# simulates the SM(m) message cascade as seen by one general, and measures
+# signature verifications per second with and without the verify cache:
+# python3 bench_verify.py [m] [seconds]
+
+m = int(sys.argv[1]) if len(sys.argv) >= 2 else 2
+seconds = float(sys.argv[2]) if len(sys.argv) >= 3 else 2.0
+n = m + 2
+
+private_keys = [signing.SigningKey.generate() for _ in range(n)]
+public_keys = {i: bytes(k.verify_key) for i, k in enumerate(private_keys)}
+
+def cascade(msg):
+    # all messages the last general (n-1) receives below this one
+    yield msg
+    path = chain_signers(msg)
+    if len(path) > m:
+        return
+    for i in range(n - 1):
+        if i not in path:
+            yield from cascade(sign_chain(private_keys[i], i, msg))
+
+def links(msg):
+    # every (signer, signed bytes, signature) link of the chain, like verify_chain checks on /order
+    digest = chain_digest(msg["value"], msg["nonce"])
+    signers = chain_signers(msg)
+    return [(signer, chain_link(digest, signers[:k+1]), signature_b64) for k, (signer, signature_b64) in enumerate(msg["signatures"])]
+
+def verify_naive(node_id, signed_bytes, signature_b64):
+    # no caching: new VerifyKey and a full Ed25519 check on every call
+    verify_key = signing.VerifyKey(public_keys[node_id])
+    verify_key.verify(signed_bytes, b64decode_signature(signature_b64))
+    return True
+
+king_msg = sign_chain(private_keys[0], 0, {"value": "attack", "nonce": secrets.token_urlsafe(16), "signatures": []})
+messages = list(cascade(king_msg))
+signatures_per_round = sum(len(msg["signatures"]) for msg in messages)
+
+def run(name, verify_round):
+    rounds = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        verify_round()
+        rounds += 1
+    elapsed = time.perf_counter() - started
+    print(f"{name:<10} {rounds * signatures_per_round / elapsed:>12,.0f} verifications/s  {rounds / elapsed:>10,.1f} rounds/s")
+
+def naive_round():
+    for msg in messages:
+        for link in links(msg):
+            assert verify_naive(*link)
+
+def cached_round():
+    # fresh verifier per round: only repeats within a round are served from the cache
+    verifier = SignatureVerifier(public_keys.__getitem__, n)
+    for msg in messages:
+        for link in links(msg):
+            assert verifier.verify(*link)
+
+def batched_round():
+    verifier = SignatureVerifier(public_keys.__getitem__, n)
+    for msg in messages:
+        assert verifier.verify_chain(msg)
+
+print(f"m={m}, n={n}: {len(messages)} messages and {signatures_per_round} signatures per round")
+run("naive", naive_round)
+run("cached", cached_round)
+run("batched", batched_round)
@@ -1,11 +1,16 @@
-import sys, threading, requests, logging, base64, secrets, json
+import sys, os, threading, requests, logging, base64, secrets
+from signatures import SignatureVerifier, sign_chain, chain_signers, well_formed_chain
 from concurrent.futures import ThreadPoolExecutor
-from nacl.exceptions import BadSignatureError
 from collections import Counter, defaultdict
 from flask import Flask, request, jsonify
+from functools import lru_cache
 from nacl import signing
 from math import perm
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address, node_url
+from metrics import Metrics
+
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
 if len(sys.argv) != 5:
@@ -17,6 +22,13 @@ session = requests.Session()
 executor = ThreadPoolExecutor(max_workers=64)
 id, n, m, traitor = map(int, sys.argv[1:])
 traitor = bool(traitor)
+# the commander, the only general /start is sent to (driver.py, bench.py); chains that another general
+# signed first are refused, or a traitor could start its own and force "retreat" under a loyal king
+KING = 0
+peers = [node_url(i, 8000+i) for i in range(n)]
+metrics = Metrics(peers) # /metrics, also counts the messages /status reports, see ../../metrics.py
+metrics.register(app)
+net = metrics.client(session) # every outbound call goes through it
 received_values = {}
 done = False
 value = None
@@ -29,41 +41,19 @@ def get_public_key(node_id):
     global public_keys_cache
     if node_id in public_keys_cache:
         return public_keys_cache[node_id]
-    public_key_b64 = requests.get(f"http://127.0.0.1:{8000+node_id}/public_key").json()["public_key"]
+    # keys are normally pushed by the driver via /public_keys before /start,
+    # fetching lazily here only happens if that phase was skipped
+    public_key_b64 = net.get(f"{peers[node_id]}/public_key").json()["public_key"]
     public_key = base64.b64decode(public_key_b64)
     public_keys_cache[node_id] = public_key
     return public_key
 
-def canonical_json(obj):
-    return json.dumps(obj, separators=(",", ":"), sort_keys=True).encode("utf-8")
-
-def insert_nonce(payload):
-    payload["node_id"] = id
-    payload["nonce"] = secrets.token_urlsafe(16) # add ~128 bits of entropy
-    return payload
-
-def sign(payload):
-    signed = private_key.sign(canonical_json(payload)).signature
-    return base64.urlsafe_b64encode(signed).decode().rstrip("=")
-
-def verify_signature(node_id, payload, signature_b64):
-    public_key = get_public_key(node_id)
-    verify_key = signing.VerifyKey(public_key)
-    try:
-        signature_b64_padded = signature_b64 + "=" * (-len(signature_b64) % 4)
-        verify_key.verify(canonical_json(payload), base64.urlsafe_b64decode(signature_b64_padded))
-        return True
-    except BadSignatureError:
-        return False
+verifier = SignatureVerifier(get_public_key, n)
 
 def async_order(node_id, msg):
     def _post():
-        try:
-            insert_nonce(msg)
-            signature = sign(msg)
-            session.post(f"http://127.0.0.1:{8000+node_id}/order/{signature}", json=msg)
-        except:
-            pass
+        try: net.post(f"{peers[node_id]}/order", json=msg)
+        except: pass
     executor.submit(_post)
 
 def expected_messages(k):
@@ -72,6 +62,23 @@ def expected_messages(k):
 
 total_expected = sum(expected_messages(k) for k in range(m+1))
 
+@lru_cache(maxsize=None)
+def expected_paths(king_id):
+    # table of every signature chain we expect a message along when king_id gives the order
+    paths = set()
+    def walk(path):
+        paths.add(path)
+        if len(path) <= m:
+            for i in range(n):
+                if i not in path and i != id:
+                    walk(path + (i,))
+    walk((king_id,))
+    return frozenset(paths)
+
+def decided_early():
+    # once two different orders signed by the king are seen, choice() is "retreat" whatever is still missing
+    return len(set(received_values.values())) > 1
+
 def all_messages_received():
     total_received = len(received_values)
     # print(f'node={id}: {total_received}/{total_expected}')
@@ -87,10 +94,13 @@ def choice(vals):
     # retreat if there are more than 1 values (=the king is a traitor)
     return "retreat"
 
-def broadcast(path, msg, signature_b64):
+def broadcast(msg):
+    # append my signature to the chain once, the same message goes to everybody not yet on it
+    signed_msg = sign_chain(private_key, id, msg)
+    path = chain_signers(signed_msg)
     for i in range(n):
         if i not in path:
-            async_order(i, msg={"path": path, "msg": msg, "signature_b64": signature_b64})
+            async_order(i, signed_msg)
 
 def other_value(v):
     return "retreat" if v == "attack" else "attack"
@@ -99,41 +109,45 @@ def shortest_path():
     return list(min(received_values.keys(), key=len, default=None))
 
 def process_message(path, msg):
-    if "value" in msg:
-        value = msg["value"]
-        received_values[tuple(path)] = value
-    elif "msg" in msg:
-        contained_msg = msg["msg"]
-        if not verify_signature(contained_msg["node_id"], contained_msg, msg["signature_b64"]):
-            # print(f"Signature {signature_b64} does not match: msg")
-            assert(False) # in my implementation, this should not happen
-            # return 
-        else:
-            # print(f"Signature {msg['signature_b64'][:10]}[..] checks out for: {contained_msg}")
-            process_message(path, msg["msg"])
-    else:
-        assert(False) # in my implementation, this should not happen
-
-def message_cascade(msg, signature_b64):
-    path = list(msg["path"])
+    received_values[tuple(path)] = msg["value"]
+
+def message_cascade(path, msg):
     k = 1 + m - len(path)
     if k > 0:
-        broadcast(path + [id], msg, signature_b64)
+        broadcast(msg)
 
 @app.route("/public_key")
 def public_key():
     return jsonify({"node_id": id, "public_key": base64.b64encode(bytes(private_key.verify_key)).decode()})
 
-@app.route("/order/<signature_b64>", methods=["POST"])
-def order(signature_b64):
-    msg = request.get_json()
-    if not verify_signature(msg["node_id"], msg, signature_b64):
-        # print(f"Signature {signature_b64} does not match: msg")
+@app.route("/public_keys", methods=["POST"])
+def public_keys():
+    # key distribution phase: the driver collected everyone's /public_key and pushes the directory
+    keys = {int(node_id): base64.b64decode(public_key_b64) for node_id, public_key_b64 in request.get_json()["public_keys"].items()}
+    if keys.get(id) != public_keys_cache[id]:
+        return "Directory does not contain my public key", 400
+    if set(keys) != set(range(n)):
+        return "Directory does not contain all nodes", 400
+    public_keys_cache.update(keys)
+    return jsonify(ok=True)
+
+@app.route("/order", methods=["POST"])
+def order():
+    msg = request.get_json(silent=True)
+    if not well_formed_chain(msg):
+        return "specify value, nonce and signatures", 400
+    # the path is the chain of signers, verify all links together, earlier ones are usually cached
+    path = chain_signers(msg)
+    if not path or not verifier.known_signers(path) or tuple(path) not in expected_paths(KING) \
+            or not verifier.verify_chain(msg):
+        # print(f"Signature chain does not match: {msg}")
         return "Signature does not match", 401
-    # print(f"Signature {signature_b64[:10]}[..] checks out for: {msg}")
-    process_message(msg["path"], msg)
-    message_cascade(msg, signature_b64)
-    if all_messages_received():
+    if tuple(path) in received_values:
+        return "path already received", 400
+    # print(f"Signature chain {path} checks out for: {msg['value']}")
+    process_message(path, msg)
+    message_cascade(path, msg)
+    if all_messages_received() or decided_early():
         global done
         done = True
     return jsonify(ok=True)
@@ -150,18 +164,24 @@ def decide():
 def start():
     # /start is essentially like order with: path=[], value=order, k=0
     global value
+    if id != KING:
+        return f"general {KING} gives the order", 400
     value = request.get_json()["order"]
+    nonce = secrets.token_urlsafe(16) # add ~128 bits of entropy, so signatures can't be replayed in other rounds
+    signed_msgs = {v: sign_chain(private_key, id, {"value": v, "nonce": nonce, "signatures": []})
+                   for v in {value, other_value(value)}}
     for i in range(n):
         if i == id: continue # don't order myself
-        msg = {"path": [id], "value": other_value(value) if traitor and i % 2 == 0 else value}
-        async_order(i, msg)
+        async_order(i, signed_msgs[other_value(value) if traitor and i % 2 == 0 else value])
     global done
     done=True
     return jsonify(ok=True)
 
 @app.route("/status")
 def status():
-    return jsonify(done=done)
+    return jsonify(done=done, signatures_verified=verifier.num_verified, signatures_cached=verifier.num_cached,
+                   messages=metrics.messages_received())
 
 if __name__ == "__main__":
-    app.run(port=8000+id, threaded=True)
+    host, port = node_address(id, 8000+id)
+    app.run(host=host, port=port, threaded=True)
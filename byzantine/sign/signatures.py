@@ -0,0 +1,112 @@
+import base64, json, hashlib, threading
+from collections import OrderedDict
+from nacl.exceptions import BadSignatureError
+from nacl import signing
+
+def canonical_json(obj):
+    return json.dumps(obj, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+def b64encode_signature(signature):
+    return base64.urlsafe_b64encode(signature).decode().rstrip("=")
+
+def b64decode_signature(signature_b64):
+    return base64.urlsafe_b64decode(signature_b64 + "=" * (-len(signature_b64) % 4))
+
+# signature chains: a message is {"value", "nonce", "signatures": [[signer, signature_b64], ...]}
+# the k-th signer signs the fixed digest of (value, nonce) plus the ids of the first k signers,
+# so a signature can neither be moved to another position in the chain nor reused for another value
+
+def chain_digest(value, nonce):
+    return hashlib.sha256(canonical_json({"value": value, "nonce": nonce})).digest()
+
+def chain_link(digest, signers):
+    return digest + canonical_json(signers)
+
+def well_formed_chain(msg):
+    # the shape above, checked before anything reads a message off the network
+    return (isinstance(msg, dict) and isinstance(msg.get("value"), str) and isinstance(msg.get("nonce"), str)
+            and isinstance(msg.get("signatures"), list)
+            and all(isinstance(s, list) and len(s) == 2 and isinstance(s[1], str) for s in msg["signatures"]))
+
+def chain_signers(msg):
+    return [signer for signer, _ in msg["signatures"]]
+
+def sign_chain(private_key, node_id, msg):
+    signers = chain_signers(msg) + [node_id]
+    link = chain_link(chain_digest(msg["value"], msg["nonce"]), signers)
+    signature_b64 = b64encode_signature(private_key.sign(link).signature)
+    return {"value": msg["value"], "nonce": msg["nonce"], "signatures": msg["signatures"] + [[node_id, signature_b64]]}
+
+# verified signatures remembered per verifier, least recently used ones are dropped beyond this,
+# so a traitor sending ever new signatures can't grow the cache without bound
+VERIFIED_CACHE_SIZE = 1 << 16
+
+class SignatureVerifier:
+    def __init__(self,
+                 public_key_func,   # public_key_func(node_id: int) -> bytes
+                 n,                 # signers are node ids 0..n-1
+                 cache_size=VERIFIED_CACHE_SIZE):
+        self._public_key  = public_key_func
+        self.n            = n
+        self._cache_size  = cache_size
+        # state
+        self._verified    = OrderedDict() # (node_id, signature_b64) -> signed bytes, least recently used first
+        self._lock        = threading.Lock() # guards _verified, Ed25519 checks run outside it
+        self._verify_keys = {}      # node_id -> signing.VerifyKey
+        self.num_verified = 0       # signatures actually checked with Ed25519
+        self.num_cached   = 0       # signatures answered from the cache
+
+    def known_signers(self, signers):
+        # checked before any key lookup: an unknown id would make public_key_func fetch a key for it
+        return all(type(signer) is int and 0 <= signer < self.n for signer in signers)
+
+    def verify_key(self, node_id):
+        verify_key = self._verify_keys.get(node_id)
+        if verify_key is None:
+            verify_key = signing.VerifyKey(self._public_key(node_id))
+            self._verify_keys[node_id] = verify_key
+        return verify_key
+
+    def verify(self, node_id, signed_bytes, signature_b64):
+        return self.verify_batch([(node_id, signed_bytes, signature_b64)])
+
+    def verify_batch(self, pending):
+        # pending is a queue of (node_id, signed_bytes, signature_b64) triples,
+        # the whole batch is valid only if every signature checks out
+        pending = list(pending)
+        if not self.known_signers(node_id for node_id, _, _ in pending):
+            return False
+        to_check = {}
+        with self._lock:
+            for node_id, signed_bytes, signature_b64 in pending:
+                key = (node_id, signature_b64)
+                seen = self._verified.get(key, to_check.get(key))
+                if seen is not None:
+                    # a known signature is only good for the bytes it was made over
+                    if seen != signed_bytes:
+                        return False
+                    if key in self._verified:
+                        self._verified.move_to_end(key)
+                    self.num_cached += 1
+                    continue
+                to_check[key] = signed_bytes
+        for (node_id, signature_b64), signed_bytes in to_check.items():
+            try:
+                self.verify_key(node_id).verify(signed_bytes, b64decode_signature(signature_b64))
+            except (BadSignatureError, ValueError):
+                return False
+            self.num_verified += 1
+        # only remember signatures once the whole batch is known to be good
+        with self._lock:
+            self._verified.update(to_check)
+            while len(self._verified) > self._cache_size:
+                self._verified.popitem(last=False)
+        return True
+
+    def verify_chain(self, msg):
+        signers = chain_signers(msg)
+        if not signers or not self.known_signers(signers) or len(set(signers)) != len(signers):
+            return False
+        digest = chain_digest(msg["value"], msg["nonce"])
+        return self.verify_batch([(signer, chain_link(digest, signers[:k+1]), signature_b64)
+                                  for k, (signer, signature_b64) in enumerate(msg["signatures"])])
@@ -1,4 +1,11 @@
-import subprocess, sys, random, time, requests
+import sys, os, random, time, requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import start_cluster, stop_cluster, wait_ready, driver_args, node_url
+
+# --fork: fork generals from this process instead of starting new interpreters, --cluster=<file>: where they run
+fork, args = driver_args(sys.argv[1:])
+sys.argv = sys.argv[:1] + args
 
 m = int(sys.argv[1]) if len(sys.argv) >= 2 else 1
 n = 3*m + 1
@@ -6,27 +13,18 @@ n = 3*m + 1
 # randomly pick m traitors (could include commander 0)
 traitors = set(random.sample(range(n), m))
 print(f'Traitors: {traitors}')
+urls = [node_url(i, 8000+i) for i in range(n)]
 
-def spawn(mod, *args):
-    return subprocess.Popen([sys.executable, mod, *map(str, args)])
-
-procs = []
-# start every general
-for gid in range(n):
-    traitor = 1 if gid in traitors else 0
-    procs.append(spawn("general.py", gid, n, m, traitor))
-# let servers come up
-time.sleep(1)
+# start every general, wait until each answers
+procs = start_cluster([("general.py", [gid, n, m, 1 if gid in traitors else 0], gid, 8000+gid) for gid in range(n)], fork=fork)
+wait_ready(procs, [f"{urls[i]}/status" for i in range(n)])
 # kick off message cascade by telling the commander to issue his order
-requests.post("http://127.0.0.1:8000/start", json={"order": "attack" if random.random() < 0.5 else "retreat"})
+requests.post(f"{urls[0]}/start", json={"order": "attack" if random.random() < 0.5 else "retreat"})
 # wait until all generals report done
 while True:
     time.sleep(0.1)
-    try:
-        if all(requests.get(f"http://127.0.0.1:{8000+i}/status").json()["done"] for i in range(n)):
-            break # all done, exit waiting loop
-    except:
-        pass
+    if all(requests.get(f"{urls[i]}/status").json()["done"] for i in range(n)):
+        break # all done, exit waiting loop
 # tell each general to decide based on what they've seen so far
 print('Decisions:')
 decisions = set()
@@ -34,7 +32,7 @@ for i in range(n):
     if i in traitors:
         print(f'General {i} is a traitor')
     else:
-        value = requests.post(f"http://127.0.0.1:{8000+i}/decide").json()["value"]
+        value = requests.post(f"{urls[i]}/decide").json()["value"]
         print(f'General {i} decided {value}')
         decisions.add(value)
 if len(decisions) == 1:
@@ -42,5 +40,4 @@ if len(decisions) == 1:
 else:
     print('FAILURE: non-traitor generals decided differently')
 # stop all generals
-for p in procs:
-    p.kill()
+stop_cluster(procs)
@@ -1,9 +1,14 @@
-import sys, threading, requests, logging
+import sys, os, threading, requests, logging
 from concurrent.futures import ThreadPoolExecutor
 from collections import Counter, defaultdict
 from flask import Flask, request, jsonify
+from functools import lru_cache
 from math import perm
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address, node_url
+from metrics import Metrics
+
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
 if len(sys.argv) != 5:
@@ -15,13 +20,18 @@ session = requests.Session()
 executor = ThreadPoolExecutor(max_workers=64)
 id, n, m, traitor = map(int, sys.argv[1:])
 traitor = bool(traitor)
+peers = [node_url(i, 8000+i) for i in range(n)]
+metrics = Metrics(peers) # /metrics, also counts the messages /status reports, see ../../metrics.py
+metrics.register(app)
+net = metrics.client(session) # every outbound call goes through it
 received_values = {}
+fixed_values = {} # path -> OM value that no missing message can change
 done = False
 value = None
 
 def async_order(i, msg):
     def _post():
-        try: session.post(f"http://127.0.0.1:{8000+i}/order", json=msg)
+        try: net.post(f"{peers[i]}/order", json=msg)
         except: pass
     executor.submit(_post)
 
@@ -46,6 +56,41 @@ total_expected = sum(expected_messages(k) for k in range(m+1))
 #         receive_message(i, path=shortest_path())
 #     return expected_messages[id]
 
+@lru_cache(maxsize=None)
+def expected_paths(king_id):
+    # table of every path we expect a message along when king_id gives the order,
+    # mapped to the child paths whose OM(k-1) results go into the majority at that path
+    children = {}
+    def walk(path):
+        k = 1 + m - len(path)
+        children[path] = tuple(path + (i,) for i in range(n) if i not in path and i != id) if k > 0 else ()
+        for child in children[path]:
+            walk(child)
+    walk((king_id,))
+    return children
+
+def fixed_majority(path):
+    # the majority at path if it is already certain whatever the missing messages say, otherwise None
+    values = [received_values.get(path)] + [fixed_values.get(child) for child in expected_paths(path[0])[path]]
+    c = Counter(values)
+    if c["attack"] > c["retreat"] + c[None]:
+        return "attack"
+    if c["retreat"] >= c["attack"] + c[None]:
+        return "retreat"
+    return None
+
+def update_fixed(path):
+    # a new message can only fix the OM value at its own path and, in turn, at its ancestors
+    while path and path not in fixed_values:
+        fixed = fixed_majority(path)
+        if fixed is None:
+            return
+        fixed_values[path] = fixed
+        path = path[:-1]
+
+def decided_early():
+    return len(received_values) > 0 and tuple(shortest_path()[:1]) in fixed_values
+
 def all_messages_received():
     total_received = len(received_values)
     # print(f'node={id}: {total_received}/{total_expected}')
@@ -83,16 +128,28 @@ def other_value(v):
 def shortest_path():
     return list(min(received_values.keys(), key=len, default=None))
 
+def expects(path):
+    # False for anything no loyal general sends: node ids out of range, a king that can't be one (us),
+    # a path that isn't in the king's table, a second message along the same path
+    if not path or not all(type(i) is int and 0 <= i < n for i in path) or path[0] == id:
+        return False
+    return tuple(path) in expected_paths(path[0]) and tuple(path) not in received_values
+
 @app.route("/order", methods=["POST"])
 def order():
-    msg = request.get_json()
+    msg = request.get_json(silent=True) or {}
+    if not isinstance(msg, dict) or not isinstance(msg.get("path"), list) or "value" not in msg:
+        return "specify path and value", 400
     path = list(msg["path"])
     value = msg["value"]
+    if not expects(path):
+        return "unexpected path", 400
     k = 1 + m - len(path)
     received_values[tuple(path)] = value
     if k > 0:
         broadcast(path + [id], other_value(value) if traitor else value)
-    if all_messages_received():
+    update_fixed(tuple(path))
+    if all_messages_received() or decided_early():
         global done
         done = True
     return jsonify(ok=True)
@@ -101,6 +158,9 @@ def order():
 def decide():
     assert(done)
     global value
+    if value is None and decided_early():
+        # messages may still be in flight, but they can't change the outcome
+        value = fixed_values[tuple(shortest_path()[:1])]
     if value is None:
         value = OM(path=shortest_path())
     return jsonify(value=value)
@@ -123,7 +183,8 @@ def start():
 
 @app.route("/status")
 def status():
-    return jsonify(done=done)
+    return jsonify(done=done, messages=metrics.messages_received())
 
 if __name__ == "__main__":
-    app.run(port=8000+id, threaded=True)
+    host, port = node_address(id, 8000+id)
+    app.run(host=host, port=port, threaded=True)
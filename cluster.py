@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import runpy
+import requests
+import signal
+import socket
+import traceback
+import subprocess
+
+# starting local clusters for the drivers and benchmarks
+#
+# the driver binds every node's listening socket before starting any node and hands each node its socket,
+# through werkzeug's reloader protocol (WERKZEUG_RUN_MAIN + WERKZEUG_SERVER_FD): app.run() then serves on the
+# inherited socket instead of binding the port itself; connections queue in the kernel's backlog from the start,
+# so the workload can begin right away, no sleeping and no "connection refused" while a node is still importing Flask;
+# the first requests simply wait until the node accepts
+#
+# fork=True forks the nodes from the driver instead of starting a new interpreter for each: Flask and requests
+# are imported once, in the driver, and every node starts with them already loaded
+#
+# usage from a driver two levels down, e.g. bakery/python/driver.py:
+#   sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+#   from cluster import start_cluster, stop_cluster
+#   fork, args = driver_args(sys.argv[1:])
+#   procs = start_cluster([("worker.py", [num_loops, i, num_workers], i, 7000+i) for i in ...], fork=fork)
+#   wait_ready(procs, [f"{node_url(i, 7000+i)}/status" for i in ...])
+#
+# topology: without a config every node is on 127.0.0.1 (paxos: localhost) at its protocol's default port;
+# a cluster config file, named by $DCA_CLUSTER (drivers: --cluster=<file>) and read by every node and driver,
+# puts node ids on any host:port, e.g. to run two clusters side by side or to spread one over machines:
+#   {
+#     "transport": "http",
+#     "nodes": ["127.0.0.1:6000", "127.0.0.1:6001", {"address": "10.77.0.3:6000", "launch": ["ip", "netns", "exec", "dca2"]}],
+#     "prepare_quorum": 2,
+#     "accept_quorum": 2,
+#     "state_dir": "/var/tmp/dca"
+#   }
+# node ids index "nodes" (bakery and dme: 0 is the increment server, workers are 1..n);
+# a node with "launch" is started with that command prefix (a network namespace, ssh to another machine, ...),
+# it binds its own port there, and over ssh it also needs DCA_CLUSTER set on the remote side, e.g.
+#   "launch": ["ssh", "host2", "cd dca/paxos/multi && DCA_CLUSTER=/home/me/cluster.json"]
+# the quorum keys are the defaults for paxos nodes started without quorums on the command line,
+# state_dir is where the lease acceptors keep their state (default: the directory they run in)
+#
+# one network namespace per node on a bridge, for cross-host style runs on one machine (needs root):
+#   python3 cluster.py netns-up 5 6000 cluster.json
+#   python3 bench.py paxos-multi 5 500 8 --cluster=cluster.json
+#   python3 cluster.py netns-down 5
+
+LISTEN_BACKLOG = 128 # same as werkzeug's own
+READY_TIMEOUT  = 30.0 # seconds for all nodes of a cluster to answer
+CONFIG_ENV     = "DCA_CLUSTER"
+TRANSPORTS     = ("http",)
+
+configs = {} # path -> parsed config
+
+def load_config():
+    # the config named by $DCA_CLUSTER, parsed once per process; None without one
+    path = os.environ.get(CONFIG_ENV)
+    if not path:
+        return None
+    if path not in configs:
+        with open(path) as f:
+            config = json.load(f)
+        if config.get("transport", "http") not in TRANSPORTS:
+            raise ValueError(f"{path}: unknown transport {config['transport']!r}, supported: {', '.join(TRANSPORTS)}")
+        nodes = []
+        for entry in config.get("nodes", []):
+            entry = {"address": entry} if isinstance(entry, str) else dict(entry)
+            host, _, port = entry["address"].rpartition(":")
+            nodes.append({**entry, "host": host, "port": int(port)})
+        config["nodes"] = nodes
+        configs[path] = config
+    return configs[path]
+
+def node_config(node_id):
+    config = load_config()
+    if config is None:
+        return None
+    if not 0 <= node_id < len(config["nodes"]):
+        raise ValueError(f"node {node_id} is not in {os.environ[CONFIG_ENV]}, it has {len(config['nodes'])} nodes")
+    return config["nodes"][node_id]
+
+def node_address(node_id, default_port, default_host="127.0.0.1"):
+    # (host, port) node_id listens on
+    node = node_config(node_id)
+    return (node["host"], node["port"]) if node is not None else (default_host, default_port)
+
+def node_url(node_id, default_port, default_host="127.0.0.1"):
+    host, port = node_address(node_id, default_port, default_host)
+    return f"http://{host}:{port}"
+
+def config_value(key, default):
+    config = load_config()
+    return default if config is None else config.get(key, default)
+
+def state_path(node_id, default_port, prefix, default_host="localhost"):
+    # where a node keeps state across restarts: named after its address, so clusters on other ports started
+    # from the same directory never share it; in the config's "state_dir" if set, else the current directory
+    host, port = node_address(node_id, default_port, default_host)
+    state_dir = config_value("state_dir", ".")
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, f"{prefix}-{host}-{port}.state")
+
+def driver_args(argv):
+    # strips the flags every driver takes: --fork, and --cluster=<file>, which is passed on to the nodes as $DCA_CLUSTER
+    fork, args = False, []
+    for arg in argv:
+        if arg == "--fork":
+            fork = True
+        elif arg.startswith("--cluster="):
+            os.environ[CONFIG_ENV] = os.path.abspath(arg.split("=", 1)[1])
+        else:
+            args.append(arg)
+    return fork, args
+
+def listen(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind((host, port))
+    except OSError as e:
+        sock.close()
+        raise RuntimeError(f"can't bind {host}:{port}: {e.strerror}") from e
+    sock.listen(LISTEN_BACKLOG)
+    return sock
+
+def node_env(sock):
+    return {"WERKZEUG_RUN_MAIN": "true", "WERKZEUG_SERVER_FD": str(sock.fileno())}
+
+class ForkedNode:
+    # the parts of subprocess.Popen the drivers use
+    def __init__(self, pid, args):
+        self.pid = pid
+        self.args = args
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid != 0:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.poll() is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+def preload():
+    # everything a node imports that is slow to import, loaded once in the driver before forking
+    import flask, requests, werkzeug.serving
+
+def fork_node(directory, mod, args, sock, all_sockets, quiet):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid != 0:
+        return ForkedNode(pid, [sys.executable, mod, *map(str, args)])
+    # child: become `python3 mod args` started in directory, then never return into the driver's code
+    code = 1
+    try:
+        for other in all_sockets:
+            if other is not None and other is not sock:
+                other.close() # or a node killed later would keep accepting connections through its siblings
+        if quiet:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+        os.chdir(directory)
+        os.environ.update(node_env(sock))
+        sys.argv = [mod, *map(str, args)]
+        sys.path[0] = directory # the node's own imports, e.g. bc.py next to general.py
+        runpy.run_path(mod, run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+def spawn_node(directory, mod, args, sock, quiet):
+    return subprocess.Popen([sys.executable, mod, *map(str, args)], cwd=directory,
+                            stdout=subprocess.DEVNULL if quiet else None, stderr=subprocess.DEVNULL if quiet else None,
+                            env={**os.environ, **node_env(sock)}, pass_fds=[sock.fileno()])
+
+def launch_node(directory, mod, args, launch, quiet):
+    # started elsewhere (another network namespace or machine), nothing to hand over, it binds its own port
+    return subprocess.Popen([*launch, sys.executable, mod, *map(str, args)], cwd=directory,
+                            stdout=subprocess.DEVNULL if quiet else None, stderr=subprocess.DEVNULL if quiet else None)
+
+def start_cluster(nodes, fork=False, directory=None, default_host="127.0.0.1", quiet=False):
+    # nodes: (script, args, node_id, default_port) per node, scripts are run in directory (default: the current one),
+    # the cluster config may move a node elsewhere; quiet sends their stdout and stderr (werkzeug's request log)
+    # to /dev/null; returns Popen-like handles in the same order, stop them with stop_cluster()
+    directory = os.path.abspath(directory or os.getcwd())
+    if fork:
+        preload()
+    sockets, procs = [], []
+    try:
+        for _, _, node_id, default_port in nodes:
+            node = node_config(node_id) or {}
+            sockets.append(None if "launch" in node else listen(*node_address(node_id, default_port, default_host)))
+        for (mod, args, node_id, _), sock in zip(nodes, sockets):
+            if sock is None:
+                procs.append(launch_node(directory, mod, args, node_config(node_id)["launch"], quiet))
+            elif fork:
+                procs.append(fork_node(directory, mod, args, sock, sockets, quiet))
+            else:
+                procs.append(spawn_node(directory, mod, args, sock, quiet))
+        return procs
+    except BaseException:
+        stop_cluster(procs)
+        raise
+    finally:
+        # the nodes have their own copies now; ours would keep a killed node's port open
+        for sock in sockets:
+            if sock is not None:
+                sock.close()
+
+def wait_ready(procs, urls, timeout=READY_TIMEOUT):
+    # readiness probe, returns the moment every node has answered one request; any HTTP status counts,
+    # the server is up (byzantine-multi's /status wants a body); with start_cluster()'s sockets the request
+    # is accepted at once and answered when the node serves, connection errors only mean a node died
+    deadline = time.monotonic() + timeout
+    pending = list(urls)
+    while pending:
+        for p in procs:
+            if p.poll() is not None:
+                raise RuntimeError(f"{' '.join(map(str, p.args[1:]))} exited with {p.returncode} during startup")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RuntimeError(f"not ready after {timeout:.0f}s: {', '.join(pending)}")
+        try:
+            requests.get(pending[0], timeout=min(1.0, remaining))
+            pending.pop(0)
+        except requests.RequestException:
+            time.sleep(0.01)
+
+def stop_cluster(procs):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.wait()
+
+# network namespaces dca0..dca<n-1>, one per node, on bridge br-dca with 10.77.0.<i+1>/24,
+# and a config that launches node i in namespace dca<i>
+
+NETNS_BRIDGE = "br-dca"
+NETNS_SUBNET = "10.77.0"
+
+def ip(*args, check=True):
+    subprocess.run(["ip", *args], check=check)
+
+def netns_up(num_nodes, port, path):
+    if not 1 <= num_nodes <= 253:
+        raise ValueError("between 1 and 253 namespaces")
+    ip("link", "add", NETNS_BRIDGE, "type", "bridge")
+    ip("addr", "add", f"{NETNS_SUBNET}.254/24", "dev", NETNS_BRIDGE)
+    ip("link", "set", NETNS_BRIDGE, "up")
+    for i in range(num_nodes):
+        ns, veth = f"dca{i}", f"veth-dca{i}"
+        ip("netns", "add", ns)
+        ip("link", "add", veth, "type", "veth", "peer", "name", "eth0", "netns", ns)
+        ip("link", "set", veth, "master", NETNS_BRIDGE)
+        ip("link", "set", veth, "up")
+        ip("-n", ns, "addr", "add", f"{NETNS_SUBNET}.{i+1}/24", "dev", "eth0")
+        ip("-n", ns, "link", "set", "eth0", "up")
+        ip("-n", ns, "link", "set", "lo", "up")
+    config = {
+        "transport": "http",
+        "nodes": [{"address": f"{NETNS_SUBNET}.{i+1}:{port}", "launch": ["ip", "netns", "exec", f"dca{i}"]}
+                  for i in range(num_nodes)],
+    }
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+
+def netns_down(num_nodes):
+    for i in range(num_nodes):
+        ip("netns", "del", f"dca{i}", check=False)
+    ip("link", "del", NETNS_BRIDGE, check=False)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "netns-up":
+        netns_up(int(sys.argv[2]), int(sys.argv[3]), sys.argv[4])
+    elif len(sys.argv) == 3 and sys.argv[1] == "netns-down":
+        netns_down(int(sys.argv[2]))
+    else:
+        print("Usage: cluster.py netns-up <num_nodes> <port> <config.json> | netns-down <num_nodes>")
+        sys.exit(1)
@@ -1,52 +1,50 @@
 import logging
-import subprocess, requests, time, sys
+import requests, time, sys, os
 from multiprocessing import Process
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import start_cluster, stop_cluster, wait_ready, driver_args, node_url
+
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
 num_workers = 8
 num_loops   = 100
+# --fork: fork workers from this process instead of starting new interpreters, --cluster=<file>: where they run
+fork, args = driver_args(sys.argv[1:])
+if len(args) >= 1:
+    num_workers = int(args[0])
+if len(args) >= 2:
+    num_loops = int(args[1])
 
-if len(sys.argv) >= 2:
-    num_workers = int(sys.argv[1])
-if len(sys.argv) >= 3:
-    num_loops = int(sys.argv[2])
-
-def spawn(mod, *args):
-    return subprocess.Popen([sys.executable, mod, *map(str, args)])
+urls = [node_url(i, 7000+i) for i in range(num_workers+1)] # 0 is the increment server
 
 def wait_done(id_):
-    url = f"http://127.0.0.1:{7000+id_}/status"
+    url = f"{urls[id_]}/status"
     while not requests.get(url).json().get("done"):
         time.sleep(0.1)
 
 def main():
-    # start increment server
-    procs = [spawn("inc_server.py")]
-    # start workers
-    for wid in range(1, num_workers+1):
-        procs.append(spawn("worker.py", num_loops, wid, num_workers))
-    # allow ports to open
-    time.sleep(1)
+    # start increment server and workers, wait until each answers
+    nodes = [("inc_server.py", [], 0, 7000)]
+    nodes += [("worker.py", [num_loops, wid, num_workers], wid, 7000+wid) for wid in range(1, num_workers+1)]
+    procs = start_cluster(nodes, fork=fork)
+    wait_ready(procs, [f"{urls[node_id]}/status" for _, _, node_id, _ in nodes])
     # start workers
     for wid in range(1, num_workers+1):
-        requests.post(f"http://127.0.0.1:{7000+wid}/start")
+        requests.post(f"{urls[wid]}/start")
     # wait until all workers have done their part
     for wid in range(1, num_workers+1):
         wait_done(wid)
     # check results
     expected = num_workers * num_loops
-    observed = requests.get("http://127.0.0.1:7000/get").json()["value"]
+    observed = requests.get(f"{urls[0]}/get").json()["value"]
     print(f"Workers:    {num_workers}")
     print(f"Iterations: {num_loops}")
     print(f"Expected:   {expected}")
     print(f"Observed:   {observed}")
     print(f"Passed!" if expected == observed else "FAILED!")
     # clean up
-    for p in procs:
-        p.terminate()
-    for p in procs:
-        p.wait()
+    stop_cluster(procs)
 
 if __name__ == "__main__":
     main()
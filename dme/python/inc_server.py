@@ -1,6 +1,9 @@
-import logging
+import os, sys, logging
 from flask import Flask, jsonify, request, abort
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address
+
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
 app = Flask(__name__)
@@ -20,4 +23,5 @@ def set_value():
 
 if __name__ == "__main__":
     # one thread so GET and SET can interleave
-    app.run(port=7000, threaded=False)
+    host, port = node_address(0, 7000)
+    app.run(host=host, port=port, threaded=False)
@@ -1,20 +1,50 @@
-import sys, time, threading, requests, json, logging
+import sys, os, time, threading, json, logging, queue, requests
 from flask import Flask, request, jsonify
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address, node_url
+from faults import Faults
+from metrics import Metrics
+
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
 num_loops   = int(sys.argv[1])  # e.g. 1_000
 my_id       = int(sys.argv[2])  # 1 .. n
 num_workers = int(sys.argv[3])  # e.g. 8
+peers       = [node_url(i, 7000+i) for i in range(num_workers+1)] # 0 is the increment server
+faults      = Faults(peers, my_id)   # delay/loss/partitions injected per link at runtime, see ../../faults.py
+metrics     = Metrics(peers)         # /metrics, also counts the messages /status reports, see ../../metrics.py
+net         = metrics.client(faults) # every outbound call goes through both
+lock_wait   = metrics.histogram("dca_lock_wait_seconds", "Seconds from asking for the lock until holding it")
 
 app = Flask(__name__)
+faults.register(app)
+metrics.register(app)
 clock            = 0                # Lamport logical clock
 requesting       = False            # am I trying to get the lock to run my critical section?
 request_ts       = 0                # timestamp of my current request
-replies_needed   = 0                # remaining replies to receive
-deferred_replies = set()            # worker IDs whose reply is deferred
+replied          = set()            # worker IDs that replied to my current request
+deferred_replies = {}               # worker ID -> timestamp of its request whose reply is deferred
 done             = False            # set to True when loops finished
 guard_lock       = threading.Lock() # guards all variables above
+latencies        = []               # seconds per lock + critical section + unlock
+# Ricart-Agrawala needs every request and reply delivered: messages go into a queue per peer, whose sender
+# thread delivers them in order and retries while the link is down, so no handler waits on the network
+outboxes         = {i: queue.Queue() for i in range(1, num_workers + 1) if i != my_id}
+RETRY_INTERVAL   = 0.05             # seconds between delivery attempts to an unreachable peer
+
+def send(i, path, body):
+    outboxes[i].put((path, body))
+
+def sender(i):
+    while True:
+        path, body = outboxes[i].get()
+        while True:
+            try:
+                net.post(f"{peers[i]}{path}", json=body)
+                break
+            except requests.RequestException:
+                time.sleep(RETRY_INTERVAL)
 
 @app.route("/request", methods=["POST"])
 def endpoint_request():
@@ -26,18 +56,21 @@ def endpoint_request():
         grant_request = (not requesting) or (ts, id) < (request_ts, my_id)
         if grant_request:
             # reply immediately
-            requests.post(f"http://127.0.0.1:{7000+id}/reply", json={"id": my_id, "ts": clock})
+            send(id, "/reply", {"id": my_id, "ts": clock, "request_ts": ts})
         else:
-            deferred_replies.add(id)
+            deferred_replies[id] = ts
     return jsonify(ok=True)
 
 @app.route("/reply", methods=["POST"])
 def endpoint_reply():
+    id = int(request.get_json()["id"])
     ts = int(request.get_json()["ts"])
-    global clock, replies_needed
+    global clock
     with guard_lock:
         clock = max(clock, ts) + 1
-        replies_needed -= 1 # we assume each worker only replies once
+        # a message is retried if its delivery looked failed, so the same reply may arrive twice
+        if requesting and request.get_json().get("request_ts") == request_ts:
+            replied.add(id)
     return jsonify(ok=True)
 
 @app.route("/start", methods=["POST"])
@@ -47,48 +80,54 @@ def endpoint_start():
 
 @app.route("/status")
 def endpoint_status():
-    return jsonify(done=done)
+    # latencies only once done, /status is polled while the workload runs
+    return jsonify(done=done, messages=metrics.messages_received(), latencies=latencies if done else None)
 
 def lock():
-    global clock, requesting, request_ts, replies_needed
+    global clock, requesting, request_ts
     with guard_lock:
         requesting = True
         clock += 1
         request_ts = clock
-        replies_needed = num_workers - 1
+        replied.clear()
     # broadcast request
-    for i in range(1, num_workers + 1):
-        if i != my_id:
-            requests.post(f"http://127.0.0.1:{7000+i}/request", json={"ts": request_ts, "id": my_id})
+    for i in outboxes:
+        send(i, "/request", {"ts": request_ts, "id": my_id})
     # wait for all replies
     while True:
         with guard_lock:
-            if replies_needed == 0:
+            if len(replied) == num_workers - 1:
                 break
         time.sleep(0.001)
 
 def unlock():
     global requesting
     with guard_lock:
-        pending = list(deferred_replies)
+        pending = dict(deferred_replies)
         deferred_replies.clear()
         requesting = False
-    for i in pending:
-        requests.post(f"http://127.0.0.1:{7000+i}/reply", json={"id": my_id, "ts": clock})
+        for i, ts in pending.items():
+            send(i, "/reply", {"id": my_id, "ts": clock, "request_ts": ts})
 
 def critical_section():
-    curr = requests.get(f"http://127.0.0.1:7000/get").json()["value"]     # get
-    requests.post(f"http://127.0.0.1:7000/set", json={"value": curr + 1}) # set
+    curr = net.get(f"{peers[0]}/get").json()["value"]     # get
+    net.post(f"{peers[0]}/set", json={"value": curr + 1}) # set
 
 def run_worker():
     global done
     for i in range(num_loops):
+        started = time.perf_counter()
         lock()
+        lock_wait.observe(time.perf_counter() - started)
         critical_section()
         unlock()
+        latencies.append(time.perf_counter() - started)
         #print(f"Worker {my_id} at {i}")
     done = True
     print(f"Worker {my_id} Done.", flush=True)
 
 if __name__ == "__main__":
-    app.run(port=7000+my_id, threaded=False)
+    for i in outboxes:
+        threading.Thread(target=sender, args=(i,), daemon=True).start()
+    host, port = node_address(my_id, 7000+my_id)
+    app.run(host=host, port=port, threaded=False)
@@ -0,0 +1,105 @@
+import time
+import random
+import requests
+from flask import request, jsonify
+
+# fault and latency injection for node-to-node calls, to benchmark protocols under adverse networks
+# without killing processes: every outbound call of a node goes through its Faults object, which applies
+# the rules for the link to the peer being called, then makes the call with requests (or a Session)
+#
+# rules per peer id, "*" for every peer without its own, all keys optional:
+#   delay, jitter  seconds added before the call goes out: delay + uniform(-jitter, jitter)
+#   loss           probability that a transmission is lost; like TCP, it's retransmitted after an RTO that doubles
+#   partitioned    true: the call fails at once like an unreachable peer (requests.ConnectionError), the message is lost
+# rules live in the calling node, so a link has a direction; responses come back unaffected, the delay is per call
+# and waiting for a fault counts against the caller's timeout, so protocols see them as a slow or dead network
+#
+# set at runtime on each node (bench.py --scenario=... does this for a whole cluster), an empty "links" heals all:
+#   curl -X POST http://127.0.0.1:5000/faults -H "Content-Type: application/json" -d '{"links": {"1": {"delay": 0.05, "jitter": 0.01}, "2": {"partitioned": true}}}'
+#   curl -X POST http://127.0.0.1:5000/faults -H "Content-Type: application/json" -d '{"links": {}}'
+#   curl http://127.0.0.1:5000/faults
+#
+# usage in a node, with peers the list of base URLs indexed by node id:
+#   net = Faults(peers, node_id)              # or Faults(peers, node_id, session) to call through a Session
+#   net.register(app)                         # adds /faults
+#   net.post(f"{peers[i]}/reply", json=...)   # instead of requests.post
+
+RTO_INITIAL = 0.2 # seconds, Linux's minimum TCP retransmission timeout
+LINK_KEYS   = {"delay": float, "jitter": float, "loss": float, "partitioned": bool}
+
+def base_url(url):
+    # "http://host:port/path?query" -> "http://host:port", the form peers are listed in
+    end = url.find("/", url.find("//") + 2)
+    return url if end < 0 else url[:end]
+
+def parse_rule(rule):
+    if not isinstance(rule, dict) or not set(rule) <= set(LINK_KEYS):
+        raise ValueError(f"a link rule is an object with keys {', '.join(LINK_KEYS)}, got {rule!r}")
+    rule = {key: LINK_KEYS[key](value) for key, value in rule.items()}
+    if rule.get("delay", 0.0) < 0 or rule.get("jitter", 0.0) < 0 or not 0 <= rule.get("loss", 0.0) < 1:
+        raise ValueError(f"need delay >= 0, jitter >= 0 and 0 <= loss < 1, got {rule!r}")
+    return rule
+
+class Faults:
+    def __init__(self, peers, node_id, transport=requests):
+        self.transport = transport
+        self.node_id = node_id
+        self.peer_ids = {url: i for i, url in enumerate(peers)}
+        self.links = {} # peer id or "*" -> rule, replaced as a whole so calls read it without locking
+
+    def set_links(self, links):
+        parsed = {}
+        for peer, rule in links.items():
+            parsed[peer if peer == "*" else int(peer)] = parse_rule(rule)
+        self.links = parsed
+
+    def rule(self, peer):
+        links = self.links
+        return links.get(peer, links.get("*"))
+
+    def wait(self, seconds, deadline, url):
+        # sleep, but not past the caller's timeout
+        if deadline is not None and time.monotonic() + seconds >= deadline:
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            raise requests.exceptions.ConnectTimeout(f"injected fault: {url} timed out")
+        time.sleep(seconds)
+
+    def inject(self, url, timeout):
+        # applies the link's rule before a call, returns what's left of the caller's timeout for the call itself
+        if not self.links:
+            return timeout
+        peer = self.peer_ids.get(base_url(url))
+        if peer is None or peer == self.node_id or self.rule(peer) is None:
+            return timeout
+        deadline = time.monotonic() + timeout if isinstance(timeout, (int, float)) else None
+        rule = self.rule(peer)
+        if rule.get("partitioned"):
+            # fail fast, a caller holding a lock mustn't stall until the heal; senders that need delivery retry
+            raise requests.exceptions.ConnectionError(f"injected fault: {url} is partitioned")
+        rto = RTO_INITIAL
+        while random.random() < rule.get("loss", 0.0):
+            self.wait(rto, deadline, url)
+            rto *= 2
+        delay = rule.get("delay", 0.0) + random.uniform(-1, 1) * rule.get("jitter", 0.0)
+        if delay > 0:
+            self.wait(delay, deadline, url)
+        return timeout if deadline is None else max(0.001, deadline - time.monotonic())
+
+    def get(self, url, **kwargs):
+        kwargs["timeout"] = self.inject(url, kwargs.get("timeout"))
+        return self.transport.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        kwargs["timeout"] = self.inject(url, kwargs.get("timeout"))
+        return self.transport.post(url, **kwargs)
+
+    def register(self, app):
+        @app.route("/faults", methods=["GET", "POST"])
+        def endpoint_faults():
+            if request.method == "POST":
+                data = request.get_json(force=True, silent=True) or {}
+                try:
+                    self.set_links(data.get("links", {}))
+                except (ValueError, TypeError, AttributeError) as e:
+                    return jsonify(success=False, error=str(e)), 400
+            return jsonify(success=True, links={str(peer): rule for peer, rule in self.links.items()})
@@ -0,0 +1,190 @@
+import time
+import bisect
+import threading
+import requests
+from flask import request, Response
+from faults import base_url
+
+# Prometheus-style /metrics for the nodes, in the text exposition format:
+#   curl http://127.0.0.1:5000/metrics
+# every node exports
+#   dca_messages_received_total{endpoint}     requests received, per route ("/order"), "unmatched" for 404s
+#   dca_messages_sent_total{endpoint,peer}    requests sent through metrics.client(), peer is the node id
+#   dca_rpc_seconds{peer}                     histogram of those calls' latencies, faults injected below included
+#   dca_rpc_errors_total{peer}                calls that raised (timeouts, refused connections)
+# and adds its own families, e.g. lock wait time, Paxos phase durations, rounds decided
+#
+# updates must stay off the hot paths' locks: every thread writes to its own shard, a plain dict only it
+# touches, /metrics adds the shards up; shards are keyed by thread ident, werkzeug starts a thread per
+# connection and idents are reused once a thread is gone, so their number follows peak concurrency,
+# not the number of requests
+#
+# usage in a node, with peers the list of base URLs indexed by node id:
+#   metrics = Metrics(peers)
+#   metrics.register(app)                      # adds /metrics, counts received requests
+#   net = metrics.client(Faults(peers, id))    # or metrics.client() around requests, or around a Session
+#   lock_wait = metrics.histogram("dca_lock_wait_seconds", "Seconds from asking for the lock until holding it")
+#   lock_wait.observe(seconds)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def sample(name, label_names, label_values, value):
+    if label_names:
+        labels = ",".join(f'{k}="{label_value(v)}"' for k, v in zip(label_names, label_values))
+        name = f"{name}{{{labels}}}"
+    return f"{name} {value}"
+
+class CounterFamily:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def inc(self, *label_values, value=1):
+        counters = self.metrics.shard()[0]
+        key = (self.name, label_values)
+        counters[key] = counters.get(key, 0) + value
+
+class HistogramFamily:
+    def __init__(self, metrics, name, labels, buckets):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        histograms = self.metrics.shard()[1]
+        key = (self.name, label_values)
+        if (h := histograms.get(key)) is None:
+            # a count per bucket and one for +Inf, then sum and count
+            h = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        h[bisect.bisect_left(self.buckets, value)] += 1
+        h[-2] += value
+        h[-1] += 1
+
+class GaugeFamily:
+    # read on scrape, nothing to update: callback() returns the value, or {label values tuple: value} with labels
+    def __init__(self, name, labels, callback):
+        self.name = name
+        self.labels = labels
+        self.callback = callback
+
+class Metrics:
+    def __init__(self, peers=()):
+        self.peer_ids = {url: str(i) for i, url in enumerate(peers)}
+        self.shards = {} # thread ident -> (counters, histograms)
+        self.lock = threading.Lock() # only for adding shards and reading them all
+        self.families = {} # name -> (type, help, family), in the order declared
+        self.received = self.counter("dca_messages_received_total", "Requests received, per endpoint", ("endpoint",))
+        self.sent = self.counter("dca_messages_sent_total", "Requests sent to peers, per endpoint", ("endpoint", "peer"))
+        self.rpc = self.histogram("dca_rpc_seconds", "Latency of calls to peers", ("peer",))
+        self.rpc_errors = self.counter("dca_rpc_errors_total", "Calls to peers that failed", ("peer",))
+
+    def shard(self):
+        ident = threading.get_ident()
+        if (shard := self.shards.get(ident)) is None:
+            with self.lock:
+                shard = self.shards[ident] = ({}, {})
+        return shard
+
+    def counter(self, name, help, labels=()):
+        family = CounterFamily(self, name, labels)
+        self.families[name] = ("counter", help, family)
+        return family
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        family = HistogramFamily(self, name, labels, buckets)
+        self.families[name] = ("histogram", help, family)
+        return family
+
+    def gauge(self, name, help, callback, labels=(), kind="gauge"):
+        # kind="counter" for totals that are cheaper to compute on scrape than to count
+        family = GaugeFamily(name, labels, callback)
+        self.families[name] = (kind, help, family)
+        return family
+
+    def totals(self):
+        with self.lock:
+            shards = [(dict(counters), {key: list(h) for key, h in histograms.items()})
+                      for counters, histograms in self.shards.values()]
+        counters, histograms = {}, {}
+        for shard_counters, shard_histograms in shards:
+            for key, value in shard_counters.items():
+                counters[key] = counters.get(key, 0) + value
+            for key, h in shard_histograms.items():
+                total = histograms.setdefault(key, [0] * len(h))
+                for i, value in enumerate(h):
+                    total[i] += value
+        return counters, histograms
+
+    def messages_received(self):
+        # {endpoint: count}, for /status
+        counters, _ = self.totals()
+        return {labels[0]: value for (name, labels), value in counters.items() if name == self.received.name}
+
+    def render(self):
+        counters, histograms = self.totals()
+        lines = []
+        for name, (kind, help, family) in self.families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if isinstance(family, CounterFamily):
+                for (key_name, labels), value in sorted(counters.items()):
+                    if key_name == name:
+                        lines.append(sample(name, family.labels, labels, value))
+            elif isinstance(family, HistogramFamily):
+                for (key_name, labels), h in sorted(histograms.items()):
+                    if key_name != name:
+                        continue
+                    cumulative = 0
+                    for le, count in zip([*map(str, family.buckets), "+Inf"], h):
+                        cumulative += count
+                        lines.append(sample(f"{name}_bucket", (*family.labels, "le"), (*labels, le), cumulative))
+                    lines.append(sample(f"{name}_sum", family.labels, labels, h[-2]))
+                    lines.append(sample(f"{name}_count", family.labels, labels, h[-1]))
+            else:
+                value = family.callback()
+                for labels, v in sorted(value.items()) if family.labels else [((), value)]:
+                    lines.append(sample(name, family.labels, labels, v))
+        return "\n".join(lines) + "\n"
+
+    def register(self, app):
+        @app.before_request
+        def count_received():
+            # the route, not request.path: every path a client makes up would be a new series
+            self.received.inc(request.url_rule.rule if request.url_rule is not None else "unmatched")
+
+        @app.route("/metrics")
+        def endpoint_metrics():
+            return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+    def client(self, transport=requests):
+        return MeteredClient(self, transport)
+
+class MeteredClient:
+    # get/post like requests (or whatever it wraps), counting and timing every call per peer
+    def __init__(self, metrics, transport):
+        self.metrics = metrics
+        self.transport = transport
+
+    def call(self, method, url, kwargs):
+        base = base_url(url)
+        peer = self.metrics.peer_ids.get(base, base)
+        started = time.perf_counter()
+        try:
+            return method(url, **kwargs)
+        except requests.RequestException:
+            self.metrics.rpc_errors.inc(peer)
+            raise
+        finally:
+            self.metrics.sent.inc(url[len(base):].split("?", 1)[0], peer)
+            self.metrics.rpc.observe(time.perf_counter() - started, peer)
+
+    def get(self, url, **kwargs):
+        return self.call(self.transport.get, url, kwargs)
+
+    def post(self, url, **kwargs):
+        return self.call(self.transport.post, url, kwargs)
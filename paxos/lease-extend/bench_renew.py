@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import start_cluster, stop_cluster, wait_ready, driver_args, node_url, state_path
+
+# starts a local cluster, has node 0 acquire a batch of leases and keep them,
+# then reports how renewals went: fast (single /renew) vs full prepare/propose rounds,
+# renewal latency and messages per minute per lease;
+# compare quorum splits with e.g. python3 bench_renew.py 5 100 30 3 3 vs python3 bench_renew.py 5 100 30 4 2
+# python3 bench_renew.py [n] [num_leases] [seconds] [prepare_quorum accept_quorum] [--fork] [--cluster=<file>]
+
+fork, args = driver_args(sys.argv[1:])
+n = int(args[0]) if len(args) >= 1 else 3
+num_leases = int(args[1]) if len(args) >= 2 else 100
+seconds = float(args[2]) if len(args) >= 3 else 30.0
+quorums = args[3:5] # passed on to the nodes, majorities if not given
+urls = [node_url(i, 5000+i, "localhost") for i in range(n)]
+
+def renew_stats():
+    return requests.get(f"{urls[0]}/status").json()["renew_stats"]
+
+# fresh cluster: leases restored from an earlier run would still be held
+for i in range(n):
+    path = state_path(i, 5000+i, "acceptor")
+    if os.path.exists(path):
+        os.remove(path)
+procs = start_cluster([("node.py", [i, n, *quorums], i, 5000+i) for i in range(n)], fork=fork, default_host="0.0.0.0", quiet=True)
+try:
+    # nodes without a state file wait LEASE_SECONDS before serving
+    wait_ready(procs, [f"{url}/status" for url in urls])
+    names = [f"shard-{i}" for i in range(num_leases)]
+    result = requests.post(f"{urls[0]}/start", json={"leases": names}).json()
+    print(f"Acquire: {result['status']}")
+    before = renew_stats()
+    time.sleep(seconds)
+    after = renew_stats()
+    messages = after["messages_sent"] - before["messages_sent"]
+    print(f"Nodes:                   {n}")
+    print(f"Leases:                  {num_leases}")
+    print(f"Quorums:                 {'/'.join(quorums) if quorums else 'majority'}")
+    print(f"Renewals fast/full/fail: {after['renewals_fast'] - before['renewals_fast']}"
+          f"/{after['renewals_full'] - before['renewals_full']}"
+          f"/{after['renewals_failed'] - before['renewals_failed']}")
+    print(f"Renew latency:           p50={after.get('renew_latency_p50', 0)*1000:.1f}ms p99={after.get('renew_latency_p99', 0)*1000:.1f}ms")
+    print(f"Messages/minute/lease:   {messages / (seconds / 60) / num_leases:.3f}")
+finally:
+    stop_cluster(procs)
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import random
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from timers import TimerScheduler
+from stats import percentile
+
+# compares per-lease threading.Timer objects with the shared TimerScheduler:
+# - restart: every lease restarts its acceptor expiry, local expiry and extension timers
+#   in a loop, like a busy node accepting proposals and extensions (timer ops/s, thread count)
+# - fire: many short timers fire, how late are they (p50/p99)?
+# python3 bench_timers.py [num_leases] [seconds]
+
+num_leases = int(sys.argv[1]) if len(sys.argv) >= 2 else 100
+seconds = float(sys.argv[2]) if len(sys.argv) >= 3 else 2.0
+LEASE_SECONDS = 5.0
+
+class ThreadingTimers:
+    # what node.py used to do: cancel, then start a new threading.Timer (a new OS thread)
+    def call_later(self, delay, func, background=False):
+        timer = threading.Timer(delay, func)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+def bench_restart(name, timers):
+    slots = [[None, None, None] for _ in range(num_leases)] # acceptor, local lease, extension timer
+    ops = 0
+    peak_threads = threading.active_count()
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for slot in slots:
+            for k, delay in enumerate([LEASE_SECONDS, LEASE_SECONDS, LEASE_SECONDS / 2]):
+                if slot[k] is not None:
+                    slot[k].cancel()
+                slot[k] = timers.call_later(delay, lambda: None)
+                ops += 1
+        peak_threads = max(peak_threads, threading.active_count())
+    elapsed = time.perf_counter() - started
+    for slot in slots:
+        for timer in slot:
+            timer.cancel()
+    print(f"{name:<10} restart: {ops / elapsed:>10,.0f} timer ops/s, peak threads {peak_threads}")
+
+def bench_fire(name, timers, num_timers=2000):
+    lateness = []
+    fired = threading.Semaphore(0)
+    def on_fire(deadline):
+        lateness.append(time.monotonic() - deadline)
+        fired.release()
+    for _ in range(num_timers):
+        delay = random.uniform(0.0, 0.2)
+        deadline = time.monotonic() + delay
+        timers.call_later(delay, lambda deadline=deadline: on_fire(deadline))
+    for _ in range(num_timers):
+        fired.acquire()
+    print(f"{name:<10} fire:    {num_timers} timers, lateness p50={percentile(lateness, 50)*1000:.2f}ms p99={percentile(lateness, 99)*1000:.2f}ms")
+
+print(f"{num_leases} leases, 3 timers each")
+bench_restart("threading", ThreadingTimers())
+time.sleep(0.5) # let cancelled timer threads exit
+bench_restart("scheduler", TimerScheduler())
+bench_fire("threading", ThreadingTimers())
+bench_fire("scheduler", TimerScheduler())
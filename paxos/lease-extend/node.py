@@ -1,110 +1,357 @@
+import os
 import sys
 import json
 import time
-import requests
 import threading
+from collections import deque, namedtuple
 from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import Flask, request, jsonify, Response
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address, node_url, config_value, state_path
+from metrics import Metrics
+from timers import TimerScheduler
+from stats import percentile
+
 # start nodes:
 # python3 node.py 0 3
 # python3 node.py 1 3
 # python3 node.py 2 3
 # try to acquire a lease for 5 seconds:
 # curl -X POST http://localhost:5000/start
-# release the lease:
+# while a node holds leases it renews them halfway through, with a single /renew per peer if it can
+# try to acquire many named leases at once, they travel together in one prepare/propose per peer:
+# curl -X POST http://localhost:5000/start -H "Content-Type: application/json" -d '{"leases": ["shard-0", "shard-1"]}'
+# release the lease(s):
 # curl -X POST http://localhost:5000/stop
-
-if len(sys.argv) != 3:
-    print("Usage: node.py <id> <n>")
+# curl -X POST http://localhost:5000/stop -H "Content-Type: application/json" -d '{"leases": ["shard-1"]}'
+# who holds a lease, for how long, and its fencing token (pass it along with writes, storage rejects smaller tokens):
+# curl http://localhost:5000/lease?name=shard-0
+# acceptors append the leases they change to acceptor-<host>-<port>.state (in the cluster config's state_dir
+# if set), so a restarted node doesn't have to sit out a whole lease
+# flexible quorums, all nodes must be started with the same ones, e.g. 5 nodes, prepare to 4, propose/renew to 2:
+# python3 node.py 0 5 4 2
+
+if len(sys.argv) not in (3, 5):
+    print("Usage: node.py <id> <n> [<prepare_quorum> <accept_quorum>]")
     sys.exit(1)
 
-id, n = map(int, sys.argv[1:])
-port = 5000 + id
-peers = [f"http://localhost:{5000+i}" for i in range(n)]
+id, n = map(int, sys.argv[1:3])
+host, port = node_address(id, 5000 + id, "0.0.0.0")
+peers = [node_url(i, 5000+i, "localhost") for i in range(n)]
+# /metrics, see ../../metrics.py; every outbound call goes through net
+metrics = Metrics(peers)
+net = metrics.client()
+phase_seconds = metrics.histogram("dca_paxos_phase_seconds", "Seconds per batched prepare/propose/renew/release of this node",
+                                  ("phase",))
+rounds_decided = metrics.counter("dca_paxos_rounds_decided_total", "Leases this node won or extended")
 n_majority = n//2 + 1
+# Flexible Paxos: prepare and propose quorums don't have to be majorities, they only have to intersect,
+# so a new proposer's prepare always reaches an acceptor that knows about a live lease;
+# from the command line, else from the cluster config, else majorities
+n_prepare_quorum, n_accept_quorum = map(int, sys.argv[3:5]) if len(sys.argv) == 5 else \
+    (config_value("prepare_quorum", n_majority), config_value("accept_quorum", n_majority))
+if not (1 <= n_prepare_quorum <= n and 1 <= n_accept_quorum <= n and n_prepare_quorum + n_accept_quorum > n):
+    print(f"Quorums don't intersect: need prepare_quorum + accept_quorum > n, "
+          f"got {n_prepare_quorum} + {n_accept_quorum} with n={n}")
+    sys.exit(1)
 # globally known maximal lease time
 LEASE_SECONDS = 5.0
+# lease name used when a request doesn't name one
+DEFAULT_LEASE = "default"
+# acceptor promises and accepted leases survive restarts here: a log with a line per changed lease,
+# rewritten with only the latest line per lease once it has this many times more lines than leases
+STATE_FILE = state_path(id, 5000+id, "acceptor")
+STATE_COMPACT_FACTOR = 4
 
 app = Flask(__name__)
+metrics.register(app)
+# single timer thread shared by acceptor expiry, local lease expiry and extension timers
+scheduler = TimerScheduler()
+
+def read_boot_id():
+    # monotonic clocks restart on reboot, so saved monotonic deadlines are only comparable within one boot
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+BOOT_ID = read_boot_id()
+
+def save_state(path, text):
+    # write to a temp file and rename it over the old one, so a crash leaves either the old or the new state
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load_log(path):
+    # {lease name: its last record}, None without a log; a torn last line from a crash mid-append is ignored
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    records = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        records[record["name"]] = record
+    return records
+
+# immutable view of a lease this node holds, replaced (never mutated) whenever the lease changes,
+# so "am I still the owner?" is a dict lookup and a clock read, without taking the proposer lock;
+# the fencing token is the winning proposal id, which grows with every change of ownership
+LeaseSnapshot = namedtuple("LeaseSnapshot", ["fencing_token", "expires_at"])  # expires_at is time.monotonic()
 
 class PaxosLeaseAcceptor:
     def __init__(self):
         self._lock = threading.Lock()
-        self.state = SimpleNamespace()
-        self.state.promised_n = None
-        self.state.accepted_n = None
-        self.state.accepted_value = None
-        self._lease_timer = None  # not exposed in state/__dict__
-
-    def _restart_timer(self, lease_seconds):
-        if self._lease_timer is not None:
-            self._lease_timer.cancel()
-        self._lease_timer = threading.Timer(lease_seconds, self._on_timeout)
-        self._lease_timer.daemon = True
-        self._lease_timer.start()
-
-    def _on_timeout(self):
+        self.leases = {}          # lease name -> SimpleNamespace(promised_n, accepted_n, accepted_value)
+        self._lease_timers = {}   # lease name -> expiry timer, not exposed in leases/__dict__
+        self._dirty = set()       # lease names changed since they were last written to STATE_FILE
+        # one writer at a time, outside _lock: handlers keep changing leases while a batch is fsynced
+        self._persist_lock = threading.Lock()
+        self._log = None          # STATE_FILE opened for appending
+        self._log_lines = 0
+
+    def _get_lease_state(self, name):
+        if name not in self.leases:
+            self.leases[name] = SimpleNamespace(
+                promised_n=None,
+                accepted_n=None,
+                accepted_value=None,
+            )
+        return self.leases[name]
+
+    def _cancel_timer(self, name):
+        timer = self._lease_timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _restart_timer(self, name, accepted_value, lease_seconds):
+        self._cancel_timer(name)
+        self._lease_timers[name] = scheduler.call_later(
+            lease_seconds, lambda: self._on_timeout(name, accepted_value))
+
+    def _on_timeout(self, name, accepted_value):
         with self._lock:
-            self.state.accepted_n = None
-            self.state.accepted_value = None
-            self._lease_timer = None
-
-    def on_prepare(self, proposal_id):
+            st = self.leases[name]
+            # a timer that fired just as a newer proposal or renewal was accepted must not clear it
+            if st.accepted_value is not accepted_value:
+                return
+            st.accepted_n = None
+            st.accepted_value = None
+            self._lease_timers.pop(name, None)
+
+    def _record(self, name):
+        # call with self._lock held
+        st = self.leases[name]
+        timer = self._lease_timers.get(name)
+        return json.dumps({
+            "name": name,
+            "boot_id": BOOT_ID,
+            "promised_n": st.promised_n,
+            "accepted_n": st.accepted_n,
+            "accepted_value": st.accepted_value,
+            "lease_deadline": timer.deadline if st.accepted_value is not None and timer is not None else None,  # time.monotonic()
+        })
+
+    def persist(self, force=False):
+        # the endpoints call this once per batch, before answering: a restarted acceptor must not forget what it
+        # promised or accepted; appends only the leases changed since the last write, with one fsync, and holds
+        # the acceptor lock only to collect them; a batch whose changes another thread collected waits here
+        # until that write is done, so nobody answers before their changes are on disk
+        with self._persist_lock:
+            with self._lock:
+                compact = force or self._log is None or \
+                    self._log_lines + len(self._dirty) > STATE_COMPACT_FACTOR * len(self.leases)
+                if not self._dirty and not compact:
+                    return
+                lines = [self._record(name) for name in (self.leases if compact else self._dirty)]
+                self._dirty = set()
+            if compact:
+                # rewrite the log with one line per lease, a crash leaves either the old or the new log
+                if self._log is not None:
+                    self._log.close()
+                save_state(STATE_FILE, "".join(f"{line}\n" for line in lines))
+                self._log = open(STATE_FILE, "a")
+                self._log_lines = len(lines)
+            else:
+                self._log.write("".join(f"{line}\n" for line in lines))
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._log_lines += len(lines)
+
+    def restore(self):
+        # returns False without a usable state file, the caller then has to wait out LEASE_SECONDS
+        saved = load_log(STATE_FILE)
+        if saved is None:
+            return False
         with self._lock:
-            if self.state.promised_n is None or proposal_id > self.state.promised_n:
-                self.state.promised_n = proposal_id
+            for name, lease in saved.items():
+                st = self._get_lease_state(name)
+                st.promised_n = lease["promised_n"]
+                accepted_value = lease["accepted_value"]
+                if accepted_value is None:
+                    continue
+                same_boot = BOOT_ID is not None and lease["boot_id"] == BOOT_ID
+                if same_boot and lease["lease_deadline"] is not None:
+                    remaining = lease["lease_deadline"] - time.monotonic()
+                else:
+                    # rebooted (or can't tell): we don't know how long we were down, assume the lease just started
+                    remaining = accepted_value["lease_seconds"]
+                if remaining > 0:
+                    st.accepted_n = lease["accepted_n"]
+                    st.accepted_value = {**accepted_value, "lease_expires_at": time.time() + remaining}
+                    self._restart_timer(name, st.accepted_value, remaining)
+        return True
+
+    def on_prepare(self, name, proposal_id):
+        with self._lock:
+            st = self._get_lease_state(name)
+            if st.promised_n is None or proposal_id > st.promised_n:
+                st.promised_n = proposal_id
+                self._dirty.add(name)
                 success = True
             else:
                 success = False
-            # state.accepted_value may be None (empty) or a current lease
-            return success, self.state
+            # st.accepted_value may be None (empty) or a current lease
+            return success, st
 
-    def on_propose(self, proposal_id, lease_owner, lease_seconds):
+    def on_propose(self, name, proposal_id, lease_owner, lease_seconds):
         with self._lock:
-            if self.state.promised_n is None or proposal_id >= self.state.promised_n:
+            st = self._get_lease_state(name)
+            if st.promised_n is None or proposal_id >= st.promised_n:
                 # accept the proposal
-                self.state.promised_n = proposal_id
-                self.state.accepted_n = proposal_id
-                self.state.accepted_value = {
+                st.promised_n = proposal_id
+                st.accepted_n = proposal_id
+                st.accepted_value = {
                     "owner": lease_owner,
                     "lease_seconds": lease_seconds,
                     "lease_expires_at": time.time() + lease_seconds,
                 }
-                self._restart_timer(lease_seconds)
+                self._restart_timer(name, st.accepted_value, lease_seconds)
+                self._dirty.add(name)
                 success = True
             else:
                 success = False
-            return success, self.state
+            return success, st
 
-    def on_release(self, proposal_id):
+    def on_renew(self, name, proposal_id, lease_owner, lease_seconds):
+        # renewal without a prepare round: only for the owner whose proposal we accepted,
+        # while its lease is still live here and nobody has been promised a higher proposal id
         with self._lock:
-            if self.state.accepted_n == proposal_id:
-                if self._lease_timer is not None:
-                    self._lease_timer.cancel()
-                    self._lease_timer = None
-                self.state.accepted_n = None
-                self.state.accepted_value = None
-                return True, self.state
+            st = self._get_lease_state(name)
+            if (st.accepted_value is not None
+                    and st.accepted_value["owner"] == lease_owner
+                    and st.accepted_n == proposal_id
+                    and st.promised_n == proposal_id):
+                st.accepted_value = {
+                    "owner": lease_owner,
+                    "lease_seconds": lease_seconds,
+                    "lease_expires_at": time.time() + lease_seconds,
+                }
+                self._restart_timer(name, st.accepted_value, lease_seconds)
+                self._dirty.add(name)
+                return True, st
+            return False, st
+
+    def on_release(self, name, proposal_id):
+        with self._lock:
+            st = self._get_lease_state(name)
+            if st.accepted_n == proposal_id:
+                self._cancel_timer(name)
+                st.accepted_n = None
+                st.accepted_value = None
+                self._dirty.add(name)
+                return True, st
             # otherwise ignore
-            return False, self.state
+            return False, st
 
 class PaxosLeaseProposer:
     def __init__(self, node_id, peers):
         self._lock = threading.Lock()
         self.node_id = node_id
         self.peers = peers
-        self.state = SimpleNamespace()
-        self.state.proposal_id = self.node_id  # for uniqueness
-        self.state.lease_owner = False
-        self.state.lease_expires_at = None
-        self._lease_timer = None       # main expiry timer
-        self._extend_timer = None      # extension timer
-
-    def increment_proposal_id(self):
+        self.leases = {}             # lease name -> SimpleNamespace(proposal_id, lease_owner, lease_expires_at)
+        self._lease_timers = {}      # lease name -> main expiry timer
+        self._extend_timer = None    # one extension timer renews all held leases in a single batch
+        self._snapshots = {}         # lease name -> LeaseSnapshot, only for leases we hold
+        self.stats = SimpleNamespace(
+            messages_sent=0,         # prepare/propose/renew/release messages, one per peer
+            renewals_fast=0,         # leases renewed with a single /renew round
+            renewals_full=0,         # leases renewed with a full prepare/propose round
+            renewals_failed=0,
+        )
+        self._renew_latencies = deque(maxlen=1000)  # seconds per renewal batch
+        self._held_since = {}        # lease name -> time.monotonic() we became its owner, only for leases we hold
+        self._held_seconds = 0.0     # summed over the leases we held and lost since
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(peers))
+
+    def _get_lease_state(self, name):
+        if name not in self.leases:
+            self.leases[name] = SimpleNamespace(
+                proposal_id=self.node_id,  # for uniqueness
+                lease_owner=False,
+                lease_expires_at=None,
+            )
+        return self.leases[name]
+
+    def _publish_snapshot(self, name, proposal_id=None):
+        # call with self._lock held, after changing lease_owner/lease_expires_at;
+        # proposal_id is the id that won the lease, the token stays the same across fast renewals
+        st = self.leases[name]
+        if st.lease_owner and st.lease_expires_at is not None:
+            expires_at = time.monotonic() + (st.lease_expires_at - time.time())
+            self._snapshots[name] = LeaseSnapshot(proposal_id, expires_at)
+            self._held_since.setdefault(name, time.monotonic())
+        else:
+            self._snapshots.pop(name, None)
+            if (held_since := self._held_since.pop(name, None)) is not None:
+                self._held_seconds += time.monotonic() - held_since
+
+    def held_seconds(self):
+        # how long this node has held leases in total, summed over leases, the current ones so far included
         with self._lock:
-            # space proposal IDs by 256 to leave room for other nodes' IDs
-            self.state.proposal_id += 256
+            now = time.monotonic()
+            return self._held_seconds + sum(now - held_since for held_since in self._held_since.values())
+
+    def holds_lease(self, name=DEFAULT_LEASE):
+        # lock-free hot path check, also correct in the gap before the local expiry timer fires
+        snapshot = self._snapshots.get(name)
+        return snapshot is not None and time.monotonic() < snapshot.expires_at
+
+    def lease_info(self, name=DEFAULT_LEASE):
+        # None if we don't hold the lease, otherwise its fencing token and remaining time
+        snapshot = self._snapshots.get(name)
+        if snapshot is None:
+            return None
+        remaining = snapshot.expires_at - time.monotonic()
+        if remaining <= 0:
+            return None
+        return {
+            "lease": name,
+            "owner": self.node_id,
+            "fencing_token": snapshot.fencing_token,
+            "remaining": remaining,
+        }
+
+    def increment_proposal_ids(self, names):
+        with self._lock:
+            proposal_ids = {}
+            for name in names:
+                st = self._get_lease_state(name)
+                # space proposal IDs by 256 to leave room for other nodes' IDs
+                st.proposal_id += 256
+                proposal_ids[name] = st.proposal_id
+            return proposal_ids
 
     def _next_proposal_id_after(self, max_seen):
         # given the highest proposal id we've seen in the system (max_seen),
@@ -121,219 +368,411 @@ class PaxosLeaseProposer:
 
     def _http_post_json(self, url, path, payload):
         try:
-            resp = requests.post(f"{url}{path}", json=payload, timeout=1.0)
+            resp = net.post(f"{url}{path}", json=payload, timeout=1.0)
             if resp.status_code == 200:
                 return resp.json()
         except Exception:
             pass
         return None
 
-    def _send_message(self, endpoint, message):
+    def _send_message(self, endpoint, message, enough=None):
+        # send to all peers in parallel; if enough(responses) is given, return as soon
+        # as it holds, without waiting for slow peers (their replies are dropped)
+        with self._lock:
+            self.stats.messages_sent += len(self.peers)
+        started = time.perf_counter()
+        futures = {self._executor.submit(self._http_post_json, peer, endpoint, message): peer for peer in self.peers}
         responses = []
-        for peer in self.peers:
-            data = self._http_post_json(peer, endpoint, message)
+        for future in as_completed(futures):
+            data = future.result()
             if data is not None:
-                data["node"] = peer
+                data["node"] = futures[future]
                 responses.append(data)
+                if enough is not None and enough(responses):
+                    break
+        phase_seconds.observe(time.perf_counter() - started, endpoint.lstrip("/"))
         return responses
 
-    def _send_prepare(self, proposal_id):
-        return self._send_message("/prepare", {"proposal_id": proposal_id})
+    def _enough_for_all(self, names, counts, quorum):
+        # enough(responses) for batched messages: every lease has a quorum of responses counts(r) is true for
+        def enough(responses):
+            return all(sum(1 for r in self._lease_responses(responses, name) if counts(r)) >= quorum
+                       for name in names)
+        return enough
 
-    def _send_propose(self, proposal_id, lease_seconds):
+    def _is_open_promise(self, r, extend_existing):
+        # in PaxosLease, we may propose ourselves if a prepare quorum returned:
+        # - "empty" accepted proposals, i.e. no current lease, OR
+        # - (for extension) the existing proposal whose lease has not yet expired
+        #   and belongs to us (owner == self.node_id)
+        if not r.get("success"):
+            return False
+        accepted_value = (r.get("acceptor_state") or {}).get("accepted_value")
+        if accepted_value is None:
+            return True
+        # acceptor thinks we currently hold the lease: ok for extension
+        return extend_existing and accepted_value.get("owner") == self.node_id
+
+    def _is_accept(self, r):
+        return bool(r.get("success"))
+
+    def _lease_responses(self, responses, name):
+        # per-lease view of batched responses: one {"success", "acceptor_state", "node"} per peer that answered
+        lease_responses = []
+        for r in responses:
+            lease_response = (r.get("leases") or {}).get(name)
+            if lease_response is not None:
+                lease_responses.append({**lease_response, "node": r["node"]})
+        return lease_responses
+
+    def _send_prepare(self, proposal_ids, extend_existing):
+        return self._send_message(
+            "/prepare",
+            {"leases": proposal_ids},
+            enough=self._enough_for_all(proposal_ids, lambda r: self._is_open_promise(r, extend_existing), n_prepare_quorum),
+        )
+
+    def _send_propose(self, proposal_ids, lease_seconds):
         return self._send_message(
             "/propose",
             {
-                "proposal_id": proposal_id,
+                "leases": proposal_ids,
                 "lease_owner": self.node_id,
                 "lease_seconds": lease_seconds,
             },
+            enough=self._enough_for_all(proposal_ids, self._is_accept, n_accept_quorum),
         )
 
-    def _send_release(self, proposal_id):
-        return self._send_message("/release", {"proposal_id": proposal_id})
+    def _send_renew(self, proposal_ids, lease_seconds):
+        return self._send_message(
+            "/renew",
+            {
+                "leases": proposal_ids,
+                "lease_owner": self.node_id,
+                "lease_seconds": lease_seconds,
+            },
+            enough=self._enough_for_all(proposal_ids, self._is_accept, n_accept_quorum),
+        )
 
-    def _cancel_local_lease_timer(self):
-        if self._lease_timer is not None:
-            self._lease_timer.cancel()
-            self._lease_timer = None
+    def _send_release(self, proposal_ids):
+        return self._send_message("/release", {"leases": proposal_ids})
 
-    def _cancel_extend_timer(self):
-        if self._extend_timer is not None:
-            self._extend_timer.cancel()
-            self._extend_timer = None
+    def _cancel_local_lease_timer(self, name):
+        timer = self._lease_timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
 
-    def _on_local_lease_timeout(self):
+    def _on_local_lease_timeout(self, name):
         with self._lock:
-            print('Lease expired (local)')
-            self.state.lease_owner = False
-            self.state.lease_expires_at = None
-            self._lease_timer = None
-        # if lease naturally expires, we should also stop extension attempts
-        self._cancel_extend_timer()
-
-    def _on_extend_timer(self):
-        # called halfway through the remaining lease to extend it
+            print(f'Lease {name} expired (local)')
+            st = self.leases[name]
+            st.lease_owner = False
+            st.lease_expires_at = None
+            self._publish_snapshot(name)
+            self._lease_timers.pop(name, None)
+        # if no lease is held anymore, this also stops extension attempts
+        self._schedule_extend_timer()
+
+    def _schedule_extend_timer(self):
+        # a single extension timer for all held leases: it fires halfway through the
+        # remaining time of the lease that expires first, and renews every held lease
         with self._lock:
-            if not self.state.lease_owner:
-                # We no longer think we own the lease; do nothing.
+            if self._extend_timer is not None:
+                self._extend_timer.cancel()
                 self._extend_timer = None
+            expires = [st.lease_expires_at for st in self.leases.values() if st.lease_owner]
+            if not expires:
                 return
-            print('Attempting to extend lease')
-        # try to extend the lease; we allow "existing lease by me" during prepare
-        result = self.acquire_lease(
-            retry_on_prepare_fail=False,
-            extend_existing=True
-        )
-        # new lease (if successful) will have set up fresh timers
+            remaining = min(expires) - time.time()
+            if remaining > 0:
+                extend_after = remaining / 2.0
+                # extending sends prepare/propose over HTTP, so it must not run on the scheduler thread
+                self._extend_timer = scheduler.call_later(extend_after, self._on_extend_timer, background=True)
 
-    def _start_local_lease_timer(self, lease_seconds):
+    def _on_extend_timer(self):
+        with self._lock:
+            self._extend_timer = None
+            names = [name for name, st in self.leases.items() if st.lease_owner]
+            if not names:
+                # We no longer think we own any lease; do nothing.
+                return
+            print(f'Attempting to extend {len(names)} lease(s)')
+        started = time.monotonic()
+        results = self.renew_leases(names)
+        with self._lock:
+            self._renew_latencies.append(time.monotonic() - started)
+            for r in results.values():
+                if r["status"] != "success":
+                    self.stats.renewals_failed += 1
+                elif r.get("renewed") == "fast":
+                    self.stats.renewals_fast += 1
+                else:
+                    self.stats.renewals_full += 1
+        # leases extended successfully have fresh timers, renew_leases re-arms the extension timer
+
+    def _start_local_lease_timer(self, name, lease_seconds, lease_expires_at=None):
         # start main expiry timer
-        self._cancel_local_lease_timer()
+        self._cancel_local_lease_timer(name)
+        if lease_expires_at is None:
+            lease_expires_at = time.time() + lease_seconds
+        with self._lock:
+            self._get_lease_state(name).lease_expires_at = lease_expires_at
+        self._lease_timers[name] = scheduler.call_later(
+            lease_expires_at - time.time(), lambda: self._on_local_lease_timeout(name))
+
+    def renew_stats(self):
         with self._lock:
-            self.state.lease_expires_at = time.time() + lease_seconds
-            expires_at = self.state.lease_expires_at
-        self._lease_timer = threading.Timer(lease_seconds, self._on_local_lease_timeout)
-        self._lease_timer.daemon = True
-        self._lease_timer.start()
-        # start extension timer at half the remaining time
-        self._cancel_extend_timer()
-        remaining = expires_at - time.time()
-        if remaining > 0:
-            extend_after = remaining / 2.0
-            self._extend_timer = threading.Timer(extend_after, self._on_extend_timer)
-            self._extend_timer.daemon = True
-            self._extend_timer.start()
-
-    def acquire_lease(self, retry_on_prepare_fail=True, extend_existing=False):
+            latencies = list(self._renew_latencies)
+            stats = dict(self.stats.__dict__)
+        if latencies:
+            stats["renew_latency_p50"] = percentile(latencies, 50)
+            stats["renew_latency_p99"] = percentile(latencies, 99)
+        return stats
+
+    def renew_leases(self, names):
+        # fast path for the current owner: acceptors that accepted our proposal and
+        # promised nobody else since take a single /renew under the same proposal id,
+        # leases that can't be renewed that way fall back to a full prepare/propose round
         lease_seconds = LEASE_SECONDS
-        self.increment_proposal_id()
-        # Phase 1: prepare
-        prepare_responses = self._send_prepare(self.state.proposal_id)
-        promises = [r for r in prepare_responses if r.get("success")]
-        if len(promises) < n_majority:
-            # prepare failed: compute the highest proposal id we've seen
-            max_seen = None
-            for r in prepare_responses:
-                acc_state = r.get("acceptor_state") or {}
-                promised_n = acc_state.get("promised_n")
-                if promised_n is not None:
-                    if max_seen is None or promised_n > max_seen:
-                        max_seen = promised_n
-            # bump our proposal id to be > any seen, respecting node_id + k*256 layout
-            if max_seen is not None:
-                new_id = self._next_proposal_id_after(max_seen)
+        with self._lock:
+            # renew under the proposal id that won the lease, not a later one a failed extension attempt bumped to
+            proposal_ids = {name: self._snapshots[name].fencing_token
+                            for name in names if self.leases[name].lease_owner and name in self._snapshots}
+        results = {}
+        if proposal_ids:
+            # per PaxosLease, the new lease period starts BEFORE sending the request
+            lease_expires_at = time.time() + lease_seconds
+            renew_responses = self._send_renew(proposal_ids, lease_seconds)
+            for name, proposal_id in proposal_ids.items():
+                accepts = [r for r in self._lease_responses(renew_responses, name) if r.get("success")]
+                if len(accepts) < n_accept_quorum:
+                    continue
                 with self._lock:
-                    self.state.proposal_id = new_id
-            # retry once with the new proposal id (if we haven't retried yet)
-            if retry_on_prepare_fail:
-                return self.acquire_lease(
-                    retry_on_prepare_fail=False,
-                    extend_existing=extend_existing
-                )
-            # this is already the second try, just fail
-            return {
-                "status": "failed_prepare",
-                "reason": f"Only got {len(promises)} promises, need {n_majority}",
-                "proposal_id": self.state.proposal_id,
-                "prepare_responses": prepare_responses,
-            }
-
-        # in PaxosLease, we may propose ourselves if a majority returned:
-        # - "empty" accepted proposals, i.e. no current lease, OR
-        # - (for extension) the existing proposal whose lease has not yet expired
-        #   and belongs to us (owner == self.node_id)
-        open_promises = []
-        for r in promises:
-            acc_state = r.get("acceptor_state", {})
-            accepted_value = acc_state.get("accepted_value")
-            if accepted_value is None:
-                open_promises.append(r)
-            elif extend_existing and accepted_value.get("owner") == self.node_id:
-                # acceptor thinks we currently hold the lease: ok for extension
-                open_promises.append(r)
-        if len(open_promises) < n_majority:
-            return {
-                "status": "lease_busy",
-                "reason": (
-                    "A majority of acceptors already hold some other lease; "
-                    "cannot safely acquire/extend a lease now."
-                ),
-                "proposal_id": self.state.proposal_id,
-                "prepare_responses": prepare_responses,
-            }
+                    still_owner = self.leases[name].lease_owner
+                if not still_owner:
+                    # expired locally or released while we were waiting
+                    continue
+                self._start_local_lease_timer(name, lease_seconds, lease_expires_at)
+                with self._lock:
+                    self._publish_snapshot(name, proposal_id)
+                results[name] = {
+                    "status": "success",
+                    "renewed": "fast",
+                    "proposal_id": proposal_id,
+                    "lease_owner": self.node_id,
+                    "lease_seconds": lease_seconds,
+                    "lease_expires_at": lease_expires_at,
+                    "lease_time_lost": lease_seconds - (lease_expires_at - time.time()),
+                }
+            if results:
+                rounds_decided.inc(value=len(results))
+                print(f'Extended {len(results)} lease(s) without prepare')
+        slow_names = [name for name in names if name not in results]
+        if slow_names:
+            # we allow "existing lease by me" during prepare
+            results.update(self.acquire_leases(
+                slow_names,
+                retry_on_prepare_fail=False,
+                extend_existing=True
+            ))
+        self._schedule_extend_timer()
+        return results
+
+    def acquire_lease(self, name=DEFAULT_LEASE, retry_on_prepare_fail=True, extend_existing=False):
+        return self.acquire_leases([name], retry_on_prepare_fail, extend_existing)[name]
+
+    def acquire_leases(self, names, retry_on_prepare_fail=True, extend_existing=False):
+        # runs one PaxosLease instance per lease name, but all of them share
+        # one prepare and one propose message per peer
+        lease_seconds = LEASE_SECONDS
+        started = time.time()
+        proposal_ids = self.increment_proposal_ids(names)
+        results = {}
+        retry_names = []
+        open_proposal_ids = {}
+        # Phase 1: prepare
+        prepare_responses = self._send_prepare(proposal_ids, extend_existing)
+        for name in names:
+            responses = self._lease_responses(prepare_responses, name)
+            promises = [r for r in responses if r.get("success")]
+            if len(promises) < n_prepare_quorum:
+                # prepare failed: compute the highest proposal id we've seen
+                max_seen = None
+                for r in responses:
+                    acc_state = r.get("acceptor_state") or {}
+                    promised_n = acc_state.get("promised_n")
+                    if promised_n is not None:
+                        if max_seen is None or promised_n > max_seen:
+                            max_seen = promised_n
+                # bump our proposal id to be > any seen, respecting node_id + k*256 layout
+                if max_seen is not None:
+                    new_id = self._next_proposal_id_after(max_seen)
+                    with self._lock:
+                        self.leases[name].proposal_id = new_id
+                # retry once with the new proposal id (if we haven't retried yet)
+                if retry_on_prepare_fail:
+                    retry_names.append(name)
+                    continue
+                # this is already the second try, just fail
+                results[name] = {
+                    "status": "failed_prepare",
+                    "reason": f"Only got {len(promises)} promises, need {n_prepare_quorum}",
+                    "proposal_id": proposal_ids[name],
+                    "prepare_responses": responses,
+                }
+                continue
+            open_promises = [r for r in promises if self._is_open_promise(r, extend_existing)]
+            if len(open_promises) < n_prepare_quorum:
+                results[name] = {
+                    "status": "lease_busy",
+                    "reason": (
+                        "A prepare quorum of acceptors already holds some other lease; "
+                        "cannot safely acquire/extend a lease now."
+                    ),
+                    "proposal_id": proposal_ids[name],
+                    "prepare_responses": responses,
+                }
+                continue
+            open_proposal_ids[name] = proposal_ids[name]
         # Phase 2: propose ourselves as lease owner
-        # per PaxosLease, we start our local timer BEFORE sending propose requests
-        self._start_local_lease_timer(lease_seconds)
-        propose_responses = self._send_propose(self.state.proposal_id, lease_seconds)
-        accepts = [r for r in propose_responses if r.get("success")]
-        if len(accepts) < n_majority:
-            # failed to get a majority; cancel our local lease timer
-            self._cancel_local_lease_timer()
-            self._cancel_extend_timer()
-            with self._lock:
-                self.state.lease_owner = False
-                self.state.lease_expires_at = None
-            return {
-                "status": "failed_propose",
-                "reason": f"Only got {len(accepts)} accepts, need {n_majority}",
-                "proposal_id": self.state.proposal_id,
-                "lease_seconds": lease_seconds,
-                "prepare_responses": prepare_responses,
-                "propose_responses": propose_responses,
-            }
-        # success: we now believe we have (or extended) the lease until our local timer fires.
-        with self._lock:
-            self.state.lease_owner = True
-            if extend_existing:
-                print('Lease extended')
-            else:
-                print('I am the lease owner')
-        # we do NOT need to broadcast learn; other nodes can't reliably
-        # know the remaining lease time due to network delay.
-        return {
-            "status": "success",
-            "proposal_id": self.state.proposal_id,
-            "lease_owner": self.node_id,
-            "lease_seconds": lease_seconds,
-            "lease_expires_at": self.state.lease_expires_at,
-            "prepare_responses": prepare_responses,
-            "propose_responses": propose_responses,
-        }
-
-    def release_lease(self):
-        # explicitly release the lease early:
+        if open_proposal_ids:
+            # per PaxosLease, we start our local timers BEFORE sending propose requests
+            for name in open_proposal_ids:
+                self._start_local_lease_timer(name, lease_seconds)
+            propose_responses = self._send_propose(open_proposal_ids, lease_seconds)
+            won = []
+            for name, proposal_id in open_proposal_ids.items():
+                responses = self._lease_responses(propose_responses, name)
+                accepts = [r for r in responses if r.get("success")]
+                if len(accepts) < n_accept_quorum:
+                    # failed to get a quorum; cancel our local lease timer
+                    self._cancel_local_lease_timer(name)
+                    with self._lock:
+                        self.leases[name].lease_owner = False
+                        self.leases[name].lease_expires_at = None
+                        self._publish_snapshot(name)
+                    results[name] = {
+                        "status": "failed_propose",
+                        "reason": f"Only got {len(accepts)} accepts, need {n_accept_quorum}",
+                        "proposal_id": proposal_id,
+                        "lease_seconds": lease_seconds,
+                        "propose_responses": responses,
+                    }
+                    continue
+                # the lease started running when we sent propose, whatever elapsed since is lost to the protocol
+                with self._lock:
+                    st = self.leases[name]
+                    lease_expires_at = st.lease_expires_at
+                    now = time.time()
+                    lease_time_lost = lease_seconds - (lease_expires_at - now) if lease_expires_at is not None else lease_seconds
+                    # success: we now believe we have (or extended) the lease until our local timer fires,
+                    # unless we only learned that we won after it already ran out
+                    expired = lease_expires_at is None or lease_expires_at <= now
+                    st.lease_owner = not expired
+                    if expired:
+                        st.lease_expires_at = None
+                    self._publish_snapshot(name, proposal_id)
+                if expired:
+                    self._cancel_local_lease_timer(name)
+                    results[name] = {
+                        "status": "lease_expired",
+                        "reason": "An accept quorum accepted, but the lease expired before we learned it",
+                        "proposal_id": proposal_id,
+                        "lease_seconds": lease_seconds,
+                        "acquire_seconds": now - started,
+                        "lease_time_lost": lease_time_lost,
+                    }
+                    continue
+                won.append(name)
+                # we do NOT need to broadcast learn; other nodes can't reliably
+                # know the remaining lease time due to network delay.
+                results[name] = {
+                    "status": "success",
+                    "proposal_id": proposal_id,
+                    "lease_owner": self.node_id,
+                    "lease_seconds": lease_seconds,
+                    "lease_expires_at": lease_expires_at,
+                    "acquire_seconds": now - started,
+                    "lease_time_lost": lease_time_lost,
+                }
+            if won:
+                rounds_decided.inc(value=len(won))
+                lost_ms = max(results[name]["lease_time_lost"] for name in won) * 1000
+                if extend_existing:
+                    print(f'Extended {len(won)} lease(s) ({lost_ms:.1f} ms of the lease lost to the protocol)')
+                else:
+                    print(f'I am the lease owner of {", ".join(won) if len(won) <= 10 else f"{len(won)} leases"}'
+                          f' ({lost_ms:.1f} ms of the lease lost to the protocol)')
+            self._schedule_extend_timer()
+        if retry_names:
+            results.update(self.acquire_leases(
+                retry_names,
+                retry_on_prepare_fail=False,
+                extend_existing=extend_existing
+            ))
+        return results
+
+    def release_lease(self, name=DEFAULT_LEASE):
+        return self.release_leases([name])
+
+    def release_leases(self, names=None):
+        # explicitly release leases early (all held leases if names is None):
         # - set local state to "no lease"
         # - cancel timers
-        # - send release messages to acceptors
+        # - send one batched release message to each acceptor
         with self._lock:
-            if not self.state.lease_owner:
-                # nothing to do
-                return {"status": "no_lease"}
-            proposal_id = self.state.proposal_id
-            self.state.lease_owner = False
-            self.state.lease_expires_at = None
-        self._cancel_local_lease_timer()
-        self._cancel_extend_timer()
-        release_responses = self._send_release(proposal_id)
-        print('Lease released explicitly')
+            if names is None:
+                names = list(self.leases)
+            proposal_ids = {}
+            for name in names:
+                st = self.leases.get(name)
+                if st is None or not st.lease_owner:
+                    continue
+                snapshot = self._snapshots.get(name)
+                proposal_ids[name] = snapshot.fencing_token if snapshot is not None else st.proposal_id
+                st.lease_owner = False
+                st.lease_expires_at = None
+                self._publish_snapshot(name)
+        if not proposal_ids:
+            # nothing to do
+            return {"status": "no_lease"}
+        for name in proposal_ids:
+            self._cancel_local_lease_timer(name)
+        self._schedule_extend_timer()
+        release_responses = self._send_release(proposal_ids)
+        print(f'Released {", ".join(proposal_ids)} explicitly')
         return {
             "status": "released",
-            "proposal_id": proposal_id,
+            "leases": proposal_ids,
             "release_responses": release_responses,
         }
 
 acceptor = PaxosLeaseAcceptor()
 proposer = PaxosLeaseProposer(id, peers)
+metrics.gauge("dca_paxos_lease_held_seconds_total", "Seconds this node has held leases, summed over leases",
+              proposer.held_seconds, kind="counter")
+
+def requested_lease_names(data, default):
+    # {"leases": [...]} or {"lease": name}, otherwise the default
+    if "leases" in data:
+        return [str(name) for name in data["leases"]]
+    if "lease" in data:
+        return [str(data["lease"])]
+    return default
 
 @app.route("/start", methods=["POST"])
 def start():
-    result = proposer.acquire_lease()
-    return jsonify(result)
+    data = request.get_json(force=True, silent=True) or {}
+    results = proposer.acquire_leases(requested_lease_names(data, [DEFAULT_LEASE]))
+    return jsonify({
+        "status": "success" if all(r["status"] == "success" for r in results.values()) else "failed",
+        "leases": results,
+    })
 
 @app.route("/stop", methods=["POST"])
 def stop():
-    payload = proposer.release_lease()
+    data = request.get_json(force=True, silent=True) or {}
+    payload = proposer.release_leases(requested_lease_names(data, None))
     return Response(
         json.dumps(payload, indent=2, sort_keys=True) + "\n",
         mimetype="application/json"
@@ -342,50 +781,105 @@ def stop():
 @app.route("/prepare", methods=["POST"])
 def prepare():
     data = request.get_json(force=True, silent=True) or {}
-    proposal_id = data.get("proposal_id")
-    if proposal_id is None:
-        return jsonify({"ok": False, "error": "missing proposal_id"}), 400
-    success, state = acceptor.on_prepare(proposal_id)
-    return jsonify({
-        "success": success,
-        "acceptor_state": state.__dict__,
-    })
+    leases = data.get("leases")
+    if not isinstance(leases, dict):
+        return jsonify({"ok": False, "error": "missing leases"}), 400
+    results = {}
+    for name, proposal_id in leases.items():
+        success, state = acceptor.on_prepare(name, proposal_id)
+        results[name] = {
+            "success": success,
+            "acceptor_state": dict(state.__dict__),
+        }
+    acceptor.persist()
+    return jsonify({"leases": results})
 
 @app.route("/propose", methods=["POST"])
 def propose():
     data = request.get_json(force=True, silent=True) or {}
-    proposal_id = data.get("proposal_id")
+    leases = data.get("leases")
     lease_owner = data.get("lease_owner")
     lease_seconds = data.get("lease_seconds")
-    if proposal_id is None or lease_owner is None or lease_seconds is None:
+    if not isinstance(leases, dict) or lease_owner is None or lease_seconds is None:
         return jsonify({
             "ok": False,
-            "error": "missing proposal_id, lease_owner or lease_seconds"
+            "error": "missing leases, lease_owner or lease_seconds"
         }), 400
-    success, state = acceptor.on_propose(proposal_id, lease_owner, float(lease_seconds))
-    return jsonify({
-        "success": success,
-        "acceptor_state": state.__dict__,
-    })
+    results = {}
+    for name, proposal_id in leases.items():
+        success, state = acceptor.on_propose(name, proposal_id, lease_owner, float(lease_seconds))
+        results[name] = {
+            "success": success,
+            "acceptor_state": dict(state.__dict__),
+        }
+    acceptor.persist()
+    return jsonify({"leases": results})
+
+@app.route("/renew", methods=["POST"])
+def renew():
+    data = request.get_json(force=True, silent=True) or {}
+    leases = data.get("leases")
+    lease_owner = data.get("lease_owner")
+    lease_seconds = data.get("lease_seconds")
+    if not isinstance(leases, dict) or lease_owner is None or lease_seconds is None:
+        return jsonify({
+            "ok": False,
+            "error": "missing leases, lease_owner or lease_seconds"
+        }), 400
+    results = {}
+    for name, proposal_id in leases.items():
+        success, state = acceptor.on_renew(name, proposal_id, lease_owner, float(lease_seconds))
+        results[name] = {
+            "success": success,
+            "acceptor_state": dict(state.__dict__),
+        }
+    acceptor.persist()
+    return jsonify({"leases": results})
 
 @app.route("/release", methods=["POST"])
 def release():
     data = request.get_json(force=True, silent=True) or {}
-    proposal_id = data.get("proposal_id")
-    if proposal_id is None:
-        return jsonify({"ok": False, "error": "missing proposal_id"}), 400
-    success, state = acceptor.on_release(proposal_id)
+    leases = data.get("leases")
+    if not isinstance(leases, dict):
+        return jsonify({"ok": False, "error": "missing leases"}), 400
+    results = {}
+    for name, proposal_id in leases.items():
+        success, state = acceptor.on_release(name, proposal_id)
+        results[name] = {
+            "success": success,
+            "acceptor_state": dict(state.__dict__),
+        }
+    acceptor.persist()
+    return jsonify({"leases": results})
+
+@app.route("/lease", methods=["GET"])
+def lease():
+    # cheap alternative to /status for a single lease
+    name = request.args.get("name", DEFAULT_LEASE)
+    info = proposer.lease_info(name)
+    if info is not None:
+        return jsonify({**info, "holder": True})
+    # not ours: report what our acceptor last accepted, which may already be stale
+    st = acceptor.leases.get(name)
+    accepted_n, accepted_value = (st.accepted_n, st.accepted_value) if st is not None else (None, None)
+    if accepted_value is None:
+        return jsonify({"lease": name, "holder": False, "owner": None, "fencing_token": None, "remaining": 0.0})
     return jsonify({
-        "success": success,
-        "acceptor_state": state.__dict__,
+        "lease": name,
+        "holder": False,
+        "owner": accepted_value["owner"],
+        "fencing_token": accepted_n,
+        "remaining": max(0.0, accepted_value["lease_expires_at"] - time.time()),
     })
 
 @app.route("/status", methods=["GET"])
 def status():
     payload = {
         "node_id": id,
-        "proposer_state": proposer.state.__dict__,
-        "acceptor_state": acceptor.state.__dict__,
+        "quorums": {"prepare": n_prepare_quorum, "accept": n_accept_quorum},
+        "proposer_state": {name: st.__dict__ for name, st in list(proposer.leases.items())},
+        "renew_stats": proposer.renew_stats(),
+        "acceptor_state": {name: st.__dict__ for name, st in list(acceptor.leases.items())},
     }
     return Response(
         json.dumps(payload, indent=2, sort_keys=True) + "\n",
@@ -393,7 +887,13 @@ def status():
     )
 
 if __name__ == "__main__":
-    print(f"Node {id} starting, waiting for {LEASE_SECONDS} seconds to respect PaxosLease protocol...")
-    time.sleep(LEASE_SECONDS)
-    print(f"Node {id} is now active.")
-    app.run(host="0.0.0.0", port=port, debug=False)
+    if acceptor.restore():
+        # we remember every promise and accepted lease, as if we had only been paused
+        print(f"Node {id} restored acceptor state from {STATE_FILE}, active immediately.")
+    else:
+        print(f"Node {id} starting, waiting for {LEASE_SECONDS} seconds to respect PaxosLease protocol...")
+        time.sleep(LEASE_SECONDS)
+        # nothing we could have accepted before is live anymore, the next restart needn't wait
+        acceptor.persist(force=True)
+        print(f"Node {id} is now active.")
+    app.run(host=host, port=port, debug=False)
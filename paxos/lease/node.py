@@ -1,30 +1,74 @@
+import os
 import sys
 import json
 import time
-import requests
 import threading
 from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import Flask, request, jsonify, Response
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address, node_url, state_path
+from metrics import Metrics
+from timers import TimerScheduler
+
 # start nodes:
 # python3 node.py 0 3
 # python3 node.py 1 3
 # python3 node.py 2 3
 # try to acquire a lease for 5 seconds:
 # curl -X POST http://localhost:5000/start
+# acceptors keep their state in acceptor-<host>-<port>.state (in the cluster config's state_dir if set),
+# so a restarted node doesn't have to sit out a whole lease
 
 if len(sys.argv) != 3:
     print("Usage: node.py <id> <n>")
     sys.exit(1)
 
 id, n = map(int, sys.argv[1:])
-port = 5000 + id
-peers = [f"http://localhost:{5000+i}" for i in range(n)]
+host, port = node_address(id, 5000 + id, "0.0.0.0")
+peers = [node_url(i, 5000+i, "localhost") for i in range(n)]
+# /metrics, see ../../metrics.py; every outbound call goes through net
+metrics = Metrics(peers)
+net = metrics.client()
+phase_seconds = metrics.histogram("dca_paxos_phase_seconds", "Seconds per phase of this node's lease attempts", ("phase",))
+rounds_decided = metrics.counter("dca_paxos_rounds_decided_total", "Leases this node won")
 n_majority = n//2 + 1
 # globally known maximal lease time M
 LEASE_SECONDS = 5.0
+# acceptor promises and accepted leases survive restarts here
+STATE_FILE = state_path(id, 5000+id, "acceptor")
 
 app = Flask(__name__)
+metrics.register(app)
+# single timer thread shared by acceptor expiry and local lease expiry
+scheduler = TimerScheduler()
+
+def read_boot_id():
+    # monotonic clocks restart on reboot, so saved monotonic deadlines are only comparable within one boot
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+BOOT_ID = read_boot_id()
+
+def save_state(path, payload):
+    # write to a temp file and rename it over the old one, so a crash leaves either the old or the new state
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
 class PaxosLeaseAcceptor:
     def __init__(self):
@@ -38,9 +82,44 @@ class PaxosLeaseAcceptor:
     def _restart_timer(self, lease_seconds):
         if self._lease_timer is not None:
             self._lease_timer.cancel()
-        self._lease_timer = threading.Timer(lease_seconds, self._on_timeout)
-        self._lease_timer.daemon = True
-        self._lease_timer.start()
+        self._lease_timer = scheduler.call_later(lease_seconds, self._on_timeout)
+
+    def _persist(self):
+        # call with self._lock held, before answering: a restarted acceptor must not forget what it promised or accepted
+        lease_deadline = None
+        if self.state.accepted_value is not None and self._lease_timer is not None:
+            lease_deadline = self._lease_timer.deadline  # time.monotonic()
+        save_state(STATE_FILE, {
+            "boot_id": BOOT_ID,
+            "promised_n": self.state.promised_n,
+            "accepted_n": self.state.accepted_n,
+            "accepted_value": self.state.accepted_value,
+            "lease_deadline": lease_deadline,
+        })
+
+    def save(self):
+        with self._lock:
+            self._persist()
+
+    def restore(self):
+        # returns False without a usable state file, the caller then has to wait out LEASE_SECONDS
+        saved = load_state(STATE_FILE)
+        if saved is None:
+            return False
+        with self._lock:
+            self.state.promised_n = saved["promised_n"]
+            accepted_value = saved["accepted_value"]
+            if accepted_value is not None:
+                if BOOT_ID is not None and saved["boot_id"] == BOOT_ID and saved["lease_deadline"] is not None:
+                    remaining = saved["lease_deadline"] - time.monotonic()
+                else:
+                    # rebooted (or can't tell): we don't know how long we were down, assume the lease just started
+                    remaining = accepted_value["lease_seconds"]
+                if remaining > 0:
+                    self.state.accepted_n = saved["accepted_n"]
+                    self.state.accepted_value = {**accepted_value, "lease_expires_at": time.time() + remaining}
+                    self._restart_timer(remaining)
+        return True
 
     def _on_timeout(self):
         with self._lock:
@@ -52,6 +131,7 @@ class PaxosLeaseAcceptor:
         with self._lock:
             if self.state.promised_n is None or proposal_id > self.state.promised_n:
                 self.state.promised_n = proposal_id
+                self._persist()
                 success = True
             else:
                 success = False
@@ -70,6 +150,7 @@ class PaxosLeaseAcceptor:
                     "lease_expires_at": time.time() + lease_seconds,
                 }
                 self._restart_timer(lease_seconds)
+                self._persist()
                 success = True
             else:
                 success = False
@@ -85,6 +166,9 @@ class PaxosLeaseProposer:
         self.state.lease_owner = False
         self.state.lease_expires_at = None
         self._lease_timer = None
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(peers))
+        self._held_since = None       # time.monotonic() we became the owner, None while we aren't
+        self._held_seconds = 0.0      # summed over the leases we held and lost since
 
     def increment_proposal_id(self):
         with self._lock:
@@ -106,24 +190,29 @@ class PaxosLeaseProposer:
 
     def _http_post_json(self, url, path, payload):
         try:
-            resp = requests.post(f"{url}{path}", json=payload, timeout=1.0)
+            resp = net.post(f"{url}{path}", json=payload, timeout=1.0)
             if resp.status_code == 200:
                 return resp.json()
         except Exception:
             pass
         return None
 
-    def _send_message(self, endpoint, message):
+    def _send_message(self, endpoint, message, enough=None):
+        # send to all peers in parallel; if enough(responses) is given, return as soon
+        # as it holds, without waiting for slow peers (their replies are dropped)
+        futures = {self._executor.submit(self._http_post_json, peer, endpoint, message): peer for peer in self.peers}
         responses = []
-        for peer in self.peers:
-            data = self._http_post_json(peer, endpoint, message)
+        for future in as_completed(futures):
+            data = future.result()
             if data is not None:
-                data["node"] = peer
+                data["node"] = futures[future]
                 responses.append(data)
+                if enough is not None and enough(responses):
+                    break
         return responses
 
     def _send_prepare(self, proposal_id):
-        return self._send_message("/prepare", {"proposal_id": proposal_id})
+        return self._send_message("/prepare", {"proposal_id": proposal_id}, enough=self._enough_open_promises)
 
     def _send_propose(self, proposal_id, lease_seconds):
         return self._send_message(
@@ -133,16 +222,33 @@ class PaxosLeaseProposer:
                 "lease_owner": self.node_id,
                 "lease_seconds": lease_seconds,
             },
+            enough=self._enough_accepts,
         )
 
+    def _enough_open_promises(self, responses):
+        return sum(1 for r in responses
+                   if r.get("success") and (r.get("acceptor_state") or {}).get("accepted_value") is None) >= n_majority
+
+    def _enough_accepts(self, responses):
+        return sum(1 for r in responses if r.get("success")) >= n_majority
+
     def _cancel_local_lease_timer(self):
         if self._lease_timer is not None:
             self._lease_timer.cancel()
             self._lease_timer = None
 
+    def held_seconds(self):
+        # how long this node has been the lease owner in total, the current lease so far included
+        with self._lock:
+            held_since = self._held_since
+            return self._held_seconds + (time.monotonic() - held_since if held_since is not None else 0.0)
+
     def _on_local_lease_timeout(self):
         with self._lock:
             print(f'Lease expired')
+            if self._held_since is not None:
+                self._held_seconds += time.monotonic() - self._held_since
+                self._held_since = None
             self.state.lease_owner = False
             self.state.lease_expires_at = None
             self._lease_timer = None
@@ -150,15 +256,16 @@ class PaxosLeaseProposer:
     def _start_local_lease_timer(self, lease_seconds):
         self._cancel_local_lease_timer()
         self.state.lease_expires_at = time.time() + lease_seconds
-        self._lease_timer = threading.Timer(lease_seconds, self._on_local_lease_timeout)
-        self._lease_timer.daemon = True
-        self._lease_timer.start()
+        self._lease_timer = scheduler.call_later(lease_seconds, self._on_local_lease_timeout)
 
     def acquire_lease(self, retry_on_prepare_fail=True):
         lease_seconds = LEASE_SECONDS
+        started = time.time()
         self.increment_proposal_id()
         # Phase 1: prepare
+        phase_started = time.perf_counter()
         prepare_responses = self._send_prepare(self.state.proposal_id)
+        phase_seconds.observe(time.perf_counter() - phase_started, "prepare")
         promises = [r for r in prepare_responses if r.get("success")]
         if len(promises) < n_majority:
             # prepare failed: compute the highest proposal id we've seen
@@ -205,7 +312,9 @@ class PaxosLeaseProposer:
         # Phase 2: propose ourselves as lease owner
         # per PaxosLease, we start our local timer BEFORE sending propose requests
         self._start_local_lease_timer(lease_seconds)
+        phase_started = time.perf_counter()
         propose_responses = self._send_propose(self.state.proposal_id, lease_seconds)
+        phase_seconds.observe(time.perf_counter() - phase_started, "propose")
         accepts = [r for r in propose_responses if r.get("success")]
         if len(accepts) < n_majority:
             # failed to get a majority; cancel our local lease timer
@@ -221,10 +330,35 @@ class PaxosLeaseProposer:
                 "prepare_responses": prepare_responses,
                 "propose_responses": propose_responses,
             }
-        # success: we now believe we have the lease until our local timer fires.
+        # the lease started running when we sent propose, whatever elapsed since is lost to the protocol
         with self._lock:
-            self.state.lease_owner = True
-            print(f'I am the lease owner')
+            lease_expires_at = self.state.lease_expires_at
+            now = time.time()
+            lease_time_lost = lease_seconds - (lease_expires_at - now) if lease_expires_at is not None else lease_seconds
+            if lease_expires_at is None or lease_expires_at <= now:
+                # won, but only learned it after the lease already ran out
+                self.state.lease_owner = False
+                self.state.lease_expires_at = None
+                expired = True
+            else:
+                # success: we now believe we have the lease until our local timer fires.
+                self.state.lease_owner = True
+                self._held_since = time.monotonic()
+                expired = False
+                print(f'I am the lease owner ({lease_time_lost*1000:.1f} ms of the lease lost to the protocol)')
+        if expired:
+            self._cancel_local_lease_timer()
+            return {
+                "status": "lease_expired",
+                "reason": "A majority accepted, but the lease expired before we learned it",
+                "proposal_id": self.state.proposal_id,
+                "lease_seconds": lease_seconds,
+                "acquire_seconds": now - started,
+                "lease_time_lost": lease_time_lost,
+                "prepare_responses": prepare_responses,
+                "propose_responses": propose_responses,
+            }
+        rounds_decided.inc()
         # we do NOT need to broadcast learn; other nodes can't reliably
         # know the remaining lease time due to network delay.
         return {
@@ -232,13 +366,16 @@ class PaxosLeaseProposer:
             "proposal_id": self.state.proposal_id,
             "lease_owner": self.node_id,
             "lease_seconds": lease_seconds,
-            "lease_expires_at": self.state.lease_expires_at,
+            "lease_expires_at": lease_expires_at,
+            "acquire_seconds": now - started,
+            "lease_time_lost": lease_time_lost,
             "prepare_responses": prepare_responses,
             "propose_responses": propose_responses,
         }
 
 acceptor = PaxosLeaseAcceptor()
 proposer = PaxosLeaseProposer(id, peers)
+metrics.gauge("dca_paxos_lease_held_seconds_total", "Seconds this node has held the lease", proposer.held_seconds, kind="counter")
 
 @app.route("/start", methods=["POST"])
 def start():
@@ -287,7 +424,13 @@ def status():
     )
 
 if __name__ == "__main__":
-    print(f"Node {id} starting, waiting for {LEASE_SECONDS} seconds to respect PaxosLease protocol...")
-    time.sleep(LEASE_SECONDS)
-    print(f"Node {id} is now active.")
-    app.run(host="0.0.0.0", port=port, debug=False)
+    if acceptor.restore():
+        # we remember every promise and accepted lease, as if we had only been paused
+        print(f"Node {id} restored acceptor state from {STATE_FILE}, active immediately.")
+    else:
+        print(f"Node {id} starting, waiting for {LEASE_SECONDS} seconds to respect PaxosLease protocol...")
+        time.sleep(LEASE_SECONDS)
+        # nothing we could have accepted before is live anymore, the next restart needn't wait
+        acceptor.save()
+        print(f"Node {id} is now active.")
+    app.run(host=host, port=port, debug=False)
@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import random
+import requests
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import start_cluster, stop_cluster, wait_ready, driver_args, node_url
+from stats import percentile
+
+# goodput under contention: 1 to 16 clients send commands to random nodes at the same time;
+# "direct" makes every node propose the commands it gets itself, so proposers duel,
+# "forward" lets nodes forward to the current leader
+# python3 bench_contention.py [n] [seconds] [--fork] [--cluster=<file>]
+
+fork, args = driver_args(sys.argv[1:])
+n = int(args[0]) if len(args) >= 1 else 3
+seconds = float(args[1]) if len(args) >= 2 else 5.0
+urls = [node_url(i, 5000+i, "localhost") for i in range(n)]
+
+def client(client_id, forward, deadline, results):
+    session = requests.Session()
+    k = 0
+    while time.time() < deadline:
+        node = random.randrange(n)
+        body = {"command": f"c{client_id}_{k} = {k}", "direct": not forward}
+        started = time.perf_counter()
+        try:
+            result = session.post(f"{urls[node]}/command", json=body, timeout=30.0).json()
+        except Exception:
+            result = {"status": "error"}
+        results.append((result.get("status"), result.get("attempts", 1), time.perf_counter() - started))
+        k += 1
+
+def run(num_clients, forward):
+    procs = start_cluster([("node.py", [i, n], i, 5000+i) for i in range(n)], fork=fork, default_host="0.0.0.0", quiet=True)
+    try:
+        wait_ready(procs, [f"{url}/current" for url in urls])
+        results = []
+        deadline = time.time() + seconds
+        threads = [threading.Thread(target=client, args=(c, forward, deadline, results)) for c in range(num_clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        ok = [r for r in results if r[0] == "success"]
+        latencies = [r[2] for r in ok] or [0.0]
+        attempts = sum(r[1] for r in ok) / max(1, len(ok))
+        print(f"{num_clients:>7} {'forward' if forward else 'direct':>8} {len(ok) / seconds:>9.1f} {len(results) - len(ok):>7}"
+              f" {attempts:>9.2f} {percentile(latencies, 50)*1000:>8.1f} {percentile(latencies, 99)*1000:>8.1f}")
+    finally:
+        stop_cluster(procs)
+
+print(f"{n} nodes, {seconds:.0f} seconds per run")
+print(f"clients     mode  goodput  failed  attempts  p50(ms)  p99(ms)")
+for num_clients in [1, 2, 4, 8, 16]:
+    for forward in [False, True]:
+        run(num_clients, forward)
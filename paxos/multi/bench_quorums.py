@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import signal
+import random
+import requests
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import start_cluster, stop_cluster, wait_ready, driver_args, node_url
+from stats import percentile
+
+# tail latency of /command with different prepare/accept quorum splits (Flexible Paxos);
+# a background thread keeps pausing one random acceptor at a time (SIGSTOP/SIGCONT) to make stragglers,
+# the phase that waits for more acceptors is the one that waits for the straggler
+# python3 bench_quorums.py [n] [num_commands] [pause_ms] [--fork] [--cluster=<file>]
+# (stragglers are paused with signals, so every node has to run on this machine)
+
+fork, args = driver_args(sys.argv[1:])
+n = int(args[0]) if len(args) >= 1 else 5
+num_commands = int(args[1]) if len(args) >= 2 else 300
+pause = (float(args[2]) if len(args) >= 3 else 20.0) / 1000
+urls = [node_url(i, 5000+i, "localhost") for i in range(n)]
+
+def stragglers(procs, stop):
+    # node 0 takes the client commands, the others take turns being slow
+    while not stop.is_set():
+        p = random.choice(procs[1:])
+        p.send_signal(signal.SIGSTOP)
+        time.sleep(pause)
+        p.send_signal(signal.SIGCONT)
+        time.sleep(pause)
+
+def run(prepare_quorum, accept_quorum):
+    procs = start_cluster([("node.py", [i, n, prepare_quorum, accept_quorum], i, 5000+i) for i in range(n)],
+                          fork=fork, default_host="0.0.0.0", quiet=True)
+    stop = threading.Event()
+    try:
+        wait_ready(procs, [f"{url}/current" for url in urls])
+        thread = threading.Thread(target=stragglers, args=(procs, stop), daemon=True)
+        thread.start()
+        # successes without phase timings: chosen in a round finished by another proposer, or run by a peer
+        totals, prepares, proposes, failed, untimed = [], [], [], 0, 0
+        for k in range(num_commands):
+            started = time.perf_counter()
+            result = requests.post(f"{urls[0]}/command", json={"command": f"x{k % 10} = {k}"}).json()
+            if result["status"] != "success":
+                failed += 1
+                continue
+            totals.append(time.perf_counter() - started)
+            if "prepare_seconds" not in result:
+                untimed += 1
+                continue
+            prepares.append(result["prepare_seconds"])
+            proposes.append(result["propose_seconds"])
+        stop.set()
+        thread.join()
+        def ms(values):
+            if not values:
+                return f"{'-':>6} / {'-':>6}"
+            return f"{percentile(values, 50)*1000:6.1f} / {percentile(values, 99)*1000:6.1f}"
+        print(f"{prepare_quorum:>7} {accept_quorum:>6}   {ms(prepares)}   {ms(proposes)}   {ms(totals)}   {failed:>6}   {untimed}")
+    finally:
+        stop.set()
+        for p in procs:
+            p.send_signal(signal.SIGCONT)
+        stop_cluster(procs)
+
+print(f"{n} nodes, {num_commands} commands, one acceptor paused {pause*1000:.0f}ms at a time")
+print(f"prepare accept   prepare p50/p99  propose p50/p99  total p50/p99    failed   untimed")
+n_majority = n // 2 + 1
+for accept_quorum in range(n_majority, 0, -1):
+    run(n + 1 - accept_quorum, accept_quorum)
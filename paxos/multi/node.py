@@ -1,11 +1,19 @@
+import os
 import sys
 import time
 import json
+import random
 import requests
 import threading
 from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import Flask, request, jsonify, Response
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address, node_url, config_value
+from faults import Faults
+from metrics import Metrics
+
 # start nodes:
 # python3 node.py 0 3
 # python3 node.py 1 3
@@ -17,24 +25,68 @@ from flask import Flask, request, jsonify, Response
 # curl -X POST http://localhost:5000/command -H "Content-Type: application/json" -d '{"command": "li += [3, 4]"}'
 # curl -X POST http://localhost:5000/command -H "Content-Type: application/json" -d '{"command": "i = 0"}'
 # curl -X POST http://localhost:5002/command -H "Content-Type: application/json" -d '{"command": "i = 42"}'
+# a node forwards commands to the node whose proposal was chosen last (the leader), node 0 until one was;
+# the leader proposes and retries with backoff until the command is chosen in some round, a node that gets
+# a forwarded command while it knows another leader answers not_leader and the forwarder follows that;
+# "direct": true makes the node propose itself whoever leads (bench_contention.py duels proposers with it)
 # curl http://localhost:5000/db
+# /status is a summary with the last few rounds, page through older ones, ?compact=1 skips pretty-printing:
+# curl "http://localhost:5000/status?last=20"
+# curl "http://localhost:5000/status?from_round=0&limit=100&compact=1"
+#
+# flexible quorums, all nodes must be started with the same ones, e.g. 5 nodes, prepare to 4, propose to 2:
+# python3 node.py 0 5 4 2
 
-if len(sys.argv) != 3:
-    print("Usage: node2.py <id> <n>")
+if len(sys.argv) not in (3, 5):
+    print("Usage: node.py <id> <n> [<prepare_quorum> <accept_quorum>]")
     sys.exit(1)
 
-node_id, n = map(int, sys.argv[1:])
-port = 5000 + node_id
-peers = [f"http://localhost:{5000 + i}" for i in range(n)]
+node_id, n = map(int, sys.argv[1:3])
+host, port = node_address(node_id, 5000 + node_id, "0.0.0.0")
+peers = [node_url(i, 5000 + i, "localhost") for i in range(n)]
+# delay/loss/partitions can be injected per link at runtime, see ../../faults.py
+faults = Faults(peers, node_id)
+# /metrics, also counts the messages /status reports, see ../../metrics.py
+metrics = Metrics(peers)
+# every outbound call goes through both
+net = metrics.client(faults)
+phase_seconds = metrics.histogram("dca_paxos_phase_seconds", "Seconds per phase of the rounds this node proposed", ("phase",))
+rounds_decided = metrics.counter("dca_paxos_rounds_decided_total", "Rounds this node learned the chosen value of")
 n_majority = n // 2 + 1
+# Flexible Paxos: prepare and propose quorums don't have to be majorities, they only have to intersect,
+# so every prepare quorum sees any value a propose quorum may have chosen;
+# from the command line, else from the cluster config, else majorities
+n_prepare_quorum, n_accept_quorum = map(int, sys.argv[3:5]) if len(sys.argv) == 5 else \
+    (config_value("prepare_quorum", n_majority), config_value("accept_quorum", n_majority))
+if not (1 <= n_prepare_quorum <= n and 1 <= n_accept_quorum <= n and n_prepare_quorum + n_accept_quorum > n):
+    print(f"Quorums don't intersect: need prepare_quorum + accept_quorum > n, "
+          f"got {n_prepare_quorum} + {n_accept_quorum} with n={n}")
+    sys.exit(1)
 # current round (next slot to propose into)
 current_round = 0
 round_lock = threading.Lock()
+# highest round a peer reported to catch-up, the learner's distance to it is the catch-up lag
+max_peer_round = 0
+# node whose proposal was chosen most recently, commands are forwarded there so proposers don't duel
+leader_hint = None
+DEFAULT_LEADER = 0 # until a round was chosen, so a fresh cluster doesn't start with every node proposing
+# one proposal at a time from this node, concurrent ones would only duel with each other
+command_lock = threading.Lock()
+# retries of a command whose round was lost to another proposer: randomized exponential backoff
+MAX_ATTEMPTS = 10
+BACKOFF_BASE = 0.01  # seconds
+BACKOFF_MAX = 0.5
+# forwarded commands may queue up behind others at the leader
+FORWARD_TIMEOUT = 10.0
 # simple per-node "database": a dict that exec commands write into
 db = {}
 db_lock = threading.Lock()
+# /db serializations that may be spoiled by concurrent commands before the last good snapshot is served
+DB_JSON_ATTEMPTS = 3
 
 app = Flask(__name__)
+faults.register(app)
+metrics.register(app)
 
 def get_current_round():
     with round_lock:
@@ -88,6 +140,12 @@ class PaxosLearner:
         self.rounds = {}  # round_id -> SimpleNamespace(chosen_value)
         self.db = db
         self.db_lock = db_lock
+        self.learned_watermark = 0   # every round below this one has been learned
+        self.max_learned = None      # highest round learned so far
+        self.db_version = 0          # commands applied to db, rounds 0..db_version-1 in order, bumped under db_lock
+        # (version, compact JSON of db) serialized by /db when it's behind db_version, learn never pays for it
+        self.db_snapshot = (0, "{}")
+        self.snapshot_lock = threading.Lock()
 
     def _get_round_state(self, round_id):
         if round_id not in self.rounds:
@@ -102,11 +160,52 @@ class PaxosLearner:
                 assert st.chosen_value == command_str
                 return True, st
             st.chosen_value = command_str
-        # apply the command to the local "database"
+            rounds_decided.inc()
+            if self.max_learned is None or round_id > self.max_learned:
+                self.max_learned = round_id
+            while self.learned_watermark in self.rounds:
+                self.learned_watermark += 1
+        self._apply()
+        return True, st
+
+    def _apply(self):
+        # apply learned commands to the local "database" in round order, so every replica runs the
+        # same sequence; rounds learned past a gap wait in self.rounds until the gap is filled
         # NOTE: this uses exec and is obviously unsafe in real life.
         with self.db_lock:
-            exec(command_str, {}, self.db)
-        return True, st
+            while self.db_version < self.learned_watermark:
+                try:
+                    exec(self.rounds[self.db_version].chosen_value, {}, self.db)
+                except Exception as e:
+                    # a command that fails, fails the same way everywhere: skip it, don't stall later rounds
+                    print(f"Round {self.db_version}: command failed: {e!r}", file=sys.stderr)
+                self.db_version += 1
+
+    def db_json(self):
+        # serialized at most once per version, by whichever reader comes first after a change (the others wait
+        # on snapshot_lock, not db_lock), and outside db_lock: only a shallow copy is taken under it. Commands
+        # mutate values in place (li += [1]), so the result only counts if no command ran meanwhile; if
+        # commands keep coming, the last consistent snapshot is served, a reader never holds up learn longer
+        # than the copy takes
+        snapshot = self.db_snapshot
+        if snapshot[0] == self.db_version:
+            return snapshot
+        with self.snapshot_lock:
+            for _ in range(DB_JSON_ATTEMPTS):
+                if self.db_snapshot[0] == self.db_version:
+                    break
+                with self.db_lock:
+                    version, db = self.db_version, dict(self.db)
+                try:
+                    text = json.dumps(db, sort_keys=True, separators=(",", ":"), default=repr)
+                except RuntimeError: # a nested dict changed size while it was serialized
+                    continue
+                with self.db_lock:
+                    # _apply holds db_lock while it runs a command, so an unchanged version means none touched db
+                    if self.db_version == version:
+                        self.db_snapshot = (version, text)
+                        break
+            return self.db_snapshot
 
 class PaxosProposer:
     def __init__(self, node_id, peers):
@@ -115,49 +214,75 @@ class PaxosProposer:
         self.peers = peers
         self.state = SimpleNamespace()
         self.state.proposal_id = self.node_id  # used to generate unique proposal IDs
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(peers))
 
     def increment_proposal_id(self):
         with self._lock:
             self.state.proposal_id += 256
+            return self.state.proposal_id
+
+    def _next_proposal_id_after(self, max_seen):
+        # the next proposal id that belongs to this node (node_id + k*256) and is strictly greater than max_seen
+        k = (max_seen - self.node_id) // 256 + 1
+        return k * 256 + self.node_id
+
+    def _catch_up(self, responses):
+        # rejections carry the acceptor's promised_n: jump past it, so the retry isn't rejected again
+        max_seen = max((r.get("acceptor_state", {}).get("promised_n") or 0 for r in responses), default=0)
+        with self._lock:
+            if max_seen >= self.state.proposal_id:
+                self.state.proposal_id = self._next_proposal_id_after(max_seen)
 
     def _http_post_json(self, url, path, payload):
         try:
-            resp = requests.post(f"{url}{path}", json=payload, timeout=1.0)
+            resp = net.post(f"{url}{path}", json=payload, timeout=1.0)
             if resp.status_code == 200:
                 return resp.json()
         except Exception:
             pass
         return None
 
-    def _send_message(self, endpoint, message):
+    def _send_message(self, endpoint, message, quorum=None):
+        # send to all peers in parallel; with a quorum, return as soon as that many
+        # succeeded, without waiting for slow peers (their replies are dropped)
+        futures = {self._executor.submit(self._http_post_json, peer, endpoint, message): peer for peer in self.peers}
         responses = []
-        for peer in self.peers:
-            data = self._http_post_json(peer, endpoint, message)
+        for future in as_completed(futures):
+            data = future.result()
             if data is not None:
-                data["node"] = peer
+                data["node"] = futures[future]
                 responses.append(data)
+                if quorum is not None and sum(1 for r in responses if r.get("success")) >= quorum:
+                    break
         return responses
 
     def _send_prepare(self, round_id, proposal_id):
-        return self._send_message("/prepare", {"round_id": round_id, "proposal_id": proposal_id})
+        return self._send_message("/prepare", {"round_id": round_id, "proposal_id": proposal_id}, n_prepare_quorum)
 
     def _send_propose(self, round_id, proposal_id, value):
-        return self._send_message("/propose", {"round_id": round_id, "proposal_id": proposal_id, "value": value})
+        return self._send_message("/propose", {"round_id": round_id, "proposal_id": proposal_id, "value": value}, n_accept_quorum)
 
-    def _broadcast_learn(self, round_id, value):
-        for peer in self.peers:
-            self._http_post_json(peer, "/learn", {"round_id": round_id, "value": value})
+    def _broadcast_learn(self, round_id, proposal_id, value):
+        # only wait for our own learner, so the command is applied here when we answer the client;
+        # other nodes learn in the background (or catch up via /fetch)
+        futures = [self._executor.submit(self._http_post_json, peer, "/learn",
+                                         {"round_id": round_id, "value": value, "proposal_id": proposal_id})
+                   for peer in self.peers]
+        futures[self.node_id].result()
 
     def paxos_round(self, round_id, initial_value):
-        self.increment_proposal_id()
-        pid = self.state.proposal_id
+        pid = self.increment_proposal_id()
         # phase 1: prepare
+        started = time.perf_counter()
         prepare_responses = self._send_prepare(round_id, pid)
+        prepare_seconds = time.perf_counter() - started
+        phase_seconds.observe(prepare_seconds, "prepare")
         promises = [r for r in prepare_responses if r.get("success")]
-        if len(promises) < n_majority:
+        if len(promises) < n_prepare_quorum:
+            self._catch_up(prepare_responses)
             return {
                 "status": "failed_prepare",
-                "reason": f"Only got {len(promises)} promises, need {n_majority}",
+                "reason": f"Only got {len(promises)} promises, need {n_prepare_quorum}",
                 "round_id": round_id,
                 "proposal_id": pid,
                 "prepare_responses": prepare_responses,
@@ -173,12 +298,16 @@ class PaxosProposer:
                 highest_accepted_n = accepted_n
                 chosen_value = accepted_value
         # phase 2: propose
+        started = time.perf_counter()
         propose_responses = self._send_propose(round_id, pid, chosen_value)
+        propose_seconds = time.perf_counter() - started
+        phase_seconds.observe(propose_seconds, "propose")
         accepts = [r for r in propose_responses if r.get("success")]
-        if len(accepts) < n_majority:
+        if len(accepts) < n_accept_quorum:
+            self._catch_up(propose_responses)
             return {
                 "status": "failed_propose",
-                "reason": f"Only got {len(accepts)} accepts, need {n_majority}",
+                "reason": f"Only got {len(accepts)} accepts, need {n_accept_quorum}",
                 "round_id": round_id,
                 "proposal_id": pid,
                 "value": chosen_value,
@@ -186,12 +315,16 @@ class PaxosProposer:
                 "propose_responses": propose_responses,
             }
         # phase 3: learn
-        self._broadcast_learn(round_id, chosen_value)
+        started = time.perf_counter()
+        self._broadcast_learn(round_id, pid, chosen_value)
+        phase_seconds.observe(time.perf_counter() - started, "learn")
         return {
             "status": "success",
             "round_id": round_id,
             "proposal_id": pid,
             "value": chosen_value,
+            "prepare_seconds": prepare_seconds,
+            "propose_seconds": propose_seconds,
             "prepare_responses": prepare_responses,
             "propose_responses": propose_responses,
         }
@@ -199,18 +332,89 @@ class PaxosProposer:
 acceptor = PaxosAcceptor()
 learner = PaxosLearner(db, db_lock)
 proposer = PaxosProposer(node_id, peers)
+metrics.gauge("dca_paxos_catchup_lag_rounds", "Rounds a peer has reached that this node hasn't learned yet",
+              lambda: max(0, max_peer_round - learner.learned_watermark))
+
+def note_leader(proposal_id):
+    # proposal ids are node_id + k*256, so the id of a chosen proposal names its proposer
+    global leader_hint
+    if proposal_id is not None:
+        leader_hint = proposal_id % 256
+
+def current_leader():
+    leader = leader_hint
+    return DEFAULT_LEADER if leader is None else leader
+
+def run_command(command):
+    # propose the command into the next free round until it is chosen; a round may be lost to
+    # another proposer's command (which we then help finish) or fail, either way back off and retry,
+    # at most MAX_ATTEMPTS proposals in all.
+    # NOTE: commands are matched by value, two clients sending the same string can't be told apart
+    attempts = 0
+    while True:
+        # held per attempt, not across the backoff, so other clients' commands get their turn meanwhile
+        with command_lock:
+            round_id = get_current_round()
+            # skip rounds we already know the outcome of; once we've proposed, a failed attempt may still
+            # have been finished by another proposer with our command, then it's chosen and mustn't run twice
+            while (st := learner.rounds.get(round_id)) is not None:
+                if attempts and st.chosen_value == command:
+                    advance_round(round_id + 1)
+                    return {"status": "success", "round_id": round_id, "value": command,
+                            "attempts": attempts, "chosen_by_peer": True}
+                round_id += 1
+            advance_round(round_id)
+            result = proposer.paxos_round(round_id, command)
+            attempts += 1
+            result["attempts"] = attempts
+            if result["status"] == "success":
+                # advance to next round once this one is chosen
+                advance_round(round_id + 1)
+                if result["value"] == command:
+                    return result
+                # somebody else's command was chosen in this round, retry in the next one
+                result = {"status": "failed_preempted",
+                          "reason": "round chosen for another command",
+                          "round_id": round_id, "value": result["value"], "attempts": attempts}
+        if attempts >= MAX_ATTEMPTS:
+            return result
+        time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts)))
 
 @app.route("/command", methods=["POST"])
 def endpoint_command():
+    global leader_hint
     data = request.get_json(force=True, silent=True) or {}
     if "command" not in data:
         return jsonify({"error": "Missing 'command' in JSON body"}), 400
-    round_id = get_current_round()
-    result = proposer.paxos_round(round_id, data["command"])
-    if result.get("status") == "success":
-        # advance to next round once this one is chosen
-        advance_round(round_id + 1)
-    return jsonify(result)
+    leader = current_leader()
+    if data.get("direct"):
+        return jsonify(run_command(data["command"]))
+    if data.get("forwarded"):
+        # only the leader proposes; a stale forwarder learns who leads instead of starting a duel
+        if leader != node_id:
+            return jsonify({"status": "not_leader", "leader": leader}), 409
+        return jsonify(run_command(data["command"]))
+    # follow not_leader answers, at most once per node: a leader change moves the command along
+    for _ in range(n):
+        if leader == node_id:
+            return jsonify(run_command(data["command"]))
+        try:
+            resp = net.post(f"{peers[leader]}/command", json={"command": data["command"], "forwarded": True},
+                                 timeout=FORWARD_TIMEOUT)
+            result = resp.json()
+        except requests.exceptions.ReadTimeout:
+            # the leader may still get the command chosen, running it here too could apply it twice
+            leader_hint = None
+            return jsonify({"status": "failed_forward", "reason": f"Leader {leader} didn't answer in time"}), 504
+        except (requests.RequestException, ValueError):
+            # leader unreachable: take over, the next chosen round names the leader everyone agrees on
+            leader_hint = node_id
+            return jsonify(run_command(data["command"]))
+        if result.get("status") != "not_leader":
+            result["forwarded_to"] = leader
+            return jsonify(result), resp.status_code
+        leader = leader_hint = result["leader"]
+    return jsonify({"status": "failed_forward", "reason": "no node took the command as leader"}), 503
 
 @app.route("/prepare", methods=["POST"])
 def endpoint_prepare():
@@ -245,6 +449,7 @@ def endpoint_learn():
     if round_id is None or "value" not in data:
         return jsonify({"error": "missing round_id or value"}), 400
     success, state = learner.learn(round_id, data["value"])
+    note_leader(data.get("proposal_id"))
     return jsonify({
         "success": success,
         "learner_state": state.__dict__,
@@ -272,60 +477,103 @@ def endpoint_fetch():
         "value": st.chosen_value,
     })
 
+STATUS_LAST_ROUNDS = 10  # rounds shown by /status unless asked otherwise
+STATUS_MAX_ROUNDS = 1000  # page size limit
+
+def json_response(payload, compact):
+    if compact:
+        return Response(json.dumps(payload, separators=(",", ":")) + "\n", mimetype="application/json")
+    return Response(
+        json.dumps(payload, indent=2, sort_keys=True) + "\n",
+        mimetype="application/json"
+    )
+
+def wants_compact():
+    return request.args.get("compact", "0") not in ("0", "false", "")
+
 @app.route("/status", methods=["GET"])
 def endpoint_status():
-    # shallow snapshot
-    with db_lock:
-        db_copy = dict(db)
+    # counts and watermarks, plus one page of rounds: the last few by default, or from_round/limit;
+    # cost depends on the page size, not on how long the history is
+    current_round = get_current_round()
+    try:
+        limit = min(int(request.args.get("limit", request.args.get("last", STATUS_LAST_ROUNDS))), STATUS_MAX_ROUNDS)
+        from_round = int(request.args.get("from_round", max(0, current_round - limit)))
+    except ValueError:
+        return jsonify({"success": False, "error": "invalid from_round, limit or last"}), 400
+    page = range(from_round, from_round + max(0, limit))
+    acceptor_state, learner_state = {}, {}
+    for rid in page:
+        st = acceptor.rounds.get(rid)
+        if st is not None:
+            acceptor_state[rid] = dict(st.__dict__)
+        st = learner.rounds.get(rid)
+        if st is not None:
+            learner_state[rid] = dict(st.__dict__)
     payload = {
         "node_id": node_id,
-        "current_round": get_current_round(),
-        "db": db_copy,
+        "quorums": {"prepare": n_prepare_quorum, "accept": n_accept_quorum},
+        "current_round": current_round,
+        "summary": {
+            "acceptor_rounds": len(acceptor.rounds),
+            "learned_rounds": len(learner.rounds),
+            "learned_watermark": learner.learned_watermark,
+            "max_learned_round": learner.max_learned,
+            "db_version": learner.db_version,
+            "messages": metrics.messages_received(),
+            "leader_hint": leader_hint,
+        },
         "proposer_state": proposer.state.__dict__,
-        "acceptor_state": {rid: st.__dict__ for rid, st in acceptor.rounds.items()},
-        "learner_state": {rid: st.__dict__ for rid, st in learner.rounds.items()},
+        "rounds": {"from_round": page.start, "limit": len(page)},
+        "acceptor_state": acceptor_state,
+        "learner_state": learner_state,
     }
-    return Response(
-        json.dumps(payload, indent=2, sort_keys=True) + "\n",
-        mimetype="application/json"
-    )
+    return json_response(payload, wants_compact())
 
 
 @app.route("/db", methods=["GET"])
 def endpoint_db():
-    # shallow snapshot
-    with db_lock:
-        db_copy = dict(db)
+    # served from the cached serialization, only serialized again after commands were applied
+    version, db_json = learner.db_json()
+    current_round = get_current_round()
+    if wants_compact():
+        return Response(
+            f'{{"current_round":{current_round},"version":{version},"db":{db_json}}}\n',
+            mimetype="application/json"
+        )
     payload = {
-        "current_round": get_current_round(),
-        "db": db_copy,
+        "current_round": current_round,
+        "version": version,
+        "db": json.loads(db_json),
     }
-    return Response(
-        json.dumps(payload, indent=2, sort_keys=True) + "\n",
-        mimetype="application/json"
-    )
+    return json_response(payload, compact=False)
 
 def try_catchup():
-    # Background loop: poll peers' /current and, if they are ahead, pull
+    # Background loop: poll peers' /current and, if they are ahead of what we learned, pull
     # missing rounds via /fetch and apply them locally via learner.learn()
+    global max_peer_round
     while True:
         time.sleep(1.0)
         local_round = get_current_round()
-        for peer in peers:
+        for i, peer in enumerate(peers):
             # don't query self
-            if peer.endswith(str(port)):
+            if i == node_id:
                 continue
             try:
-                r = requests.get(f"{peer}/current", timeout=1.0)
+                r = net.get(f"{peer}/current", timeout=1.0)
                 if r.status_code != 200:
                     continue
                 peer_round = r.json().get("round_id", 0)
             except Exception:
                 continue
-            if peer_round > local_round:
-                for rid in range(local_round, peer_round):
+            max_peer_round = max(max_peer_round, peer_round)
+            if peer_round > learner.learned_watermark:
+                # from the watermark, not our current round: a gap below it holds back every later command
+                for rid in range(learner.learned_watermark, peer_round):
+                    if rid in learner.rounds:
+                        continue
                     try:
-                        resp = requests.get(f"{peer}/fetch", params={"round_id": rid}, timeout=1.0)
+                        resp = net.get(f"{peer}/fetch", params={"round_id": rid}, timeout=1.0)
                         if resp.status_code != 200:
                             continue
                         data = resp.json()
@@ -335,11 +583,12 @@ def try_catchup():
                         learner.learn(rid, value)
                     except Exception:
                         continue
-                advance_round(peer_round)
-                local_round = peer_round
+                if peer_round > local_round:
+                    advance_round(peer_round)
+                    local_round = peer_round
 
 if __name__ == "__main__":
     # start background sync thread
     t = threading.Thread(target=try_catchup, daemon=True)
     t.start()
-    app.run(host="0.0.0.0", port=port, debug=False)
+    app.run(host=host, port=port, debug=False)
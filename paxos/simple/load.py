@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import random
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import start_cluster, stop_cluster, wait_ready, driver_args, node_url
+from stats import percentile
+
+# starts a local cluster and drives many independent paxos instances through it concurrently;
+# a fraction of instances get a second, competing /start on another node with a different value,
+# afterwards every node is asked what it learned and the answers must agree
+# python3 load.py [n] [num_instances] [concurrency] [conflict_fraction] [--fork] [--cluster=<file>]
+
+fork, args = driver_args(sys.argv[1:])
+n = int(args[0]) if len(args) >= 1 else 3
+num_instances = int(args[1]) if len(args) >= 2 else 2000
+concurrency = int(args[2]) if len(args) >= 3 else 32
+conflict_fraction = float(args[3]) if len(args) >= 4 else 0.1
+urls = [node_url(i, 5000+i, "localhost") for i in range(n)]
+
+session = requests.Session()
+session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+def start(node, instance_id, value):
+    started = time.perf_counter()
+    try:
+        r = session.post(f"{urls[node]}/start", json={"instance_id": instance_id, "value": value}, timeout=10.0)
+        status = r.json()["status"]
+    except Exception:
+        status = "error"
+    return status, time.perf_counter() - started
+
+def chosen_values(instance_id):
+    return [session.get(f"{url}/instance", params={"instance_id": instance_id}).json()["chosen_value"] for url in urls]
+
+procs = start_cluster([("node.py", [i, n], i, 5000+i) for i in range(n)], fork=fork, default_host="0.0.0.0", quiet=True)
+try:
+    wait_ready(procs, [f"{url}/status" for url in urls])
+    jobs = []
+    for k in range(num_instances):
+        instance_id = f"load-{k}"
+        node = random.randrange(n)
+        jobs.append((node, instance_id, f"value-{k}-a"))
+        if random.random() < conflict_fraction:
+            jobs.append(((node + 1) % n, instance_id, f"value-{k}-b"))
+    random.shuffle(jobs)
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda job: start(*job), jobs))
+    wall = time.perf_counter() - wall_started
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = [latency for status, latency in results if status == "success"]
+    # every node that learned a value for an instance must have learned the same one
+    disagreements = 0
+    for k in random.sample(range(num_instances), min(num_instances, 200)):
+        values = {v for v in chosen_values(f"load-{k}") if v is not None}
+        disagreements += len(values) > 1
+    node_status = session.get(f"{urls[0]}/status").json()
+    print(f"Nodes:               {n}")
+    print(f"Instances:           {num_instances} ({len(jobs) - num_instances} competing starts)")
+    print(f"Concurrency:         {concurrency}")
+    print(f"Results:             {', '.join(f'{k}={v}' for k, v in sorted(statuses.items()))}")
+    print(f"Throughput:          {len(jobs) / wall:,.0f} starts/s")
+    if latencies:
+        print(f"Latency:             p50={percentile(latencies, 50)*1000:.1f}ms p99={percentile(latencies, 99)*1000:.1f}ms")
+    print(f"Disagreements:       {disagreements} (of 200 sampled instances)")
+    print(f"Node 0 instances:    {node_status['undecided_instances']} undecided, "
+          f"{node_status['decided_instances']} decided, {node_status['evicted_instances']} evicted")
+finally:
+    stop_cluster(procs)
@@ -1,69 +1,179 @@
+import os
+import re
 import sys
 import json
-import requests
+import time
 import threading
 from types import SimpleNamespace
 from flask import Flask, request, jsonify, Response
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from cluster import node_address, node_url
+from metrics import Metrics
+
 # start nodes:
 # python3 node.py 0 3
 # python3 node.py 1 3
 # python3 node.py 2 3
 # kick off a round of paxos:
 # curl -X POST http://localhost:5000/start -H "Content-Type: application/json" -d '{"value": "foo"}'
+# every instance_id is an independent round of paxos (without one, the "default" instance is used):
+# curl -X POST http://localhost:5000/start -H "Content-Type: application/json" -d '{"instance_id": "42", "value": "bar"}'
+# curl http://localhost:5000/instance?instance_id=42
 
 if len(sys.argv) != 3:
     print("Usage: node.py <id> <n>")
     sys.exit(1)
 
 id, n = map(int, sys.argv[1:])
-port = 5000 + id
-peers = [f"http://localhost:{5000+i}" for i in range(n)]
+host, port = node_address(id, 5000 + id, "0.0.0.0")
+peers = [node_url(i, 5000+i, "localhost") for i in range(n)]
+# /metrics, see ../../metrics.py; every outbound call goes through net
+metrics = Metrics(peers)
+net = metrics.client()
+phase_seconds = metrics.histogram("dca_paxos_phase_seconds", "Seconds per phase of the rounds this node proposed", ("phase",))
+rounds_decided = metrics.counter("dca_paxos_rounds_decided_total", "Instances this node learned the chosen value of")
 n_majority = n//2 + 1
+# instance used by requests that don't name one
+DEFAULT_INSTANCE = "default"
+# chosen values remembered per node, older ones are evicted first; an evicted id is remembered without
+# its value (see EvictedIds) and refused from then on, a fresh round could choose a different value
+MAX_DECIDED = 10000
 
 app = Flask(__name__)
+metrics.register(app)
 
-class PaxosAcceptor:
+# per-instance state, __slots__ keep thousands of live instances small
+
+class AcceptorInstance:
+    __slots__ = ("promised_n", "accepted_n", "accepted_value")
+
+    def __init__(self):
+        self.promised_n = None
+        self.accepted_n = None
+        self.accepted_value = None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+# stands in for the chosen value of an instance that was decided and evicted
+EVICTED = object()
+
+class EvictedIds:
+    # tombstones of evicted instance ids; ids that end in a number ("load-17", "42") collapse into a low
+    # watermark per prefix once every number below it was evicted, so sequential ids take constant space
+    def __init__(self):
+        self.watermarks = {}      # prefix -> every "<prefix><number>" below it is evicted
+        self.ids = set()          # evicted ids above their prefix's watermark, or without a number
+
+    def _split(self, instance_id):
+        # no leading zeros, so "<prefix><number>" maps back to exactly this id
+        m = re.fullmatch(r"(.*?)(0|[1-9][0-9]*)", instance_id)
+        return (m.group(1), int(m.group(2))) if m else (None, None)
+
+    def add(self, instance_id):
+        prefix, number = self._split(instance_id)
+        if prefix is not None and number < self.watermarks.get(prefix, 0):
+            return
+        self.ids.add(instance_id)
+        if prefix is None:
+            return
+        watermark = self.watermarks.get(prefix, 0)
+        while f"{prefix}{watermark}" in self.ids:
+            self.ids.remove(f"{prefix}{watermark}")
+            watermark += 1
+        if watermark:
+            self.watermarks[prefix] = watermark
+
+    def __contains__(self, instance_id):
+        prefix, number = self._split(instance_id)
+        if prefix is not None and number < self.watermarks.get(prefix, 0):
+            return True
+        return instance_id in self.ids
+
+class PaxosLearner:
     def __init__(self):
         self._lock = threading.Lock()
-        self.state = SimpleNamespace()
-        self.state.promised_n = None
-        self.state.accepted_n = None
-        self.state.accepted_value = None
+        self.chosen = {}          # instance_id -> chosen value, in the order they were decided
+        self.evicted = EvictedIds()
+        self.num_evicted = 0
+
+    def chosen_value(self, instance_id):
+        # None if undecided, EVICTED if decided so long ago that the value is gone
+        with self._lock:
+            value = self.chosen.get(instance_id)
+            if value is None and instance_id in self.evicted:
+                return EVICTED
+            return value
 
-    def on_prepare(self, proposal_id):
+    def learn(self, instance_id, value):
         with self._lock:
-            if self.state.promised_n is None or proposal_id > self.state.promised_n:
-                self.state.promised_n = proposal_id
+            # a late learn of an evicted instance: its value can't be checked any more, and it stays evicted
+            if instance_id in self.evicted:
+                return True
+            # in Paxos, the learner should never get two different chosen values
+            if instance_id in self.chosen:
+                assert(self.chosen[instance_id] == value)
+                return True
+            self.chosen[instance_id] = value
+            rounds_decided.inc()
+            if len(self.chosen) > MAX_DECIDED:
+                oldest = next(iter(self.chosen))
+                self.evicted.add(oldest)
+                del self.chosen[oldest]
+                self.num_evicted += 1
+        # the acceptor state of a decided instance is no longer needed, the chosen value answers for it
+        acceptor.forget(instance_id)
+        return True
+
+class PaxosAcceptor:
+    def __init__(self, learner):
+        self._lock = threading.Lock()
+        self.learner = learner
+        self.instances = {}       # instance_id -> AcceptorInstance, only undecided ones
+
+    def _get_instance(self, instance_id):
+        st = self.instances.get(instance_id)
+        if st is None:
+            st = self.instances[instance_id] = AcceptorInstance()
+        return st
+
+    def forget(self, instance_id):
+        with self._lock:
+            self.instances.pop(instance_id, None)
+
+    def on_prepare(self, instance_id, proposal_id):
+        # returns (success, state dict, chosen value if this instance is already decided here);
+        # the learner is checked under our lock, so forget() can't run between the check and _get_instance()
+        with self._lock:
+            chosen_value = self.learner.chosen_value(instance_id)
+            if chosen_value is not None:
+                return False, None, chosen_value
+            st = self._get_instance(instance_id)
+            if st.promised_n is None or proposal_id > st.promised_n:
+                st.promised_n = proposal_id
                 success = True
             else:
                 success = False
-            return success, self.state
+            return success, st.to_dict(), None
 
-    def on_propose(self, proposal_id, value):
+    def on_propose(self, instance_id, proposal_id, value):
         with self._lock:
-            if self.state.promised_n is None or proposal_id >= self.state.promised_n:
-                self.state.promised_n = proposal_id
-                self.state.accepted_n = proposal_id
-                self.state.accepted_value = value
+            chosen_value = self.learner.chosen_value(instance_id)
+            if chosen_value is EVICTED:
+                return False, None, chosen_value
+            if chosen_value is not None:
+                # proposing the chosen value again is harmless, anything else must be refused
+                return chosen_value == value, None, chosen_value
+            st = self._get_instance(instance_id)
+            if st.promised_n is None or proposal_id >= st.promised_n:
+                st.promised_n = proposal_id
+                st.accepted_n = proposal_id
+                st.accepted_value = value
                 success = True
             else:
                 success = False
-            return success, self.state
-
-class PaxosLearner:
-    def __init__(self):
-        self._lock = threading.Lock()
-        self.state = SimpleNamespace()
-        self.state.chosen_value = None
-
-    def learn(self, value):
-        with self._lock:
-            # in Paxos, the learner should never get two different chosen values
-            if self.state.chosen_value is not None:
-                assert(self.state.chosen_value == value)
-            self.state.chosen_value = value
-            return True, self.state
+            return success, st.to_dict(), None
 
 class PaxosProposer:
     def __init__(self, node_id, peers):
@@ -74,12 +184,14 @@ class PaxosProposer:
         self.state.proposal_id = self.node_id # used to generate unique proposal IDs
 
     def increment_proposal_id(self):
+        # one counter for all instances; returns the new id, concurrent rounds must not share one
         with self._lock:
             self.state.proposal_id += 256
+            return self.state.proposal_id
 
     def _http_post_json(self, url, path, payload):
         try:
-            resp = requests.post(f"{url}{path}", json=payload, timeout=1.0)
+            resp = net.post(f"{url}{path}", json=payload, timeout=1.0)
             if resp.status_code == 200:
                 return resp.json()
         except Exception:
@@ -95,26 +207,53 @@ class PaxosProposer:
                 responses.append(data)
         return responses
 
-    def _send_prepare(self, proposal_id):
-        return self._send_message("/prepare", {"proposal_id": proposal_id})
+    def _send_prepare(self, instance_id, proposal_id):
+        return self._send_message("/prepare", {"instance_id": instance_id, "proposal_id": proposal_id})
 
-    def _send_propose(self, proposal_id, value):
-        return self._send_message("/propose", {"proposal_id": proposal_id, "value": value})
+    def _send_propose(self, instance_id, proposal_id, value):
+        return self._send_message("/propose", {"instance_id": instance_id, "proposal_id": proposal_id, "value": value})
 
-    def _broadcast_learn(self, value):
+    def _broadcast_learn(self, instance_id, value):
         for peer in self.peers:
-            self._http_post_json(peer, "/learn", {"value": value})
+            self._http_post_json(peer, "/learn", {"instance_id": instance_id, "value": value})
+
+    def _decided(self, instance_id, proposal_id, responses):
+        # an acceptor that already learned the outcome tells us, no need to run the round
+        for r in responses:
+            if r.get("evicted"):
+                return {
+                    "status": "evicted",
+                    "reason": "instance was decided and its value evicted, the id can't be used again",
+                    "instance_id": instance_id,
+                    "proposal_id": proposal_id,
+                }
+            if r.get("decided"):
+                learner.learn(instance_id, r["chosen_value"])
+                return {
+                    "status": "success",
+                    "instance_id": instance_id,
+                    "proposal_id": proposal_id,
+                    "value": r["chosen_value"],
+                    "already_decided": True,
+                }
+        return None
 
-    def paxos_round(self, initial_value):
-        self.increment_proposal_id()
+    def paxos_round(self, instance_id, initial_value):
+        proposal_id = self.increment_proposal_id()
         # phase 1: prepare
-        prepare_responses = self._send_prepare(self.state.proposal_id)
+        started = time.perf_counter()
+        prepare_responses = self._send_prepare(instance_id, proposal_id)
+        phase_seconds.observe(time.perf_counter() - started, "prepare")
+        decided = self._decided(instance_id, proposal_id, prepare_responses)
+        if decided is not None:
+            return decided
         promises = [r for r in prepare_responses if r.get("success")]
         if len(promises) < n_majority:
             return {
                 "status": "failed_prepare",
                 "reason": f"Only got {len(promises)} promises, need {n_majority}",
-                "proposal_id": self.state.proposal_id,
+                "instance_id": instance_id,
+                "proposal_id": proposal_id,
                 "prepare_responses": prepare_responses,
             }
         # if any acceptor already accepted a value, choose the one with the highest accepted_n
@@ -127,37 +266,57 @@ class PaxosProposer:
                 highest_accepted_n = accepted_n
                 chosen_value = accepted_value
         # phase 2: propose
-        propose_responses = self._send_propose(self.state.proposal_id, chosen_value)
+        started = time.perf_counter()
+        propose_responses = self._send_propose(instance_id, proposal_id, chosen_value)
+        phase_seconds.observe(time.perf_counter() - started, "propose")
         accepts = [r for r in propose_responses if r.get("success")]
         if len(accepts) < n_majority:
+            decided = self._decided(instance_id, proposal_id, propose_responses)
+            if decided is not None:
+                return decided
             return {
                 "status": "failed_propose",
                 "reason": f"Only got {len(accepts)} accepts, need {n_majority}",
-                "proposal_id": self.state.proposal_id,
+                "instance_id": instance_id,
+                "proposal_id": proposal_id,
                 "value": chosen_value,
                 "prepare_responses": prepare_responses,
                 "propose_responses": propose_responses,
             }
         # phase 3: learn
-        self._broadcast_learn(chosen_value)
+        started = time.perf_counter()
+        self._broadcast_learn(instance_id, chosen_value)
+        phase_seconds.observe(time.perf_counter() - started, "learn")
         return {
             "status": "success",
-            "proposal_id": self.state.proposal_id,
+            "instance_id": instance_id,
+            "proposal_id": proposal_id,
             "value": chosen_value,
             "prepare_responses": prepare_responses,
             "propose_responses": propose_responses,
         }
 
-acceptor = PaxosAcceptor()
 learner = PaxosLearner()
+acceptor = PaxosAcceptor(learner)
 proposer = PaxosProposer(id, peers)
 
+def requested_instance(data):
+    # JSON bodies and query strings may carry ints or strings, both name the same instance
+    return str(data.get("instance_id", DEFAULT_INSTANCE))
+
+def acceptor_response(success, state, chosen_value):
+    if chosen_value is EVICTED:
+        return jsonify({"success": False, "decided": True, "evicted": True})
+    if chosen_value is not None:
+        return jsonify({"success": success, "decided": True, "chosen_value": chosen_value})
+    return jsonify({"success": success, "acceptor_state": state})
+
 @app.route("/start", methods=["POST"])
 def start():
     data = request.get_json(force=True, silent=True) or {}
     if "value" not in data:
         return jsonify({"error": "Missing 'value' in JSON body"}), 400
-    result = proposer.paxos_round(data["value"])
+    result = proposer.paxos_round(requested_instance(data), data["value"])
     return jsonify(result)
 
 @app.route("/prepare", methods=["POST"])
@@ -166,11 +325,7 @@ def prepare():
     proposal_id = data.get("proposal_id")
     if proposal_id is None:
         return jsonify({"ok": False, "error": "missing proposal_id"}), 400
-    success, state = acceptor.on_prepare(proposal_id)
-    return jsonify({
-        "success": success,
-        "acceptor_state": state.__dict__,
-    })
+    return acceptor_response(*acceptor.on_prepare(requested_instance(data), proposal_id))
 
 @app.route("/propose", methods=["POST"])
 def propose():
@@ -178,34 +333,42 @@ def propose():
     proposal_id = data.get("proposal_id")
     if proposal_id is None or "value" not in data:
         return jsonify({"ok": False, "error": "missing proposal_id or value"}), 400
-    success, state = acceptor.on_propose(proposal_id, data["value"])
-    return jsonify({
-        "success": success,
-        "acceptor_state": state.__dict__,
-    })
+    return acceptor_response(*acceptor.on_propose(requested_instance(data), proposal_id, data["value"]))
 
 @app.route("/learn", methods=["POST"])
 def learn():
     data = request.get_json(force=True, silent=True) or {}
     if "value" not in data:
         return jsonify({"error": "missing value"}), 400
-    success, state = learner.learn(data["value"])
+    success = learner.learn(requested_instance(data), data["value"])
+    return jsonify({"success": success})
+
+@app.route("/instance", methods=["GET"])
+def instance():
+    instance_id = requested_instance(request.args)
+    st = acceptor.instances.get(instance_id)
+    chosen_value = learner.chosen_value(instance_id)
     return jsonify({
-        "success": success,
-        "learner_state": state.__dict__,
+        "instance_id": instance_id,
+        "acceptor_state": st.to_dict() if st is not None else None,
+        "chosen_value": None if chosen_value is EVICTED else chosen_value,
+        "evicted": chosen_value is EVICTED,
     })
 
 @app.route("/status", methods=["GET"])
 def status():
+    # counts only, a node may be tracking thousands of instances
     payload = {
         "node_id": id,
         "proposer_state": proposer.state.__dict__,
-        "acceptor_state": acceptor.state.__dict__,
-        "learner_state": learner.state.__dict__,
+        "undecided_instances": len(acceptor.instances),
+        "decided_instances": len(learner.chosen),
+        "evicted_instances": learner.num_evicted,
     }
     return Response(
         json.dumps(payload, indent=2, sort_keys=True) + "\n",
         mimetype="application/json"
+    )
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=port, debug=False)
+    app.run(host=host, port=port, debug=False)
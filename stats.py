@@ -0,0 +1,10 @@
+# summary statistics shared by the benchmark scripts
+#
+# usage, after putting the repository root on sys.path:
+#   from stats import percentile
+#   print(f"p50={percentile(latencies, 50)*1000:.1f}ms p99={percentile(latencies, 99)*1000:.1f}ms")
+
+def percentile(values, p):
+    # nearest-rank on a sorted copy, values must not be empty
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
@@ -0,0 +1,106 @@
+import sys
+import time
+import heapq
+import itertools
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# one scheduler thread backed by a heap of deadlines, instead of a threading.Timer
+# (and so a new OS thread) for every lease expiry and extension
+#
+# usage in a node, see paxos/lease and paxos/lease-extend:
+#   scheduler = TimerScheduler()
+#   timer = scheduler.call_later(5.0, on_timeout)               # runs on the scheduler thread
+#   scheduler.call_later(2.5, extend_lease, background=True)   # may block, runs on a worker thread
+#   timer.cancel()
+# a callback that raises is reported on stderr with its traceback, the other timers keep running
+
+class Timer:
+    __slots__ = ("deadline", "func", "background", "cancelled", "_scheduler")
+
+    def __init__(self, scheduler, deadline, func, background):
+        self._scheduler = scheduler
+        self.deadline = deadline
+        self.func = func
+        self.background = background
+        self.cancelled = False
+
+    def cancel(self):
+        self._scheduler._cancel(self)
+
+class TimerScheduler:
+    def __init__(self, background_workers=4):
+        self._cond = threading.Condition()
+        self._heap = []                 # (deadline, seq, Timer), cancelled timers are removed lazily
+        self._seq = itertools.count()   # tie-breaker for equal deadlines
+        self._num_cancelled = 0
+        self._thread = None
+        self._background_workers = background_workers
+        self._executor = None
+
+    def call_later(self, delay, func, background=False):
+        # quick callbacks run on the scheduler thread; anything that may block
+        # (e.g. network calls) must pass background=True so it can't delay other timers
+        timer = Timer(self, time.monotonic() + delay, func, background)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (timer.deadline, next(self._seq), timer))
+            if self._heap[0][2] is timer:
+                self._cond.notify()
+        return timer
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap) - self._num_cancelled
+
+    def _cancel(self, timer):
+        with self._cond:
+            if timer.cancelled:
+                return
+            timer.cancelled = True
+            self._num_cancelled += 1
+            # rebuild the heap once it is mostly cancelled timers
+            if self._num_cancelled > 64 and self._num_cancelled > len(self._heap) // 2:
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._num_cancelled = 0
+
+    def _pop_due(self):
+        # blocks until the earliest live timer is due and returns it
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                    self._num_cancelled -= 1
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                remaining = self._heap[0][0] - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                _, _, timer = heapq.heappop(self._heap)
+                timer.cancelled = True # fired timers can't be cancelled anymore
+                return timer
+
+    def _fire(self, timer):
+        try:
+            timer.func()
+        except Exception:
+            # background callbacks would otherwise end up in a future nobody looks at
+            print(f"Timer callback {timer.func} failed:", file=sys.stderr)
+            traceback.print_exc()
+
+    def _run(self):
+        while True:
+            timer = self._pop_due()
+            # callbacks run outside the scheduler lock, they may take their own locks and set new timers
+            if timer.background:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._background_workers)
+                self._executor.submit(self._fire, timer)
+            else:
+                self._fire(timer)